@@ -17,6 +17,11 @@ from api.routers import spaceos as spaceos_routes
 from api.dependencies import get_current_user, get_client, OptionalUser
 from api.presence_proxy import start_proxy, stop_proxy
 from api.assets import asset_resolver
+from api.ably_publisher import ably_publisher
+from api.command_outbox import command_dispatcher
+from api.metrics import metrics
+from api.ota_rollout import ota_rollout
+from api.space_pack import space_pack_encoder
 
 load_dotenv()
 
@@ -40,35 +45,31 @@ async def lifespan(app: FastAPI):
     import asyncio
 
     proxy_task = asyncio.create_task(start_proxy(lambda: base_client))
+    outbox_task = asyncio.create_task(command_dispatcher.run(lambda: base_client))
 
-    # Notify online boards that a new SpaceOS version may be available.
-    # Boards that receive this reboot immediately so main.py can check for updates.
-    from api.routers.spaceos import load_bundle
-    bundle = load_bundle()
-    if bundle:
-        try:
-            from ably import AblyRest
-            ably_key = os.getenv("ABLY_API_KEY", "")
-            if ably_key:
-                ably = AblyRest(ably_key)
-                channel = ably.channels.get("spaceos:system")
-                await channel.publish("os_update", {"type": "os_update"})
-                logger.info(
-                    f"Published os_update to spaceos:system "
-                    f"(hash={bundle[1][:16]}...)"
-                )
-        except Exception as e:
-            logger.warning(f"Failed to publish OTA startup notification: {e}")
+    # Release any new SpaceOS bundle in waves rather than rebooting every
+    # online board at once (see api/ota_rollout.py).
+    from api.routers.spaceos import get_bundle_hash
+    rollout_task = asyncio.create_task(
+        ota_rollout.run(lambda: base_client, get_bundle_hash())
+    )
 
     yield
 
     # Shutdown
     stop_proxy()
+    command_dispatcher.stop()
+    ota_rollout.stop()
+    space_pack_encoder.shutdown()
     proxy_task.cancel()
-    try:
-        await proxy_task
-    except asyncio.CancelledError:
-        pass
+    outbox_task.cancel()
+    rollout_task.cancel()
+    for task in (proxy_task, outbox_task, rollout_task):
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await ably_publisher.close()
     await base_client.aclose()
 
 
@@ -219,6 +220,19 @@ async def apple_touch_icon_precomposed():
     return FileResponse(path, media_type="image/png")
 
 
+@app.get("/metrics")
+async def metrics_snapshot(request: Request):
+    """
+    In-process metrics for this worker as JSON. Requires
+    `Authorization: Bearer $METRICS_TOKEN`; disabled when METRICS_TOKEN is unset.
+    """
+    token = os.getenv("METRICS_TOKEN", "")
+    provided = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not token or not secrets.compare_digest(provided, token):
+        raise HTTPException(status_code=404)
+    return metrics.snapshot()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     context = get_template_context(request)
@@ -0,0 +1,306 @@
+"""
+api/board_auth.py — Board authentication and short-lived board session tokens.
+
+Boards prove their identity with the raw secret key from secrets.py, which is
+checked against the scrypt hash stored on the Board row. scrypt is deliberately
+slow (tens of ms of CPU), so paying it on every Space Pack download, sync and
+heartbeat adds up. Instead a board calls the session handshake once:
+
+    POST /app/boards/{board_id}/session   (X-Board-Secret)
+      -> {"token": "...", "expires_in": 900}
+
+and sends `X-Board-Token` on later requests. The token is an HMAC-SHA256
+signed, expiring claim of the board's identity, so validating it needs no
+Gel round trip and no scrypt. Endpoints keep accepting X-Board-Secret for
+older firmware. The signing key, BOARD_TOKEN_SECRET, must be shared by every
+worker; in production and staging the API refuses to start without it.
+
+Tokens are not revoked when a board's secret is regenerated; they simply
+expire after BOARD_TOKEN_TTL_SECONDS. The OTA routes do not trust the
+token's "ota" claim for that long: ota_updates_allowed() re-reads the flag
+through board_row_cache, so turning OTA off or deleting the board takes
+effect within BOARD_CACHE_TTL_SECONDS (at once on the worker that made the
+change).
+
+board_row_cache is a per-process TTL cache of Board rows keyed by board id,
+together with a memo of the secret each row last verified. A secret check
+served from a live cached row whose memo matches needs no Gel round trip and
+no scrypt. A miss, or a secret the memo does not know, re-reads the row from
+Gel and runs scrypt against it, so a secret rotated on another worker is
+accepted at once. Routes that change a board's secret, owner or OTA flag, or
+delete it, call invalidate_board(), which drops the row and its memo on that
+worker straight away; other workers stop accepting a rotated-away secret
+once their entry expires after BOARD_CACHE_TTL_SECONDS.
+"""
+import base64
+import dataclasses
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from werkzeug.security import check_password_hash
+
+import api.queries as q
+from api.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+BOARD_TOKEN_TTL_SECONDS = int(os.getenv("BOARD_TOKEN_TTL_SECONDS", "900"))
+BOARD_CACHE_TTL_SECONDS = int(os.getenv("BOARD_CACHE_TTL_SECONDS", "300"))
+
+_token_secret = os.getenv("BOARD_TOKEN_SECRET", "").encode("utf-8")
+if not _token_secret:
+    # A per-process key only validates tokens on the worker that issued
+    # them, so every other worker would 401 and force a scrypt handshake.
+    if os.getenv("ENVIRONMENT", "development").strip().lower() in {"production", "staging"}:
+        raise RuntimeError("BOARD_TOKEN_SECRET must be set (shared by every API worker)")
+    logger.warning("BOARD_TOKEN_SECRET not set — using a per-process token key (development only)")
+    _token_secret = secrets.token_bytes(32)
+
+
+@dataclasses.dataclass
+class BoardIdentity:
+    """The board facts every board-facing endpoint needs."""
+
+    board_id: str
+    owner_id: str
+    board_type: str
+    ota_updates_enabled: bool
+
+
+class BoardRowCache:
+    """
+    TTL cache of selectBoardBySecretKey rows, keyed by board id.
+
+    Only found rows are cached, so a board registered moments ago is never
+    locked out by a stale miss. Alongside the rows it remembers, per board,
+    the stored secret hash a presented secret last verified against, so a
+    repeat check against an unchanged hash can skip scrypt. Metrics:
+    board_auth.cache_hit, board_auth.cache_miss, board_auth.cache_invalidate,
+    board_auth.secret_memo_hit.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, object]] = {}
+        self._verified: Dict[str, Tuple[str, bytes]] = {}
+        self._lock = Lock()
+
+    def get(self, board_id: str):
+        with self._lock:
+            entry = self._entries.get(board_id)
+            if entry is not None and entry[0] > time.monotonic():
+                metrics.incr("board_auth.cache_hit")
+                return entry[1]
+            if entry is not None:
+                del self._entries[board_id]
+        metrics.incr("board_auth.cache_miss")
+        return None
+
+    def put(self, board_id: str, row) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[board_id] = (time.monotonic() + self.ttl_seconds, row)
+            metrics.gauge("board_auth.cache_size", len(self._entries))
+
+    def invalidate(self, board_id: str) -> None:
+        with self._lock:
+            self._verified.pop(board_id, None)
+            if self._entries.pop(board_id, None) is not None:
+                metrics.gauge("board_auth.cache_size", len(self._entries))
+        metrics.incr("board_auth.cache_invalidate")
+
+    def secret_verified(self, board_id: str, secret_key_hash: str, secret: str) -> bool:
+        """Whether secret already verified against this exact stored hash."""
+        with self._lock:
+            verified = self._verified.get(board_id)
+        if verified is None or verified[0] != secret_key_hash:
+            return False
+        if not hmac.compare_digest(verified[1], hashlib.sha256(secret.encode("utf-8")).digest()):
+            return False
+        metrics.incr("board_auth.secret_memo_hit")
+        return True
+
+    def remember_secret(self, board_id: str, secret_key_hash: str, secret: str) -> None:
+        with self._lock:
+            self._verified[board_id] = (
+                secret_key_hash,
+                hashlib.sha256(secret.encode("utf-8")).digest(),
+            )
+
+
+board_row_cache = BoardRowCache(BOARD_CACHE_TTL_SECONDS)
+
+
+def invalidate_board(board_id) -> None:
+    """Drop any cached row for board_id after its secret, owner or OTA flag changes."""
+    try:
+        board_row_cache.invalidate(str(UUID(str(board_id))))
+    except ValueError:
+        pass
+
+
+async def _load_board_row(request: Request, board_id: str, fresh: bool = False):
+    """
+    Return the Board row for board_id from the cache or Gel, or None.
+    fresh=True skips the cached row and refreshes it from Gel.
+    """
+    try:
+        board_id = str(UUID(str(board_id)))
+    except ValueError:
+        return None
+
+    if not fresh:
+        board = board_row_cache.get(board_id)
+        if board is not None:
+            return board
+
+    base_client = request.app.state.get_base_client()
+    try:
+        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(board_id))
+    except Exception:
+        return None
+
+    if board is not None:
+        board_row_cache.put(board_id, board)
+    return board
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_token_secret, payload.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+def issue_board_token(identity: BoardIdentity) -> str:
+    """Return a signed token for identity, valid for BOARD_TOKEN_TTL_SECONDS."""
+    claims = {
+        "b": identity.board_id,
+        "o": identity.owner_id,
+        "t": identity.board_type,
+        "ota": identity.ota_updates_enabled,
+        "exp": int(time.time()) + BOARD_TOKEN_TTL_SECONDS,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_board_token(token: str) -> Optional[BoardIdentity]:
+    """Return the identity in token, or None if it is malformed, forged or expired."""
+    try:
+        payload, signature = token.split(".", 1)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+
+    if claims.get("exp", 0) < time.time():
+        return None
+
+    return BoardIdentity(
+        board_id=claims["b"],
+        owner_id=claims["o"],
+        board_type=claims["t"],
+        ota_updates_enabled=claims.get("ota", True),
+    )
+
+
+async def ota_updates_allowed(request: Request, board: BoardIdentity) -> bool:
+    """Whether board may receive OTA updates now, from its row rather than its token."""
+    row = await _load_board_row(request, board.board_id)
+    if row is None:
+        return False
+    enabled = getattr(row, "ota_updates_enabled", True)
+    return True if enabled is None else enabled
+
+
+async def check_board_secret(
+    request: Request, board_id: str, secret: str
+) -> BoardIdentity:
+    """
+    Verify a board's raw secret against its stored scrypt hash.
+    Raises 403 if the board is unknown, unregistered or the secret is wrong.
+
+    A cached row whose memo already holds this secret is trusted as is. On
+    a cache miss or a memo mismatch the row is re-read from Gel and the
+    secret goes through scrypt, then the memo is updated.
+    """
+    try:
+        board = board_row_cache.get(str(UUID(str(board_id))))
+    except ValueError:
+        board = None
+    if board is None or not board.secret_key_hash or not board_row_cache.secret_verified(
+        str(board.id), board.secret_key_hash, secret
+    ):
+        board = await _load_board_row(request, board_id, fresh=True)
+        if not board or not board.secret_key_hash:
+            raise HTTPException(status_code=403, detail="Invalid board")
+
+        row_id = str(board.id)
+        if not board_row_cache.secret_verified(row_id, board.secret_key_hash, secret):
+            if not check_password_hash(board.secret_key_hash, secret):
+                raise HTTPException(status_code=403, detail="Invalid secret key")
+            board_row_cache.remember_secret(row_id, board.secret_key_hash, secret)
+
+    board_type = board.boardType.value if hasattr(board.boardType, "value") else str(board.boardType)
+    ota_enabled = getattr(board, "ota_updates_enabled", True)
+    return BoardIdentity(
+        board_id=str(board.id),
+        owner_id=str(board.owner_id),
+        board_type=board_type,
+        ota_updates_enabled=True if ota_enabled is None else ota_enabled,
+    )
+
+
+async def authenticate_board(
+    request: Request,
+    board_id: Optional[str],
+    secret: Optional[str] = None,
+    token: Optional[str] = None,
+) -> BoardIdentity:
+    """
+    Authenticate a board-facing request by session token or raw secret.
+
+    A token is preferred; an invalid or expired token is rejected with 401
+    (so the board knows to re-run the handshake) rather than falling back
+    to the secret. Raises 401 if no credentials were sent.
+    """
+    if not board_id or not (token or secret):
+        raise HTTPException(status_code=401, detail="Missing board credentials")
+
+    try:
+        board_id = str(UUID(str(board_id)))
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid board")
+
+    if token:
+        identity = verify_board_token(token)
+        if identity is None or identity.board_id != board_id:
+            raise HTTPException(status_code=401, detail="Invalid or expired board token")
+        return identity
+
+    return await check_board_secret(request, board_id, secret)
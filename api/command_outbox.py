@@ -0,0 +1,180 @@
+"""
+api/command_outbox.py — Transactional outbox for Ably command envelopes.
+
+Handlers write command envelopes (build_message_sync, build_set_mode, ...)
+into CommandOutbox inside the same Gel transaction as the change they
+announce, then return without touching Ably:
+
+    async for tx in client.transaction():
+        async with tx:
+            message = await q.insertMessageWithBoard(tx, ...)
+            await enqueue_command(tx, f"commands:{user_id}", "new_message", envelope)
+    command_dispatcher.notify()
+
+CommandDispatcher runs as a background task (see the lifespan hook in
+api/app.py). It claims due rows in seq order, publishes each channel's rows
+as one batch through ably_publisher and marks them dispatched. A failed batch
+is retried with exponential backoff. Later rows on the same channel wait
+behind it, so per-channel order holds. Rows left over from a restart are
+picked up on the first poll. Delivery is at-least-once.
+
+Metrics: outbox.enqueued, outbox.dispatched, outbox.retried, outbox.failed,
+outbox.dispatch (batch timing), outbox.claimed (gauge).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import api.queries as q
+from api.ably_publisher import ably_publisher
+from api.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_SECONDS = float(os.getenv("COMMAND_OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("COMMAND_OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("COMMAND_OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETENTION = timedelta(hours=int(os.getenv("COMMAND_OUTBOX_RETENTION_HOURS", "24")))
+
+# A claimed row is invisible to other dispatchers for this long; if this
+# worker dies mid-publish the row becomes due again afterwards.
+_CLAIM_LEASE = timedelta(seconds=30)
+_BACKOFF_BASE_SECONDS = 1.0
+_BACKOFF_MAX_SECONDS = 300.0
+_CLEANUP_INTERVAL_SECONDS = 3600
+
+
+async def enqueue_command(executor, channel: str, name: str, payload: dict) -> None:
+    """Queue one command envelope on channel. Pass the transaction as executor."""
+    await q.insertCommandOutbox(
+        executor, channel=channel, name=name, payload=json.dumps(payload)
+    )
+    metrics.incr("outbox.enqueued")
+
+
+async def enqueue_commands(
+    executor, channel: str, commands: Iterable[Tuple[str, dict]]
+) -> None:
+    """Queue (name, payload) envelopes on channel, preserving their order."""
+    for name, payload in commands:
+        await enqueue_command(executor, channel, name, payload)
+
+
+def _backoff(attempts: int) -> timedelta:
+    seconds = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * (2 ** attempts))
+    return timedelta(seconds=seconds)
+
+
+class CommandDispatcher:
+    """Background publisher that drains CommandOutbox to Ably."""
+
+    def __init__(self, poll_seconds: float, batch_size: int, max_attempts: int):
+        self.poll_seconds = poll_seconds
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self._wake: Optional[asyncio.Event] = None
+        self._running = False
+
+    def notify(self) -> None:
+        """Wake the dispatcher now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self, client_getter: Callable[[], Any]) -> None:
+        if not ably_publisher.configured:
+            logger.warning("[OUTBOX] ABLY_API_KEY not set, command dispatcher disabled")
+            return
+
+        self._wake = asyncio.Event()
+        self._running = True
+        next_cleanup = time.monotonic()
+        logger.info("[OUTBOX] Command dispatcher started")
+
+        while self._running:
+            claimed = 0
+            try:
+                client = client_getter()
+                claimed = await self.dispatch_once(client)
+                if time.monotonic() >= next_cleanup:
+                    next_cleanup = time.monotonic() + _CLEANUP_INTERVAL_SECONDS
+                    removed = await q.deleteFinishedCommands(client, retention=OUTBOX_RETENTION)
+                    if removed:
+                        logger.info(f"[OUTBOX] Removed {len(removed)} finished commands")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[OUTBOX] Dispatch error: {e}")
+
+            if claimed >= self.batch_size:
+                continue  # A full batch: more rows are probably waiting.
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                break
+            self._wake.clear()
+
+        logger.info("[OUTBOX] Command dispatcher stopped")
+
+    def stop(self) -> None:
+        self._running = False
+        self.notify()
+
+    async def dispatch_once(self, client) -> int:
+        """Claim and publish one batch of due commands. Returns rows claimed."""
+        rows = await q.claimDueCommands(client, limit=self.batch_size, lease=_CLAIM_LEASE)
+        metrics.gauge("outbox.claimed", len(rows))
+        if not rows:
+            return 0
+
+        by_channel: Dict[str, List[q.claimDueCommandsResult]] = {}
+        for row in rows:
+            by_channel.setdefault(row.channel, []).append(row)
+
+        with metrics.timer("outbox.dispatch"):
+            await asyncio.gather(
+                *(self._dispatch_channel(client, channel, batch)
+                  for channel, batch in by_channel.items())
+            )
+        return len(rows)
+
+    async def _dispatch_channel(self, client, channel: str, rows) -> None:
+        ids = [row.id for row in rows]
+        try:
+            await ably_publisher.publish_many(
+                channel, [(row.name, json.loads(row.payload)) for row in rows]
+            )
+        except Exception as e:
+            attempts = max(row.attempts for row in rows)
+            await q.rescheduleCommands(
+                client,
+                ids=ids,
+                error=str(e)[:500],
+                delay=_backoff(attempts),
+                max_attempts=self.max_attempts,
+            )
+            if attempts + 1 >= self.max_attempts:
+                metrics.incr("outbox.failed", len(rows))
+                logger.error(
+                    f"[OUTBOX] Giving up on {len(rows)} commands for {channel} "
+                    f"after {attempts + 1} attempts: {e}"
+                )
+            else:
+                metrics.incr("outbox.retried", len(rows))
+            return
+
+        await q.markCommandsDispatched(client, ids=ids)
+        metrics.incr("outbox.dispatched", len(rows))
+
+
+command_dispatcher = CommandDispatcher(
+    poll_seconds=OUTBOX_POLL_SECONDS,
+    batch_size=OUTBOX_BATCH_SIZE,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+)
@@ -0,0 +1,78 @@
+"""
+api/metrics.py — Minimal in-process metrics registry.
+
+Counters, gauges and timings kept in memory per worker process and exposed as
+JSON at GET /metrics (see api/app.py). Intentionally dependency-free; each
+uvicorn worker reports its own numbers.
+"""
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    """Thread-safe registry of named counters, gauges and timings."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, _Timing] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing()
+            timing.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Context manager recording the wall time of its body under name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {name: t.as_dict() for name, t in self._timings.items()},
+            }
+
+
+metrics = Metrics()
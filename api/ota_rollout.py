@@ -0,0 +1,321 @@
+"""
+api/ota_rollout.py — Staged rollout of the SpaceOS OTA bundle.
+
+Broadcasting os_update to every board on deploy makes them all reset and
+hit /api/spaceos/check (scrypt plus an 83 KB download) at the same moment.
+Instead, OtaRollout releases the bundle in waves:
+
+  - Every board falls in a cohort bucket from 0 to 100. OTA_ROLLOUT_COHORT
+    picks the key: "board" (hash of the board id), "owner" (hash of the
+    owner id, so all of a user's boards move together) or "type" (boards
+    follow OTA_ROLLOUT_TYPE_ORDER). Board and owner hashes are salted with
+    the bundle hash, so each release starts with a different canary set.
+  - OTA_ROLLOUT_WAVES lists the percentage released by each wave. A board
+    is released once its bucket is below the current wave's percentage.
+    /api/spaceos/check answers 204 to boards outside the released cohort,
+    so a board that reboots on its own cannot jump the queue.
+  - When a wave starts, recently connected boards in it are notified on
+    commands:{owner_id} with {"type": "os_update", "boards": [...]}. At most
+    OTA_ROLLOUT_NOTIFY_PER_SECOND boards are notified per second. Each board
+    resets after a random delay of up to "jitter" seconds.
+
+Success is read from the boards' next check. A board that was sent the
+bundle and then checks in with the new hash has applied it. A board that
+checks in with the old hash, or stays silent for
+OTA_ROLLOUT_APPLY_TIMEOUT_SECONDS, has failed. After each wave the rollout
+soaks for OTA_ROLLOUT_SOAK_SECONDS. If the failure rate goes above
+OTA_ROLLOUT_MAX_FAILURE_RATE (once OTA_ROLLOUT_MIN_RESULTS outcomes are in),
+it pauses. No new boards are then sent the bundle until the next deploy, or
+until an operator resumes it. Recorded failures still count, so resuming
+means dropping them as well as the pause:
+
+    delete OtaRolloutBoard filter .rollout.bundle_hash = '<hash>'
+      and .outcome in {OtaOutcome.failed, OtaOutcome.timeout};
+    update OtaRollout filter .bundle_hash = '<hash>' set { paused_reason := {} };
+
+The wave, pause and per-board progress (OtaRolloutBoard: notified, sent,
+outcome) live in Gel, so any worker can score a board that another worker
+sent the bundle to, and a restart resumes the current wave. The scheduler
+itself (waves, timeouts, the regression check and notifications) runs only
+in the worker holding the "ota-rollout" WorkerLease. The other workers read
+the wave and pause from Gel, caching them for _STATE_TTL_SECONDS.
+
+Metrics: ota_rollout.sent, ota_rollout.applied, ota_rollout.apply_failed,
+ota_rollout.apply_timeout, ota_rollout.held (checks answered 204 because the
+board is not released yet), ota_rollout.notified, ota_rollout.notify_failed,
+and the gauges ota_rollout.wave, ota_rollout.percent and ota_rollout.paused.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+import api.queries as q
+from api.ably_publisher import ably_publisher
+from api.board_auth import BoardIdentity
+from api.metrics import metrics
+from api.worker_lease import WorkerLease
+
+logger = logging.getLogger(__name__)
+
+OTA_ROLLOUT_WAVES = [
+    float(p) for p in os.getenv("OTA_ROLLOUT_WAVES", "1,5,25,50,100").split(",") if p.strip()
+]
+OTA_ROLLOUT_COHORT = os.getenv("OTA_ROLLOUT_COHORT", "board")
+OTA_ROLLOUT_TYPE_ORDER = [
+    t.strip() for t in os.getenv("OTA_ROLLOUT_TYPE_ORDER", "Stellar,Galactic,Cosmic").split(",")
+]
+OTA_ROLLOUT_SOAK_SECONDS = float(os.getenv("OTA_ROLLOUT_SOAK_SECONDS", "600"))
+OTA_ROLLOUT_NOTIFY_PER_SECOND = float(os.getenv("OTA_ROLLOUT_NOTIFY_PER_SECOND", "5"))
+OTA_ROLLOUT_JITTER_SECONDS = int(os.getenv("OTA_ROLLOUT_JITTER_SECONDS", "30"))
+OTA_ROLLOUT_APPLY_TIMEOUT_SECONDS = float(os.getenv("OTA_ROLLOUT_APPLY_TIMEOUT_SECONDS", "300"))
+OTA_ROLLOUT_MAX_FAILURE_RATE = float(os.getenv("OTA_ROLLOUT_MAX_FAILURE_RATE", "0.2"))
+OTA_ROLLOUT_MIN_RESULTS = int(os.getenv("OTA_ROLLOUT_MIN_RESULTS", "5"))
+
+# Boards seen within this window are assumed online and worth notifying.
+# Boards heartbeat every 4 minutes; the rest pick the update up at boot.
+_ACTIVE_WINDOW = timedelta(minutes=10)
+_TICK_SECONDS = 5.0
+_STATE_TTL_SECONDS = 5.0
+_BOARDS_PER_MESSAGE = 50
+
+
+def cohort_bucket(board: BoardIdentity, bundle_hash: str, cohort: str = OTA_ROLLOUT_COHORT) -> float:
+    """Place a board in [0, 100) for this bundle. Lower buckets update first."""
+    if cohort == "type":
+        board_type = str(board.board_type)
+        if board_type not in OTA_ROLLOUT_TYPE_ORDER:
+            return 99.99
+        return 100.0 * OTA_ROLLOUT_TYPE_ORDER.index(board_type) / len(OTA_ROLLOUT_TYPE_ORDER)
+    key = board.owner_id if cohort == "owner" else board.board_id
+    digest = hashlib.sha256(f"{bundle_hash}:{key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % 10000 / 100
+
+
+class OtaRollout:
+    """Wave scheduler for one bundle hash at a time, with its state in Gel."""
+
+    def __init__(
+        self,
+        waves: List[float],
+        soak_seconds: float,
+        notify_per_second: float,
+        apply_timeout_seconds: float,
+        max_failure_rate: float,
+        min_results: int,
+    ):
+        self.waves = sorted(min(100.0, max(0.0, p)) for p in waves) or [100.0]
+        self.soak_seconds = soak_seconds
+        self.notify_per_second = max(0.1, notify_per_second)
+        self.apply_timeout_seconds = apply_timeout_seconds
+        self.max_failure_rate = max_failure_rate
+        self.min_results = max(1, min_results)
+
+        # This worker's copy of the OtaRollout row, refreshed every
+        # _STATE_TTL_SECONDS for released().
+        self.bundle_hash: Optional[str] = None
+        self.percent = 0.0
+        self.paused: Optional[str] = None
+        self._state_at = 0.0
+        self._lease = WorkerLease("ota-rollout")
+        self._running = False
+
+    async def _refresh(self, client, bundle_hash: str) -> bool:
+        """Re-read the rollout row if the cached copy is stale. False if unknown."""
+        fresh = time.monotonic() - self._state_at < _STATE_TTL_SECONDS
+        if bundle_hash == self.bundle_hash and fresh:
+            return True
+        try:
+            row = await q.selectOtaRollout(client, bundle_hash=bundle_hash)
+        except Exception as e:
+            logger.warning(f"[OTA] Could not read rollout state: {e}")
+            return bundle_hash == self.bundle_hash
+        self.bundle_hash = bundle_hash
+        self.percent = row.percent if row else 0.0
+        self.paused = row.paused_reason if row else None
+        self._state_at = time.monotonic()
+        return True
+
+    async def released(self, client, board: BoardIdentity, bundle_hash: str) -> bool:
+        """Whether /check may send bundle_hash to this board now."""
+        if not await self._refresh(client, bundle_hash) or self.paused:
+            return False
+        return cohort_bucket(board, bundle_hash) < self.percent
+
+    async def record_check(self, client, board_id: str, board_hash: str, bundle_hash: str) -> None:
+        """Turn a board's check-in into an apply outcome if it was sent the bundle."""
+        try:
+            row = await q.recordOtaCheck(
+                client,
+                bundle_hash=bundle_hash,
+                board_id=UUID(board_id),
+                current=board_hash == bundle_hash,
+            )
+        except Exception as e:
+            logger.warning(f"[OTA] Could not record check of board {board_id[:8]}: {e}")
+            return
+        if row is None:
+            return
+        if row.outcome == q.OtaOutcome.APPLIED:
+            metrics.incr("ota_rollout.applied")
+        else:
+            metrics.incr("ota_rollout.apply_failed")
+            logger.warning(f"[OTA] Board {board_id[:8]} checked in without applying the bundle")
+
+    async def record_sent(self, client, board_id: str, bundle_hash: str) -> None:
+        try:
+            await q.recordOtaSent(client, bundle_hash=bundle_hash, board_id=UUID(board_id))
+        except Exception as e:
+            logger.warning(f"[OTA] Could not record send to board {board_id[:8]}: {e}")
+        metrics.incr("ota_rollout.sent")
+
+    def record_held(self) -> None:
+        metrics.incr("ota_rollout.held")
+
+    async def run(self, client_getter: Callable[[], Any], bundle_hash: Optional[str]) -> None:
+        """Schedule the rollout from whichever worker holds the "ota-rollout" lease."""
+        if not bundle_hash:
+            return
+        self._running = True
+        await self._lease.run_while_held(
+            client_getter, lambda: self._schedule(client_getter, bundle_hash)
+        )
+
+    def stop(self) -> None:
+        self._running = False
+        self._lease.stop()
+
+    async def _schedule(self, client_getter: Callable[[], Any], bundle_hash: str) -> None:
+        """Release the bundle wave by wave, then keep scoring until stopped."""
+        row = await q.startOtaRollout(client_getter(), bundle_hash=bundle_hash)
+        if row.wave:
+            logger.info(
+                f"[OTA] Resuming rollout of {bundle_hash[:16]}... at wave "
+                f"{row.wave}/{len(self.waves)} ({row.percent:g}%)"
+                + (f", paused: {row.paused_reason}" if row.paused_reason else "")
+            )
+            if not row.paused_reason:
+                # Finish notifying a wave the previous leader may have cut short.
+                await self._notify_wave(client_getter(), bundle_hash, row.percent)
+        else:
+            logger.info(
+                f"[OTA] Rolling out {bundle_hash[:16]}... in waves {self.waves} "
+                f"(cohort={OTA_ROLLOUT_COHORT})"
+            )
+
+        while self._running:
+            try:
+                await self._tick(client_getter(), bundle_hash)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[OTA] Rollout error: {e}")
+            await asyncio.sleep(_TICK_SECONDS)
+
+    async def _tick(self, client, bundle_hash: str) -> None:
+        """Score timed-out sends, pause on regression, and start the next wave when due."""
+        expired = await q.expireOtaSent(
+            client,
+            bundle_hash=bundle_hash,
+            timeout=timedelta(seconds=self.apply_timeout_seconds),
+        )
+        if expired:
+            metrics.incr("ota_rollout.apply_timeout", len(expired))
+
+        row = await q.selectOtaRollout(client, bundle_hash=bundle_hash)
+        if row is None:
+            return
+        metrics.gauge("ota_rollout.wave", row.wave)
+        metrics.gauge("ota_rollout.percent", row.percent)
+        metrics.gauge("ota_rollout.paused", 1 if row.paused_reason else 0)
+        if row.paused_reason:
+            return
+
+        results = row.applied + row.failed
+        if results >= self.min_results and row.failed / results > self.max_failure_rate:
+            reason = (
+                f"{row.failed}/{results} boards failed to apply "
+                f"(> {self.max_failure_rate:.0%})"
+            )
+            await q.pauseOtaRollout(client, bundle_hash=bundle_hash, reason=reason)
+            metrics.gauge("ota_rollout.paused", 1)
+            logger.error(f"[OTA] Rollout of {bundle_hash[:16]}... paused: {reason}")
+            return
+
+        if row.wave >= len(self.waves):
+            return  # Fully released; keep scoring so late failures still show up.
+        soaked = row.wave_started_at + timedelta(seconds=self.soak_seconds)
+        if row.wave and datetime.now(timezone.utc) < soaked:
+            return
+
+        wave = row.wave + 1
+        percent = self.waves[wave - 1]
+        if await q.advanceOtaRollout(client, bundle_hash=bundle_hash, wave=wave, percent=percent) is None:
+            return
+        metrics.gauge("ota_rollout.wave", wave)
+        metrics.gauge("ota_rollout.percent", percent)
+        logger.info(f"[OTA] Wave {wave}/{len(self.waves)}: {percent:g}% released")
+        try:
+            await self._notify_wave(client, bundle_hash, percent)
+        except Exception as e:
+            logger.error(f"[OTA] Wave {wave} notification error: {e}")
+        if wave == len(self.waves):
+            logger.info(f"[OTA] Rollout of {bundle_hash[:16]}... fully released")
+
+    async def _notify_wave(self, client, bundle_hash: str, percent: float) -> None:
+        """Tell online boards that were just released to reboot and check."""
+        if not ably_publisher.configured or client is None:
+            return
+        since = datetime.now(timezone.utc) - _ACTIVE_WINDOW
+        rows = await q.selectOtaRolloutBoards(
+            client, connected_since=since, bundle_hash=bundle_hash
+        )
+
+        by_owner: Dict[str, List[str]] = {}
+        for row in rows:
+            board = BoardIdentity(
+                board_id=str(row.id),
+                owner_id=str(row.owner_id),
+                board_type=str(row.boardType),
+                ota_updates_enabled=True,
+            )
+            if cohort_bucket(board, bundle_hash) < percent:
+                by_owner.setdefault(board.owner_id, []).append(board.board_id)
+
+        for owner_id, board_ids in by_owner.items():
+            for start in range(0, len(board_ids), _BOARDS_PER_MESSAGE):
+                if not self._running:
+                    return
+                chunk = board_ids[start:start + _BOARDS_PER_MESSAGE]
+                try:
+                    await ably_publisher.publish(f"commands:{owner_id}", "control", {
+                        "type": "os_update",
+                        "boards": chunk,
+                        "jitter": OTA_ROLLOUT_JITTER_SECONDS,
+                    })
+                    metrics.incr("ota_rollout.notified", len(chunk))
+                except Exception as e:
+                    metrics.incr("ota_rollout.notify_failed", len(chunk))
+                    logger.warning(f"[OTA] Failed to notify boards of {owner_id[:8]}: {e}")
+                    await asyncio.sleep(len(chunk) / self.notify_per_second)
+                    continue
+                await q.markOtaNotified(
+                    client,
+                    bundle_hash=bundle_hash,
+                    board_ids=[UUID(board_id) for board_id in chunk],
+                )
+                await asyncio.sleep(len(chunk) / self.notify_per_second)
+
+
+ota_rollout = OtaRollout(
+    waves=OTA_ROLLOUT_WAVES,
+    soak_seconds=OTA_ROLLOUT_SOAK_SECONDS,
+    notify_per_second=OTA_ROLLOUT_NOTIFY_PER_SECOND,
+    apply_timeout_seconds=OTA_ROLLOUT_APPLY_TIMEOUT_SECONDS,
+    max_failure_rate=OTA_ROLLOUT_MAX_FAILURE_RATE,
+    min_results=OTA_ROLLOUT_MIN_RESULTS,
+)
@@ -1,108 +1,318 @@
 """
-Presence Proxy - Bridges Ably MQTT status messages to Ably Presence.
+Presence Proxy - Bridges board MQTT status messages to the web UI.
 
-Subscribes to status/+/+ channels via Ably Realtime.
-On "online" -> calls presence.enter_client(board_id) on status:{userId} channel.
-On "offline" -> calls presence.leave_client(board_id) on status:{userId} channel.
+Holds one long-lived MQTT subscription to status/+/+ (PRESENCE_MQTT_TOPIC).
+Boards publish {"state": "online"} there on connect and leave an
+{"state": "offline"} Last Will, which the broker publishes if the board
+drops off. Each presence change is republished as a board_status event on
+status:{userId}, the signal the dashboard listens to.
 
-Also handles read_receipt messages by updating the database.
+Also handles read_receipt messages. They are buffered for
+READ_RECEIPT_FLUSH_MS, de-duplicated and written to Gel as a single
+markMessagesRead update. The write rate then tracks the flush interval, not
+the number of boards replaying their inbox.
+
+Messages are handed to PRESENCE_PROXY_WORKERS consumers, sharded by topic so
+each board's messages are handled in order while different boards proceed
+concurrently. The session is persistent (clean_session=False), so after a
+reconnect the broker replays QoS 1 messages queued while the proxy was away.
+With several API workers only one of them, the holder of the
+"presence-proxy" WorkerLease, runs the proxy; the others take over if it dies.
+
+For offline load tests, point PRESENCE_MQTT_HOST/PORT at a local broker
+(PRESENCE_MQTT_TLS=false); see scripts/simulate_boards.py.
 """
 import asyncio
+import dataclasses
 import json
 import logging
 import os
+import random
+import ssl
+import time
+import zlib
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
-from ably import AblyRest
+import aiomqtt
+
+import api.queries as q
+from api.ably_publisher import ably_publisher
+from api.metrics import metrics
+from api.worker_lease import WorkerLease
 
 logger = logging.getLogger(__name__)
 
-ABLY_API_KEY = os.getenv("ABLY_API_KEY", "")
+PRESENCE_MQTT_HOST = os.getenv("PRESENCE_MQTT_HOST", "mqtt.ably.io")
+PRESENCE_MQTT_PORT = int(os.getenv("PRESENCE_MQTT_PORT", "8883"))
+PRESENCE_MQTT_TLS = os.getenv("PRESENCE_MQTT_TLS", "true").lower() == "true"
+PRESENCE_MQTT_TOPIC = os.getenv("PRESENCE_MQTT_TOPIC", "status/+/+")
+PRESENCE_MQTT_CLIENT_ID = os.getenv("PRESENCE_MQTT_CLIENT_ID", "spaceos-presence-proxy")
+PRESENCE_PROXY_WORKERS = int(os.getenv("PRESENCE_PROXY_WORKERS", "16"))
+PRESENCE_PROXY_QUEUE_SIZE = int(os.getenv("PRESENCE_PROXY_QUEUE_SIZE", "256"))
+READ_RECEIPT_FLUSH_SECONDS = int(os.getenv("READ_RECEIPT_FLUSH_MS", "500")) / 1000
+READ_RECEIPT_MAX_BATCH = int(os.getenv("READ_RECEIPT_MAX_BATCH", "500"))
+
+_KEEPALIVE_SECONDS = 60
+_RECONNECT_MIN_SECONDS = 1.0
+_RECONNECT_MAX_SECONDS = 60.0
 
 _running = False
-_task = None
+_client: Optional[aiomqtt.Client] = None
+_lease = WorkerLease("presence-proxy")
+
+
+@dataclasses.dataclass
+class StatusMessage:
+    """A message from a board's status topic (name is the topic)."""
+
+    name: str
+    data: Any
+
+
+class ReadReceiptBuffer:
+    """
+    De-duplicating buffer of read receipts, flushed as one Gel update.
 
+    A flush happens every window_seconds, or sooner once max_batch ids are
+    waiting. A failed flush puts its ids back for the next window; at most
+    max_pending ids are held, and newer receipts are dropped beyond that.
+
+    Metrics: read_receipts.received, read_receipts.duplicates,
+    read_receipts.flushes, read_receipts.flushed (ids sent),
+    read_receipts.written (rows changed), read_receipts.flush_size (gauge),
+    read_receipts.lag (oldest receipt to committed write),
+    read_receipts.flush (statement time), read_receipts.flush_failed,
+    read_receipts.dropped.
+    """
+
+    def __init__(self, window_seconds: float, max_batch: int):
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self.max_pending = self.max_batch * 20
+        self._pending: Dict[UUID, float] = {}  # message id -> first seen
+        self._full: Optional[asyncio.Event] = None
+
+    def add(self, message_id: UUID) -> None:
+        metrics.incr("read_receipts.received")
+        if message_id in self._pending:
+            metrics.incr("read_receipts.duplicates")
+            return
+        if len(self._pending) >= self.max_pending:
+            metrics.incr("read_receipts.dropped")
+            return
+        self._pending[message_id] = time.monotonic()
+        if len(self._pending) >= self.max_batch and self._full is not None:
+            self._full.set()
+
+    async def run(self, db_client_getter) -> None:
+        """Flush on every window (or full batch) until cancelled."""
+        self._full = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.drain(db_client_getter())
+
+    async def flush(self, db_client) -> bool:
+        """Write up to max_batch buffered receipts in one statement; False on error."""
+        if not self._pending:
+            return True
+        batch = {}
+        for message_id in self._pending:
+            batch[message_id] = self._pending[message_id]
+            if len(batch) >= self.max_batch:
+                break
+        for message_id in batch:
+            del self._pending[message_id]
+
+        if db_client is None:
+            metrics.incr("read_receipts.dropped", len(batch))
+            return True
+
+        try:
+            with metrics.timer("read_receipts.flush"):
+                updated = await q.markMessagesRead(db_client, ids=list(batch))
+        except Exception as e:
+            metrics.incr("read_receipts.flush_failed")
+            logger.error(f"[PROXY] Error marking {len(batch)} messages read: {e}")
+            for message_id, first_seen in batch.items():
+                if len(self._pending) < self.max_pending:
+                    self._pending.setdefault(message_id, first_seen)
+            return False
 
-async def _process_status_message(ably, message, db_client):
+        metrics.incr("read_receipts.flushes")
+        metrics.incr("read_receipts.flushed", len(batch))
+        metrics.incr("read_receipts.written", len(updated))
+        metrics.gauge("read_receipts.flush_size", len(batch))
+        metrics.observe("read_receipts.lag", time.monotonic() - min(batch.values()))
+        logger.debug(f"[PROXY] Marked {len(updated)}/{len(batch)} messages read")
+        return True
+
+    async def drain(self, db_client) -> None:
+        """Flush everything buffered, stopping at the first failed write."""
+        while self._pending and await self.flush(db_client):
+            pass
+
+
+_read_receipts = ReadReceiptBuffer(READ_RECEIPT_FLUSH_SECONDS, READ_RECEIPT_MAX_BATCH)
+
+
+def _credentials():
+    """MQTT username/password: explicit env, else the Ably API key halves."""
+    username = os.getenv("PRESENCE_MQTT_USERNAME")
+    password = os.getenv("PRESENCE_MQTT_PASSWORD")
+    if username is not None:
+        return username, password
+    api_key = os.getenv("ABLY_API_KEY", "")
+    if ":" in api_key:
+        key_name, key_secret = api_key.split(":", 1)
+        return key_name, key_secret
+    return None, None
+
+
+async def _process_status_message(message, db_client):
     """Process a single status channel message."""
     try:
         # Parse channel name: status/{user_id}/{board_id}
         channel_name = message.name if hasattr(message, "name") else ""
         data = message.data if hasattr(message, "data") else {}
 
-        if isinstance(data, str):
+        if isinstance(data, (str, bytes)):
             data = json.loads(data)
 
         msg_type = data.get("type", "")
         state = data.get("state", "")
 
         if msg_type == "presence":
-            # Extract user_id and board_id from channel name
-            # Channel subscription is on status/+/+, message arrives
-            # with the full channel path
+            # The topic is authoritative (a board may only publish to its own);
+            # fall back to ids in the payload for other publishers.
             parts = channel_name.split("/") if "/" in channel_name else []
-
-            # If we can't parse from channel name, these might be in the data
-            user_id = data.get("user_id", parts[1] if len(parts) > 1 else "")
-            board_id = data.get("board_id", parts[2] if len(parts) > 2 else "")
+            user_id = parts[1] if len(parts) > 1 else data.get("user_id", "")
+            board_id = parts[2] if len(parts) > 2 else data.get("board_id", "")
 
             if not user_id or not board_id:
                 logger.warning(f"[PROXY] Missing user_id or board_id in presence message")
                 return
 
-            presence_channel = ably.channels.get(f"status:{user_id}")
-
-            if state == "online":
-                await presence_channel.presence.enter_client(board_id, {"type": "board"})
-                logger.info(f"[PROXY] Board {board_id} entered presence for user {user_id}")
-            elif state == "offline":
-                await presence_channel.presence.leave_client(board_id)
-                logger.info(f"[PROXY] Board {board_id} left presence for user {user_id}")
+            if state in ("online", "offline"):
+                online = state == "online"
+                metrics.incr(f"presence.{state}")
+                if ably_publisher.configured:
+                    await ably_publisher.publish(f"status:{user_id}", "board_status", {
+                        "board_id": board_id,
+                        "online": online,
+                    })
+                logger.info(f"[PROXY] Board {board_id} is {state} for user {user_id}")
 
         elif msg_type == "read_receipt":
             msg_id = data.get("msg_id", "")
-            if msg_id and db_client:
-                try:
-                    from api.queries import markMessageRead
-                    await markMessageRead(db_client, message_id=UUID(msg_id))
-                    logger.info(f"[PROXY] Marked message {msg_id} as read")
-                except Exception as e:
-                    logger.error(f"[PROXY] Error marking message read: {e}")
+            metrics.incr("presence.read_receipt")
+            if msg_id:
+                _read_receipts.add(UUID(msg_id))
 
     except Exception as e:
+        metrics.incr("presence.errors")
         logger.error(f"[PROXY] Error processing status message: {e}")
 
 
+async def _worker(queue: asyncio.Queue, db_client_getter) -> None:
+    """Handle messages for one shard of topics, in arrival order."""
+    while True:
+        message = await queue.get()
+        try:
+            with metrics.timer("presence.handle"):
+                await _process_status_message(message, db_client_getter())
+        finally:
+            queue.task_done()
+
+
+async def _consume(client: aiomqtt.Client, shards: List[asyncio.Queue]) -> None:
+    """Route messages from the connection to worker shards until it drops."""
+    async for message in client.messages:
+        topic = message.topic.value
+        metrics.incr("presence.messages")
+        shard = shards[zlib.crc32(topic.encode("utf-8")) % len(shards)]
+        await shard.put(StatusMessage(name=topic, data=message.payload))
+        metrics.gauge("presence.queue_depth", sum(queue.qsize() for queue in shards))
+
+
 async def start_proxy(db_client_getter):
     """
     Start the presence proxy background task.
-    Uses Ably REST channel history polling as a simple approach.
+
+    Only the worker holding the "presence-proxy" lease connects (see
+    api/worker_lease.py). The broker allows one connection per client id,
+    and the fixed PRESENCE_MQTT_CLIENT_ID is what lets a new leader resume
+    the persistent session and its queued messages.
 
     Args:
         db_client_getter: Callable that returns a Gel client for DB operations
     """
     global _running
 
-    if not ABLY_API_KEY:
-        logger.warning("[PROXY] ABLY_API_KEY not set, presence proxy disabled")
+    username, password = _credentials()
+    if username is None:
+        logger.warning("[PROXY] No MQTT credentials (ABLY_API_KEY not set), presence proxy disabled")
         return
 
     _running = True
-    ably = AblyRest(ABLY_API_KEY)
+    await _lease.run_while_held(
+        db_client_getter, lambda: _run_proxy(db_client_getter, username, password)
+    )
 
-    logger.info("[PROXY] Presence proxy started")
 
-    # Subscribe to status channels using Ably channel enumeration
-    # Since we're using REST, we'll poll for messages periodically
-    # In production, use Ably Realtime with proper subscriptions
-    while _running:
+async def _run_proxy(db_client_getter, username: str, password: str):
+    """Hold the MQTT subscription, reconnecting with backoff, until stopped."""
+    global _client
+
+    shards = [asyncio.Queue(PRESENCE_PROXY_QUEUE_SIZE) for _ in range(max(1, PRESENCE_PROXY_WORKERS))]
+    workers = [asyncio.create_task(_worker(shard, db_client_getter)) for shard in shards]
+    workers.append(asyncio.create_task(_read_receipts.run(db_client_getter)))
+    delay = _RECONNECT_MIN_SECONDS
+
+    logger.info(f"[PROXY] Presence proxy started ({PRESENCE_MQTT_HOST}:{PRESENCE_MQTT_PORT})")
+    try:
+        while _running:
+            _client = aiomqtt.Client(
+                PRESENCE_MQTT_HOST,
+                PRESENCE_MQTT_PORT,
+                identifier=PRESENCE_MQTT_CLIENT_ID,
+                username=username,
+                password=password,
+                keepalive=_KEEPALIVE_SECONDS,
+                clean_session=False,
+                tls_context=ssl.create_default_context() if PRESENCE_MQTT_TLS else None,
+            )
+            try:
+                async with _client:
+                    await _client.subscribe(PRESENCE_MQTT_TOPIC, qos=1)
+                    logger.info(f"[PROXY] Subscribed to {PRESENCE_MQTT_TOPIC}")
+                    delay = _RECONNECT_MIN_SECONDS
+                    await _consume(_client, shards)
+            except aiomqtt.MqttError as e:
+                logger.warning(f"[PROXY] MQTT connection error: {e}")
+            finally:
+                _client = None
+
+            if not _running:
+                break
+            metrics.incr("presence.reconnects")
+            # Jittered exponential backoff so a broker restart isn't stampeded.
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(_RECONNECT_MAX_SECONDS, delay * 2)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
         try:
-            await asyncio.sleep(5)  # Poll interval
-        except asyncio.CancelledError:
-            break
+            await _read_receipts.drain(db_client_getter())
         except Exception as e:
-            logger.error(f"[PROXY] Error in proxy loop: {e}")
-            await asyncio.sleep(10)
+            logger.warning(f"[PROXY] Final read receipt flush failed: {e}")
 
     logger.info("[PROXY] Presence proxy stopped")
 
@@ -111,3 +321,4 @@ def stop_proxy():
     """Signal the proxy to stop."""
     global _running
     _running = False
+    _lease.stop()
@@ -1,42 +1,66 @@
 # AUTOGENERATED FROM:
 #     'queries/acceptFriendRequest.edgeql'
+#     'queries/acquireWorkerLease.edgeql'
+#     'queries/advanceOtaRollout.edgeql'
+#     'queries/claimDueCommands.edgeql'
 #     'queries/copyGraphicToDraft.edgeql'
 #     'queries/copyGraphicToGallery.edgeql'
 #     'queries/deleteDraft.edgeql'
+#     'queries/deleteFinishedCommands.edgeql'
 #     'queries/deleteFriend.edgeql'
 #     'queries/deleteFriendRequest.edgeql'
 #     'queries/deleteGlobalUserBoard.edgeql'
 #     'queries/deletePixelGraphic.edgeql'
 #     'queries/deleteRecipientMessage.edgeql'
+#     'queries/expireOtaSent.edgeql'
 #     'queries/finishDraft.edgeql'
 #     'queries/inserUserFromLocalProvider.edgeql'
 #     'queries/insertAvatar.edgeql'
 #     'queries/insertBoard.edgeql'
+#     'queries/insertCommandOutbox.edgeql'
 #     'queries/insertFriendRequest.edgeql'
 #     'queries/insertMessage.edgeql'
 #     'queries/insertMessageWithBoard.edgeql'
 #     'queries/insertUserFromGitHubProvider.edgeql'
+#     'queries/markCommandsDispatched.edgeql'
 #     'queries/markMessageRead.edgeql'
+#     'queries/markMessagesRead.edgeql'
+#     'queries/markOtaNotified.edgeql'
+#     'queries/pauseOtaRollout.edgeql'
+#     'queries/recordOtaCheck.edgeql'
+#     'queries/recordOtaSent.edgeql'
 #     'queries/rejectFriendRequest.edgeql'
+#     'queries/releaseWorkerLease.edgeql'
+#     'queries/rescheduleCommands.edgeql'
 #     'queries/searchUserByUsername.edgeql'
 #     'queries/selectBoardBySecretKey.edgeql'
 #     'queries/selectBoardSettingsForDevice.edgeql'
+#     'queries/selectBoardSync.edgeql'
+#     'queries/selectDashboard.edgeql'
 #     'queries/selectDraft.edgeql'
+#     'queries/selectDraftMeta.edgeql'
 #     'queries/selectFriendRequests.edgeql'
 #     'queries/selectFriendRequestsSent.edgeql'
 #     'queries/selectFriends.edgeql'
+#     'queries/selectFriendsWithBoards.edgeql'
 #     'queries/selectGlobalIdentity.edgeql'
 #     'queries/selectGlobalUser.edgeql'
 #     'queries/selectGlobalUserBoard.edgeql'
+#     'queries/selectGlobalUserProfile.edgeql'
+#     'queries/selectGraphicBinary.edgeql'
 #     'queries/selectLatestMessage.edgeql'
 #     'queries/selectManyGlobalUserBoards.edgeql'
 #     'queries/selectMessageForSpacePack.edgeql'
+#     'queries/selectOtaRollout.edgeql'
+#     'queries/selectOtaRolloutBoards.edgeql'
 #     'queries/selectPixelGraphic.edgeql'
+#     'queries/selectSpacePackSource.edgeql'
 #     'queries/selectUserAvatar.edgeql'
 #     'queries/selectUserDrafts.edgeql'
 #     'queries/selectUserGraphics.edgeql'
 #     'queries/selectUserMessages.edgeql'
 #     'queries/selectUserMessagesRecent.edgeql'
+#     'queries/startOtaRollout.edgeql'
 #     'queries/updateBoardLastConnected.edgeql'
 #     'queries/updateBoardOTAEnabled.edgeql'
 #     'queries/updateBoardSettings.edgeql'
@@ -53,6 +77,7 @@ import dataclasses
 import datetime
 import enum
 import gel
+import typing
 import uuid
 
 
@@ -94,11 +119,34 @@ class DisplayMode02(enum.Enum):
     ART = "art"
 
 
+class OtaOutcome(enum.Enum):
+    APPLIED = "applied"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+
+
 @dataclasses.dataclass
 class acceptFriendRequestResult(NoPydanticValidation):
     id: uuid.UUID
 
 
+@dataclasses.dataclass
+class acquireWorkerLeaseResult(NoPydanticValidation):
+    id: uuid.UUID
+    holder: str
+    expires_at: datetime.datetime
+
+
+@dataclasses.dataclass
+class claimDueCommandsResult(NoPydanticValidation):
+    id: uuid.UUID
+    channel: str
+    name: str
+    payload: str
+    seq: int
+    attempts: int
+
+
 @dataclasses.dataclass
 class copyGraphicToDraftResult(NoPydanticValidation):
     id: uuid.UUID
@@ -109,6 +157,11 @@ class copyGraphicToGalleryResult(NoPydanticValidation):
     id: uuid.UUID
 
 
+@dataclasses.dataclass
+class deleteFinishedCommandsResult(NoPydanticValidation):
+    id: uuid.UUID
+
+
 @dataclasses.dataclass
 class deleteFriendResult(NoPydanticValidation):
     id: uuid.UUID
@@ -145,6 +198,12 @@ class insertAvatarResult(NoPydanticValidation):
     id: uuid.UUID
 
 
+@dataclasses.dataclass
+class recordOtaCheckResult(NoPydanticValidation):
+    id: uuid.UUID
+    outcome: OtaOutcome | None
+
+
 @dataclasses.dataclass
 class searchUserByUsernameResult(NoPydanticValidation):
     id: uuid.UUID
@@ -172,6 +231,77 @@ class selectBoardSettingsForDeviceResult(NoPydanticValidation):
     owner_id: uuid.UUID
 
 
+@dataclasses.dataclass
+class selectBoardSyncResult(NoPydanticValidation):
+    art: list[selectBoardSyncResultArtItem]
+    inbox: list[selectBoardSyncResultInboxItem]
+    existing_art: list[uuid.UUID]
+    existing_inbox: list[uuid.UUID]
+
+
+@dataclasses.dataclass
+class selectBoardSyncResultArtItem(NoPydanticValidation):
+    id: uuid.UUID
+    frames: int
+    fps: int
+
+
+@dataclasses.dataclass
+class selectBoardSyncResultInboxItem(NoPydanticValidation):
+    id: uuid.UUID
+    sent_at: datetime.datetime | None
+    frames: int
+    fps: int
+
+
+@dataclasses.dataclass
+class selectDashboardResult(NoPydanticValidation):
+    user: searchUserByUsernameResult | None
+    boards: list[selectDashboardResultBoardsItem]
+    friends: list[selectFriendsResult]
+    friend_requests: list[selectFriendRequestsResult]
+    drafts: list[selectDashboardResultDraftsItem]
+    graphics: list[selectDashboardResultGraphicsItem]
+    messages: list[selectUserMessagesRecentResult]
+
+
+@dataclasses.dataclass
+class selectDashboardResultBoardsItem(NoPydanticValidation):
+    id: uuid.UUID
+    name: str | None
+    boardType: BoardType02
+
+
+@dataclasses.dataclass
+class selectDashboardResultDraftsItem(NoPydanticValidation):
+    id: uuid.UUID
+    frames: int
+    fps: int
+    size: BoardType02
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    active_board: selectUserDraftsResultActiveBoard | None
+
+
+@dataclasses.dataclass
+class selectDashboardResultGraphicsItem(NoPydanticValidation):
+    id: uuid.UUID
+    size: BoardType02
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    frames: int
+    fps: int
+
+
+@dataclasses.dataclass
+class selectDraftMetaResult(NoPydanticValidation):
+    id: uuid.UUID
+    frames: int
+    fps: int
+    size: BoardType02
+    updated_at: datetime.datetime
+
+
 @dataclasses.dataclass
 class selectDraftResult(NoPydanticValidation):
     id: uuid.UUID
@@ -203,6 +333,21 @@ class selectFriendsResult(NoPydanticValidation):
     created_at: datetime.datetime
 
 
+@dataclasses.dataclass
+class selectFriendsWithBoardsResult(NoPydanticValidation):
+    id: uuid.UUID
+    friend: selectFriendsWithBoardsResultFriend | None
+    created_at: datetime.datetime
+
+
+@dataclasses.dataclass
+class selectFriendsWithBoardsResultFriend(NoPydanticValidation):
+    id: uuid.UUID
+    username: str | None
+    avatar: insertAvatarResult | None
+    boards: list[selectDashboardResultBoardsItem]
+
+
 @dataclasses.dataclass
 class selectGlobalIdentityResult(NoPydanticValidation):
     subject: str
@@ -287,6 +432,24 @@ class selectMessageForSpacePackResult(NoPydanticValidation):
     sender_id: uuid.UUID
 
 
+@dataclasses.dataclass
+class selectOtaRolloutBoardsResult(NoPydanticValidation):
+    id: uuid.UUID
+    boardType: BoardType02
+    owner_id: uuid.UUID
+
+
+@dataclasses.dataclass
+class selectOtaRolloutResult(NoPydanticValidation):
+    id: uuid.UUID
+    wave: int
+    percent: float
+    paused_reason: str | None
+    wave_started_at: datetime.datetime
+    applied: int
+    failed: int
+
+
 @dataclasses.dataclass
 class selectPixelGraphicResult(NoPydanticValidation):
     id: uuid.UUID
@@ -296,10 +459,17 @@ class selectPixelGraphicResult(NoPydanticValidation):
     updated_at: datetime.datetime
 
 
+@dataclasses.dataclass
+class selectSpacePackSourceResult(NoPydanticValidation):
+    id: uuid.UUID
+    frames: int
+    fps: int
+    sender: str
+
+
 @dataclasses.dataclass
 class selectUserDraftsResult(NoPydanticValidation):
     id: uuid.UUID
-    binary: bytes
     frames: int
     fps: int
     size: BoardType02
@@ -317,7 +487,6 @@ class selectUserDraftsResultActiveBoard(NoPydanticValidation):
 @dataclasses.dataclass
 class selectUserGraphicsResult(NoPydanticValidation):
     id: uuid.UUID
-    binary: bytes
     size: BoardType02
     created_at: datetime.datetime
     updated_at: datetime.datetime
@@ -352,6 +521,15 @@ class selectUserMessagesResultGraphic(NoPydanticValidation):
     fps: int
 
 
+@dataclasses.dataclass
+class startOtaRolloutResult(NoPydanticValidation):
+    id: uuid.UUID
+    wave: int
+    percent: float
+    paused_reason: str | None
+    wave_started_at: datetime.datetime
+
+
 @dataclasses.dataclass
 class updateBoardOTAEnabledResult(NoPydanticValidation):
     ota_updates_enabled: bool | None
@@ -408,6 +586,115 @@ async def acceptFriendRequest(
     )
 
 
+async def acquireWorkerLease(
+    executor: gel.AsyncIOExecutor,
+    *,
+    ttl: datetime.timedelta,
+    name: str,
+    holder: str,
+) -> acquireWorkerLeaseResult | None:
+    return await executor.query_single(
+        """\
+        with
+          now := datetime_of_statement(),
+          expires_at := now + <duration>$ttl
+        select (
+          insert WorkerLease {
+            name := <str>$name,
+            holder := <str>$holder,
+            expires_at := expires_at
+          }
+          unless conflict on .name
+          else (
+            # Renew our own lease, or take over one that has expired.
+            update WorkerLease
+            filter .holder = <str>$holder or .expires_at < now
+            set {
+              holder := <str>$holder,
+              expires_at := expires_at
+            }
+          )
+        ) {
+          holder,
+          expires_at
+        }\
+        """,
+        ttl=ttl,
+        name=name,
+        holder=holder,
+    )
+
+
+async def advanceOtaRollout(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    wave: int,
+    percent: float,
+) -> acceptFriendRequestResult | None:
+    return await executor.query_single(
+        """\
+        update OtaRollout
+        filter .bundle_hash = <str>$bundle_hash
+          and not exists .paused_reason
+        set {
+          wave := <int16>$wave,
+          percent := <float64>$percent,
+          wave_started_at := datetime_of_statement()
+        }\
+        """,
+        bundle_hash=bundle_hash,
+        wave=wave,
+        percent=percent,
+    )
+
+
+async def claimDueCommands(
+    executor: gel.AsyncIOExecutor,
+    *,
+    limit: int,
+    lease: datetime.timedelta,
+) -> list[claimDueCommandsResult]:
+    return await executor.query(
+        """\
+        with
+          now := datetime_of_statement(),
+          due := (
+            select c := CommandOutbox
+            filter not exists c.dispatched_at
+              and not exists c.failed_at
+              and c.next_attempt_at <= now
+              # Keep per-channel order: skip rows queued behind one still waiting.
+              and not exists (
+                select earlier := detached CommandOutbox
+                filter earlier.channel = c.channel
+                  and earlier.seq < c.seq
+                  and not exists earlier.dispatched_at
+                  and not exists earlier.failed_at
+                  and earlier.next_attempt_at > now
+              )
+            order by c.seq
+            limit <int64>$limit
+          ),
+          claimed := (
+            update due
+            set { next_attempt_at := now + <duration>$lease }
+          )
+        select claimed {
+          id,
+          channel,
+          name,
+          payload,
+          seq,
+          attempts
+        }
+        order by .seq\
+        """,
+        limit=limit,
+        lease=lease,
+    )
+
+
 async def copyGraphicToDraft(
     executor: gel.AsyncIOExecutor,
     *,
@@ -494,6 +781,20 @@ async def deleteDraft(
     )
 
 
+async def deleteFinishedCommands(
+    executor: gel.AsyncIOExecutor,
+    *,
+    retention: datetime.timedelta,
+) -> list[deleteFinishedCommandsResult]:
+    return await executor.query(
+        """\
+        delete CommandOutbox
+        filter (.dispatched_at ?? .failed_at) < datetime_of_statement() - <duration>$retention\
+        """,
+        retention=retention,
+    )
+
+
 async def deleteFriend(
     executor: gel.AsyncIOExecutor,
     *,
@@ -575,15 +876,52 @@ async def deleteRecipientMessage(
           user := assert_single(
             select User
             filter global ext::auth::ClientTokenIdentity in .identity
+          ),
+          message := (
+            delete Message
+            filter .id = <uuid>$message_id
+              and .recipient = user
+          ),
+          # Hand the graphic back to the sender's gallery once no message uses it.
+          # The backlink still sees the message deleted above, so skip it.
+          released := (
+            update message.graphic
+            filter not exists (
+              select .<graphic[is Message]
+              filter .id != message.id
+            )
+            set { is_message_graphic := false }
           )
-        delete Message
-        filter .id = <uuid>$message_id
-          and .recipient = user\
+        select message\
         """,
         message_id=message_id,
     )
 
 
+async def expireOtaSent(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    timeout: datetime.timedelta,
+) -> list[deleteFinishedCommandsResult]:
+    return await executor.query(
+        """\
+        with
+          now := datetime_of_statement()
+        update OtaRolloutBoard
+        filter .rollout.bundle_hash = <str>$bundle_hash
+          and .sent_at < now - <duration>$timeout
+          and not exists .outcome
+        set {
+          outcome := OtaOutcome.timeout,
+          outcome_at := now
+        }\
+        """,
+        bundle_hash=bundle_hash,
+        timeout=timeout,
+    )
+
+
 async def finishDraft(
     executor: gel.AsyncIOExecutor,
     *,
@@ -689,6 +1027,27 @@ async def insertBoard(
     )
 
 
+async def insertCommandOutbox(
+    executor: gel.AsyncIOExecutor,
+    *,
+    channel: str,
+    name: str,
+    payload: str,
+) -> deleteFinishedCommandsResult:
+    return await executor.query_single(
+        """\
+        insert CommandOutbox {
+          channel := <str>$channel,
+          name := <str>$name,
+          payload := <json>$payload
+        }\
+        """,
+        channel=channel,
+        name=name,
+        payload=payload,
+    )
+
+
 async def insertFriendRequest(
     executor: gel.AsyncIOExecutor,
     *,
@@ -732,7 +1091,8 @@ async def insertMessage(
             insert StaticImage {
               binary := <bytes>$data,
               size := <BoardType>$size,
-              creator := user
+              creator := user,
+              is_message_graphic := true
             }
           )
         insert Message {
@@ -761,8 +1121,9 @@ async def insertMessageWithBoard(
             filter global ext::auth::ClientTokenIdentity in .identity
           ),
           graphic := assert_single(
-            select PixelGraphic
+            update PixelGraphic
             filter .id = <uuid>$graphic_id
+            set { is_message_graphic := true }
           )
         insert Message {
           graphic := graphic,
@@ -793,6 +1154,24 @@ async def insertUserFromGitHubProvider(
     )
 
 
+async def markCommandsDispatched(
+    executor: gel.AsyncIOExecutor,
+    *,
+    ids: typing.Sequence[uuid.UUID],
+) -> list[deleteFinishedCommandsResult]:
+    return await executor.query(
+        """\
+        update CommandOutbox
+        filter .id in array_unpack(<array<uuid>>$ids)
+        set {
+          dispatched_at := datetime_of_statement(),
+          last_error := {}
+        }\
+        """,
+        ids=ids,
+    )
+
+
 async def markMessageRead(
     executor: gel.AsyncIOExecutor,
     *,
@@ -808,6 +1187,151 @@ async def markMessageRead(
     )
 
 
+async def markMessagesRead(
+    executor: gel.AsyncIOExecutor,
+    *,
+    ids: typing.Sequence[uuid.UUID],
+) -> list[deleteRecipientMessageResult]:
+    return await executor.query(
+        """\
+        update Message
+        filter .id in array_unpack(<array<uuid>>$ids)
+          and not .is_read
+        set { is_read := true }\
+        """,
+        ids=ids,
+    )
+
+
+async def markOtaNotified(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    board_ids: typing.Sequence[uuid.UUID],
+) -> list[deleteFinishedCommandsResult]:
+    return await executor.query(
+        """\
+        with
+          now := datetime_of_statement(),
+          rollout := assert_exists(
+            (select OtaRollout filter .bundle_hash = <str>$bundle_hash)
+          )
+        for board in (
+          select Board filter .id in array_unpack(<array<uuid>>$board_ids)
+        ) union (
+          insert OtaRolloutBoard {
+            rollout := rollout,
+            board := board,
+            notified_at := now
+          }
+          unless conflict on ((.rollout, .board))
+          else (
+            update OtaRolloutBoard
+            set { notified_at := now }
+          )
+        )\
+        """,
+        bundle_hash=bundle_hash,
+        board_ids=board_ids,
+    )
+
+
+async def pauseOtaRollout(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    reason: str,
+) -> acceptFriendRequestResult | None:
+    return await executor.query_single(
+        """\
+        update OtaRollout
+        filter .bundle_hash = <str>$bundle_hash
+          and not exists .paused_reason
+        set { paused_reason := <str>$reason }\
+        """,
+        bundle_hash=bundle_hash,
+        reason=reason,
+    )
+
+
+async def recordOtaCheck(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    board_id: uuid.UUID,
+    current: bool,
+) -> recordOtaCheckResult | None:
+    return await executor.query_single(
+        """\
+        with
+          rollout := (select OtaRollout filter .bundle_hash = <str>$bundle_hash),
+          board := (select Board filter .id = <uuid>$board_id),
+          current := <bool>$current,
+          # Boards already on the bundle are skipped when a wave is notified.
+          tracked := (
+            for r in (select rollout filter current and exists board) union (
+              insert OtaRolloutBoard {
+                rollout := r,
+                board := assert_exists(board),
+                up_to_date := true
+              }
+              unless conflict on ((.rollout, .board))
+            )
+          )
+        # A board sent the bundle has applied it if it now reports the bundle hash.
+        select (
+          update OtaRolloutBoard
+          filter .rollout = rollout
+            and .board = board
+            and exists .sent_at
+            and not exists .outcome
+          set {
+            outcome := OtaOutcome.applied if current else OtaOutcome.failed,
+            outcome_at := datetime_of_statement(),
+            up_to_date := current
+          }
+        ) {
+          outcome
+        }\
+        """,
+        bundle_hash=bundle_hash,
+        board_id=board_id,
+        current=current,
+    )
+
+
+async def recordOtaSent(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+    board_id: uuid.UUID,
+) -> acceptFriendRequestResult:
+    return await executor.query_single(
+        """\
+        with
+          now := datetime_of_statement()
+        insert OtaRolloutBoard {
+          rollout := assert_exists(
+            (select OtaRollout filter .bundle_hash = <str>$bundle_hash)
+          ),
+          board := assert_exists((select Board filter .id = <uuid>$board_id)),
+          sent_at := now
+        }
+        unless conflict on ((.rollout, .board))
+        else (
+          update OtaRolloutBoard
+          set {
+            sent_at := now,
+            outcome := {},
+            outcome_at := {}
+          }
+        )\
+        """,
+        bundle_hash=bundle_hash,
+        board_id=board_id,
+    )
+
+
 async def rejectFriendRequest(
     executor: gel.AsyncIOExecutor,
     *,
@@ -823,6 +1347,52 @@ async def rejectFriendRequest(
     )
 
 
+async def releaseWorkerLease(
+    executor: gel.AsyncIOExecutor,
+    *,
+    name: str,
+    holder: str,
+) -> acceptFriendRequestResult | None:
+    return await executor.query_single(
+        """\
+        delete WorkerLease
+        filter .name = <str>$name
+          and .holder = <str>$holder\
+        """,
+        name=name,
+        holder=holder,
+    )
+
+
+async def rescheduleCommands(
+    executor: gel.AsyncIOExecutor,
+    *,
+    ids: typing.Sequence[uuid.UUID],
+    error: str,
+    delay: datetime.timedelta,
+    max_attempts: int,
+) -> list[deleteFinishedCommandsResult]:
+    return await executor.query(
+        """\
+        update CommandOutbox
+        filter .id in array_unpack(<array<uuid>>$ids)
+        set {
+          attempts := .attempts + 1,
+          last_error := <str>$error,
+          next_attempt_at := datetime_of_statement() + <duration>$delay,
+          failed_at := (
+            datetime_of_statement() if .attempts + 1 >= <int16>$max_attempts
+            else <datetime>{}
+          )
+        }\
+        """,
+        ids=ids,
+        error=error,
+        delay=delay,
+        max_attempts=max_attempts,
+    )
+
+
 async def searchUserByUsername(
     executor: gel.AsyncIOExecutor,
     *,
@@ -904,6 +1474,185 @@ async def selectBoardSettingsForDevice(
     )
 
 
+async def selectBoardSync(
+    executor: gel.AsyncIOExecutor,
+    *,
+    owner_id: uuid.UUID,
+    board_size: BoardType,
+    inbox_before_sent_at: datetime.datetime | None = None,
+    inbox_before_id: uuid.UUID | None = None,
+    art_ids: typing.Sequence[uuid.UUID],
+    inbox_ids: typing.Sequence[uuid.UUID],
+) -> selectBoardSyncResult:
+    return await executor.query_single(
+        """\
+        # Everything a board delta sync needs in one round trip: the latest art and
+        # inbox items for the board's size, plus which of the board's local IDs
+        # still exist server-side (the rest are deletions). inbox_before_sent_at /
+        # inbox_before_id page the inbox backwards from an older (sent_at, id).
+        with
+          owner_id := <uuid>$owner_id,
+          board_size := <BoardType>$board_size,
+          inbox_before_sent_at := <optional datetime>$inbox_before_sent_at,
+          inbox_before_id := <optional uuid>$inbox_before_id
+        select {
+          art := (
+            select g := PixelGraphic {
+              id,
+              frames := [is PixelAnimation].frames ?? <int16>1,
+              fps := [is PixelAnimation].fps ?? <int16>10,
+            }
+            filter g.creator.id = owner_id
+               and g.size = board_size
+               and not (g is (DraftGraphic | Avatar))
+            order by g.created_at desc
+            limit 5
+          ),
+          inbox := (
+            select Message {
+              id,
+              sent_at,
+              frames := .graphic[is PixelAnimation].frames ?? <int16>1,
+              fps := .graphic[is PixelAnimation].fps ?? <int16>10,
+            }
+            filter .recipient.id = owner_id
+               and .graphic.size = board_size
+               and ((
+                 .sent_at < inbox_before_sent_at
+                 or (.sent_at = inbox_before_sent_at and .id < inbox_before_id)
+               ) ?? true)
+            order by .sent_at desc then .id desc
+            limit 5
+          ),
+          existing_art := (
+            select PixelGraphic
+            filter .id in array_unpack(<array<uuid>>$art_ids)
+               and .creator.id = owner_id
+          ).id,
+          existing_inbox := (
+            select Message
+            filter .id in array_unpack(<array<uuid>>$inbox_ids)
+               and .recipient.id = owner_id
+          ).id,
+        }\
+        """,
+        owner_id=owner_id,
+        board_size=board_size,
+        inbox_before_sent_at=inbox_before_sent_at,
+        inbox_before_id=inbox_before_id,
+        art_ids=art_ids,
+        inbox_ids=inbox_ids,
+    )
+
+
+async def selectDashboard(
+    executor: gel.AsyncIOExecutor,
+    *,
+    graphics_limit: int,
+    messages_limit: int,
+) -> selectDashboardResult:
+    return await executor.query_single(
+        """\
+        with
+          user := global current_user,
+          friendships := (
+            select Friend
+            filter .user1 = user or .user2 = user
+          )
+        select {
+          user := user {
+            id,
+            username,
+            avatar
+          },
+          boards := (
+            select Board {
+              id,
+              name,
+              boardType
+            }
+            filter .owner = user
+          ),
+          friends := (
+            select friendships {
+              id,
+              friend := (
+                friendships.user2 if friendships.user1 = user
+                else friendships.user1
+              ) {
+                id,
+                username,
+                avatar
+              },
+              created_at
+            }
+            order by .created_at desc
+          ),
+          friend_requests := (
+            select FriendRequest {
+              id,
+              sender: {
+                id,
+                username,
+                avatar
+              },
+              created_at
+            }
+            filter .recipient = user
+            order by .created_at desc
+          ),
+          drafts := (
+            select DraftGraphic {
+              id,
+              frames,
+              fps,
+              size,
+              created_at,
+              updated_at,
+              active_board: { id, name }
+            }
+            filter .creator = user
+            order by .updated_at desc
+          ),
+          graphics := (
+            select g := PixelGraphic {
+              id,
+              size,
+              created_at,
+              updated_at,
+              frames := [is PixelAnimation].frames ?? <int16>1,
+              fps := [is PixelAnimation].fps ?? <int16>10
+            }
+            filter g.creator = user
+              and not (g is (DraftGraphic | Avatar))
+              and not g.is_message_graphic
+            order by g.updated_at desc
+            limit <int64>$graphics_limit
+          ),
+          messages := (
+            select Message {
+              id,
+              sent_at,
+              sender: { id, username },
+              recipient: { id, username },
+              graphic: {
+                id,
+                size,
+                frames := [is PixelAnimation].frames ?? <int16>1,
+                fps := [is PixelAnimation].fps ?? <int16>10
+              }
+            }
+            filter .recipient = user
+            order by .sent_at desc
+            limit <int64>$messages_limit
+          )
+        }\
+        """,
+        graphics_limit=graphics_limit,
+        messages_limit=messages_limit,
+    )
+
+
 async def selectDraft(
     executor: gel.AsyncIOExecutor,
     *,
@@ -940,6 +1689,41 @@ async def selectDraft(
     )
 
 
+async def selectDraftMeta(
+    executor: gel.AsyncIOExecutor,
+    *,
+    draft_id: uuid.UUID | None = None,
+    board_id: uuid.UUID | None = None,
+) -> selectDraftMetaResult | None:
+    return await executor.query_single(
+        """\
+        with
+          user := assert_single(
+            select User
+            filter assert_single(.identity = global ext::auth::ClientTokenIdentity)
+          )
+        select DraftGraphic {
+          id,
+          frames,
+          fps,
+          size,
+          updated_at
+        }
+        filter .creator = user
+          and (
+            (.id = <optional uuid>$draft_id) if exists <optional uuid>$draft_id else
+            (
+              (.active_board.id = <optional uuid>$board_id) if exists <optional uuid>$board_id
+              else not exists .active_board
+            )
+          )
+        limit 1\
+        """,
+        draft_id=draft_id,
+        board_id=board_id,
+    )
+
+
 async def selectFriendRequests(
     executor: gel.AsyncIOExecutor,
 ) -> list[selectFriendRequestsResult]:
@@ -1012,6 +1796,42 @@ async def selectFriends(
     )
 
 
+async def selectFriendsWithBoards(
+    executor: gel.AsyncIOExecutor,
+) -> list[selectFriendsWithBoardsResult]:
+    return await executor.query(
+        """\
+        with
+          user := global current_user,
+          friendships := (
+            select Friend
+            filter .user1 = user or .user2 = user
+          )
+        select friendships {
+          id,
+          friend := (
+            friendships.user2 if friendships.user1 = user
+            else friendships.user1
+          ) {
+            id,
+            username,
+            avatar,
+            boards := (
+              select .<owner[is Board] {
+                id,
+                name,
+                boardType
+              }
+              order by .boardType then .name
+            )
+          },
+          created_at
+        }
+        order by .created_at desc;\
+        """,
+    )
+
+
 async def selectGlobalIdentity(
     executor: gel.AsyncIOExecutor,
 ) -> selectGlobalIdentityResult:
@@ -1057,6 +1877,40 @@ async def selectGlobalUserBoard(
     )
 
 
+async def selectGlobalUserProfile(
+    executor: gel.AsyncIOExecutor,
+) -> searchUserByUsernameResult | None:
+    return await executor.query_single(
+        """\
+        select assert_single(
+            select User {
+                id,
+                username,
+                avatar
+            }
+            filter assert_single(.identity = global ext::auth::ClientTokenIdentity)
+        );\
+        """,
+    )
+
+
+async def selectGraphicBinary(
+    executor: gel.AsyncIOExecutor,
+    *,
+    graphic_id: uuid.UUID,
+) -> bytes | None:
+    return await executor.query_single(
+        """\
+        select (
+          select PixelGraphic
+          filter .id = <uuid>$graphic_id
+          limit 1
+        ).binary\
+        """,
+        graphic_id=graphic_id,
+    )
+
+
 async def selectLatestMessage(
     executor: gel.AsyncIOExecutor,
 ) -> selectLatestMessageResult | None:
@@ -1110,6 +1964,59 @@ async def selectMessageForSpacePack(
     )
 
 
+async def selectOtaRollout(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+) -> selectOtaRolloutResult | None:
+    return await executor.query_single(
+        """\
+        select OtaRollout {
+          wave,
+          percent,
+          paused_reason,
+          wave_started_at,
+          applied := count(
+            .<rollout[is OtaRolloutBoard]
+            filter .outcome = OtaOutcome.applied
+          ),
+          failed := count(
+            .<rollout[is OtaRolloutBoard]
+            filter .outcome in {OtaOutcome.failed, OtaOutcome.timeout}
+          )
+        }
+        filter .bundle_hash = <str>$bundle_hash\
+        """,
+        bundle_hash=bundle_hash,
+    )
+
+
+async def selectOtaRolloutBoards(
+    executor: gel.AsyncIOExecutor,
+    *,
+    connected_since: datetime.datetime,
+    bundle_hash: str,
+) -> list[selectOtaRolloutBoardsResult]:
+    return await executor.query(
+        """\
+        select Board {
+          id,
+          boardType,
+          owner_id := .owner.id
+        }
+        filter .ota_updates_enabled ?? true
+          and .last_connected_at >= <datetime>$connected_since
+          # Skip boards already notified, sent the bundle or up to date.
+          and not exists (
+            select .<board[is OtaRolloutBoard]
+            filter .rollout.bundle_hash = <str>$bundle_hash
+          )\
+        """,
+        connected_since=connected_since,
+        bundle_hash=bundle_hash,
+    )
+
+
 async def selectPixelGraphic(
     executor: gel.AsyncIOExecutor,
     *,
@@ -1141,6 +2048,31 @@ async def selectPixelGraphic(
     )
 
 
+async def selectSpacePackSource(
+    executor: gel.AsyncIOExecutor,
+    *,
+    item_id: uuid.UUID,
+) -> selectSpacePackSourceResult | None:
+    return await executor.query_single(
+        """\
+        # Resolve a Space Pack request (Message ID or PixelGraphic ID) to the graphic
+        # it renders, without materializing the PNG binary.
+        with
+          message := (select Message filter .id = <uuid>$item_id limit 1),
+          graphic := assert_single(
+            message.graphic ?? (select PixelGraphic filter .id = <uuid>$item_id limit 1)
+          )
+        select graphic {
+          id,
+          frames := [is PixelAnimation].frames ?? <int16>1,
+          fps := [is PixelAnimation].fps ?? <int16>10,
+          sender := message.sender.username ?? .creator.username ?? "Unknown"
+        }\
+        """,
+        item_id=item_id,
+    )
+
+
 async def selectUserAvatar(
     executor: gel.AsyncIOExecutor,
     *,
@@ -1169,7 +2101,6 @@ async def selectUserDrafts(
           )
         select DraftGraphic {
           id,
-          binary,
           frames,
           fps,
           size,
@@ -1195,7 +2126,6 @@ async def selectUserGraphics(
           )
         select g := PixelGraphic {
           id,
-          binary,
           size,
           created_at,
           updated_at,
@@ -1203,9 +2133,8 @@ async def selectUserGraphics(
           fps := [is PixelAnimation].fps ?? <int16>10
         }
         filter g.creator = user
-          and not (g is DraftGraphic)
-          and not (g is Avatar)
-          and not exists (select Message filter .graphic = g)
+          and not (g is (DraftGraphic | Avatar))
+          and not g.is_message_graphic
         order by g.updated_at desc\
         """,
     )
@@ -1214,16 +2143,21 @@ async def selectUserGraphics(
 async def selectUserMessages(
     executor: gel.AsyncIOExecutor,
     *,
-    offset: int,
+    before_sent_at: datetime.datetime | None = None,
+    before_id: uuid.UUID | None = None,
     limit: int,
 ) -> list[selectUserMessagesResult]:
     return await executor.query(
         """\
+        # Keyset pagination: pass the (sent_at, id) of the last message on the
+        # previous page to get the next one; leave both empty for the first page.
         with
           user := assert_single(
             select User
             filter global ext::auth::ClientTokenIdentity in .identity
-          )
+          ),
+          before_sent_at := <optional datetime>$before_sent_at,
+          before_id := <optional uuid>$before_id
         select Message {
           id,
           sent_at,
@@ -1238,11 +2172,15 @@ async def selectUserMessages(
           }
         }
         filter .recipient = user
-        order by .sent_at desc
-        offset <int64>$offset
+          and ((
+            .sent_at < before_sent_at
+            or (.sent_at = before_sent_at and .id < before_id)
+          ) ?? true)
+        order by .sent_at desc then .id desc
         limit <int64>$limit\
         """,
-        offset=offset,
+        before_sent_at=before_sent_at,
+        before_id=before_id,
         limit=limit,
     )
 
@@ -1276,6 +2214,30 @@ async def selectUserMessagesRecent(
     )
 
 
+async def startOtaRollout(
+    executor: gel.AsyncIOExecutor,
+    *,
+    bundle_hash: str,
+) -> startOtaRolloutResult:
+    return await executor.query_single(
+        """\
+        select (
+          insert OtaRollout {
+            bundle_hash := <str>$bundle_hash
+          }
+          unless conflict on .bundle_hash
+          else (select OtaRollout)
+        ) {
+          wave,
+          percent,
+          paused_reason,
+          wave_started_at
+        }\
+        """,
+        bundle_hash=bundle_hash,
+    )
+
+
 async def updateBoardLastConnected(
     executor: gel.AsyncIOExecutor,
     *,
@@ -3,24 +3,22 @@ import os
 from uuid import UUID
 from fastapi import APIRouter, Request, Depends, HTTPException, Header, Body
 from fastapi.responses import JSONResponse
-from werkzeug.security import check_password_hash
-from ably import AblyRest
-
+from api.ably_publisher import ably_publisher
 from api.dependencies import AuthenticatedClient, get_base_client
+from api.board_auth import authenticate_board
 import api.queries as q
 from api.command_schema import validate_command_envelope
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-ABLY_API_KEY = os.getenv("ABLY_API_KEY", "")
-
 
 def _get_ably_client():
-    """Get an Ably REST client instance."""
-    if not ABLY_API_KEY:
+    """Get the shared Ably REST client."""
+    ably = ably_publisher.client()
+    if ably is None:
         raise HTTPException(status_code=503, detail="Ably not configured")
-    return AblyRest(ABLY_API_KEY)
+    return ably
 
 
 @router.get("/token", name="ably.web_token")
@@ -34,7 +32,7 @@ async def web_token(request: Request, client: AuthenticatedClient):
     """
     ably = _get_ably_client()
 
-    user = await q.selectGlobalUser(client)
+    user = await q.selectGlobalUserProfile(client)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
@@ -64,35 +62,20 @@ async def board_token(
     request: Request,
     board_id: str,
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
 ):
     """
     Issue an Ably token for a board device.
-    Authenticates via board secret key header.
+    Authenticates via board session token or secret key header.
     """
-    if not x_board_secret:
-        raise HTTPException(status_code=401, detail="Missing board secret")
+    board = await authenticate_board(request, board_id, x_board_secret, x_board_token)
 
     ably = _get_ably_client()
 
-    # Get the base client (no user auth needed, we verify via secret key)
+    # Get the base client (no user auth needed, the board is already verified)
     base_client = request.app.state.get_base_client()
 
-    # Look up the board and verify secret
-    try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(board_id))
-    except Exception:
-        board = None
-
-    if not board:
-        raise HTTPException(status_code=404, detail="Board not found")
-
-    if not board.secret_key_hash:
-        raise HTTPException(status_code=403, detail="Board not registered")
-
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        raise HTTPException(status_code=403, detail="Invalid secret key")
-
-    owner_id = str(board.owner_id)
+    owner_id = board.owner_id
 
     # Board capabilities: publish/subscribe to its status channel,
     # subscribe to command channel, subscribe to global OTA update channel
@@ -120,8 +103,7 @@ async def board_token(
 
     # Notify web UI that board is online via Ably message
     try:
-        status_channel = ably.channels.get(f"status:{owner_id}")
-        await status_channel.publish("board_status", {
+        await ably_publisher.publish(f"status:{owner_id}", "board_status", {
             "board_id": board_id,
             "online": True,
         })
@@ -136,6 +118,7 @@ async def board_inventory(
     request: Request,
     board_id: str,
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
 ):
     """
     Receive board inventory snapshot from the device.
@@ -150,22 +133,9 @@ async def board_inventory(
         "last_eviction": "uuid-of-evicted-item" | null
     }
     """
-    if not x_board_secret:
-        raise HTTPException(status_code=401, detail="Missing board secret")
-
+    board = await authenticate_board(request, board_id, x_board_secret, x_board_token)
     base_client = request.app.state.get_base_client()
 
-    try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(board_id))
-    except Exception:
-        board = None
-
-    if not board or not board.secret_key_hash:
-        raise HTTPException(status_code=403, detail="Invalid board")
-
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        raise HTTPException(status_code=403, detail="Invalid secret key")
-
     body = await request.json()
 
     # Update last_connected_at so the UI knows the board is still online
@@ -177,10 +147,7 @@ async def board_inventory(
 
     # Publish inventory to the board's status channel so the web UI can pick it up
     try:
-        ably = _get_ably_client()
-        owner_id = str(board.owner_id)
-        status_channel = ably.channels.get(f"status:{owner_id}")
-        await status_channel.publish("board_inventory", {
+        await ably_publisher.publish(f"status:{board.owner_id}", "board_inventory", {
             "board_id": board_id,
             "inbox_count": body.get("inbox_count", 0),
             "art_count": body.get("art_count", 0),
@@ -199,27 +166,15 @@ async def board_device_settings(
     request: Request,
     board_id: str,
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
 ):
     """
     Return current board settings for the device to apply on boot/sync.
-    Board authenticates via secret key header.
+    Board authenticates via session token or secret key header.
     """
-    if not x_board_secret:
-        raise HTTPException(status_code=401, detail="Missing board secret")
-
+    board = await authenticate_board(request, board_id, x_board_secret, x_board_token)
     base_client = request.app.state.get_base_client()
 
-    try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(board_id))
-    except Exception:
-        board = None
-
-    if not board or not board.secret_key_hash:
-        raise HTTPException(status_code=403, detail="Invalid board")
-
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        raise HTTPException(status_code=403, detail="Invalid secret key")
-
     # Fetch board settings (no WiFi — those are sent encrypted via Ably)
     try:
         if hasattr(q, "selectBoardSettingsForDevice"):
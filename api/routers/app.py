@@ -1,13 +1,16 @@
 import base64
-import struct
+import dataclasses
+import hashlib
 import secrets
 import logging
 import json
 import os
 from datetime import datetime, timedelta, timezone
+from typing import Tuple
 from uuid import UUID
-from fastapi import APIRouter, Request, Depends, HTTPException, Form, Query, Header
-from fastapi.responses import HTMLResponse, Response, JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Request, Depends, HTTPException, Form, Query, Header
+from fastapi.responses import HTMLResponse, Response, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from werkzeug.security import generate_password_hash
 
 from api.dependencies import (
@@ -30,10 +33,44 @@ from api.command_schema import (
     build_wifi_update,
     generate_wifi_encryption_key,
 )
+from api.ably_publisher import ably_publisher
+from api.metrics import metrics
+from api.command_outbox import command_dispatcher, enqueue_command, enqueue_commands
+from api.space_pack import (
+    BATCH_END,
+    BATCH_FAILED,
+    BATCH_NOT_FOUND,
+    BATCH_OK,
+    SPACE_PACK_BATCH_MAX,
+    EncoderBusy,
+    batch_record,
+    build_space_pack,
+    negotiate_version,
+    space_pack_cache,
+    space_pack_encoder,
+    space_pack_store,
+)
+from api.board_auth import (
+    BOARD_TOKEN_TTL_SECONDS,
+    authenticate_board,
+    check_board_secret,
+    invalidate_board,
+    issue_board_token,
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Items previewed on the home page; the full lists live under /app/art and
+# /app/messages.
+HOME_GRAPHICS_LIMIT = 5
+HOME_MESSAGES_LIMIT = 5
+
+# Listing pages render metadata only; images load through serve_graphic and
+# serve_draft. A listing result over this size means its query is pulling
+# image bytes again.
+LIST_RESULT_BYTE_BUDGET = int(os.getenv("LIST_RESULT_BYTE_BUDGET", str(256 * 1024)))
+
 
 def get_templates(request: Request):
     return request.app.state.templates
@@ -43,6 +80,46 @@ def get_context(request: Request, **kwargs):
     return request.app.state.get_template_context(request, **kwargs)
 
 
+def _result_bytes(value) -> int:
+    """Approximate size of a Gel result: its bytes/str values plus 16 per scalar."""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_result_bytes(item) for item in value)
+    if dataclasses.is_dataclass(value):
+        return sum(_result_bytes(getattr(value, f.name)) for f in dataclasses.fields(value))
+    return 0 if value is None else 16
+
+
+def _check_list_budget(page: str, result) -> None:
+    """Record a listing page's result size and warn when it is over budget."""
+    size = _result_bytes(result)
+    metrics.gauge(f"list_bytes.{page}", size)
+    if size > LIST_RESULT_BYTE_BUDGET:
+        metrics.incr("list_bytes.over_budget")
+        logger.warning(
+            f"[LIST] {page} loaded {size} bytes from Gel (budget {LIST_RESULT_BYTE_BUDGET})"
+        )
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_cursor(sent_at: datetime, message_id: UUID) -> str:
+    """Keyset cursor for the message after (sent_at, id): "<epoch us>-<hex id>"."""
+    micros = (sent_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}-{message_id.hex}"
+
+
+def _decode_cursor(cursor: str):
+    """Parse _encode_cursor output back to (sent_at, id); 400 on junk."""
+    try:
+        micros, message_id = cursor.split("-", 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), UUID(message_id)
+    except (ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 def _get_public_api_url(request: Request) -> str:
     """Return the public-facing API base URL.
 
@@ -64,38 +141,25 @@ def _get_public_api_url(request: Request) -> str:
 @router.get("/", response_class=HTMLResponse, name="app.home")
 async def home(request: Request, client: AuthenticatedClient):
     templates = get_templates(request)
-    user = await q.selectGlobalUser(client)
-    boards = await q.selectManyGlobalUserBoards(client)
-    friends = await q.selectFriends(client) if hasattr(q, "selectFriends") else []
-    friend_requests = (
-        await q.selectFriendRequests(client)
-        if hasattr(q, "selectFriendRequests")
-        else []
-    )
-    drafts = await q.selectUserDrafts(client) if hasattr(q, "selectUserDrafts") else []
-
-    # Fetch user's graphics (StaticImages and PixelAnimations)
-    graphics = (
-        await q.selectUserGraphics(client) if hasattr(q, "selectUserGraphics") else []
-    )
-
-    # Fetch user's most recent received messages
-    messages = []
-    try:
-        if user and hasattr(q, "selectUserMessagesRecent"):
-            messages = await q.selectUserMessagesRecent(client)
-    except Exception as e:
-        logger.error(f"Error loading messages: {e}")
+    # One round trip for the whole page, carrying only the fields the
+    # template renders (images load separately via serve_graphic).
+    with metrics.timer("app.home.query"):
+        dashboard = await q.selectDashboard(
+            client,
+            graphics_limit=HOME_GRAPHICS_LIMIT,
+            messages_limit=HOME_MESSAGES_LIMIT,
+        )
+    _check_list_budget("home", dashboard)
 
     context = get_context(
         request,
-        user=user,
-        boards=boards,
-        friends=friends,
-        friend_requests=friend_requests,
-        drafts=drafts or [],
-        graphics=graphics or [],
-        messages=messages or [],
+        user=dashboard.user,
+        boards=dashboard.boards,
+        friends=dashboard.friends,
+        friend_requests=dashboard.friend_requests,
+        drafts=dashboard.drafts,
+        graphics=dashboard.graphics,
+        messages=dashboard.messages,
     )
     return templates.TemplateResponse("app/index.html", context)
 
@@ -104,24 +168,32 @@ async def home(request: Request, client: AuthenticatedClient):
 async def messages_list(
     request: Request,
     client: AuthenticatedClient,
-    offset: int = Query(0),
+    before: str = Query(None),
     limit: int = Query(20),
 ):
     templates = get_templates(request)
+    before_sent_at, before_id = _decode_cursor(before) if before else (None, None)
     messages = []
     try:
-        messages = await q.selectUserMessages(client, offset=offset, limit=limit)
+        with metrics.timer("app.messages.query"):
+            messages = await q.selectUserMessages(
+                client, before_sent_at=before_sent_at, before_id=before_id, limit=limit
+            )
     except Exception as e:
         logger.error(f"Error loading messages: {e}")
+    _check_list_budget("messages", messages)
+
+    next_cursor = None
+    if messages and len(messages) == limit and messages[-1].sent_at:
+        next_cursor = _encode_cursor(messages[-1].sent_at, messages[-1].id)
+    context = get_context(
+        request, messages=messages or [], next_cursor=next_cursor, limit=limit
+    )
 
     # For htmx requests, return only the message cards partial
     if request.headers.get("HX-Request"):
-        context = get_context(
-            request, messages=messages or [], offset=offset, limit=limit
-        )
         return templates.TemplateResponse("app/messages/_message_cards.html", context)
 
-    context = get_context(request, messages=messages or [], offset=offset, limit=limit)
     return templates.TemplateResponse("app/messages/list.html", context)
 
 
@@ -143,6 +215,7 @@ async def art_list(request: Request, client: AuthenticatedClient):
     graphics = (
         await q.selectUserGraphics(client) if hasattr(q, "selectUserGraphics") else []
     )
+    _check_list_budget("art", graphics)
 
     context = get_context(request, graphics=graphics)
     return templates.TemplateResponse("app/art/list.html", context)
@@ -287,7 +360,7 @@ async def download_config(
 
     # Look up board and user info for SpaceOS config
     board = await q.selectGlobalUserBoard(client, board_id=board_id)
-    user = await q.selectGlobalUser(client)
+    user = await q.selectGlobalUserProfile(client)
 
     # Determine board dimensions
     board_type_str = str(board.boardType.value) if board and hasattr(board.boardType, "value") else "Cosmic"
@@ -398,6 +471,7 @@ async def delete_board(board_id: str, client: AuthenticatedClient):
 
     # Delete the board
     await q.deleteGlobalUserBoard(client, board_id=board_id)
+    invalidate_board(board_id)
 
     # Redirect to home page
     response = Response(content="", status_code=204)
@@ -427,6 +501,7 @@ async def register_board(request: Request, board_id: str, client: AuthenticatedC
             secret_key_hash=hashed_key,
             wifi_encryption_key=wifi_key,
         )
+        invalidate_board(board_id)
 
         if not updated_board:
             raise HTTPException(status_code=404, detail="Board not found!")
@@ -480,51 +555,38 @@ async def update_board_settings(
         except (ValueError, TypeError):
             pass
 
-    # Persist settings in database
-    try:
-        if hasattr(q, "updateBoardSettings"):
-            board = await q.updateBoardSettings(
-                client,
-                board_id=board_id,
-                display_mode=update_kwargs.get("display_mode"),
-                auto_rotate=update_kwargs.get("auto_rotate"),
-                brightness=update_kwargs.get("brightness"),
-            )
-        else:
-            board = await q.selectGlobalUserBoard(client, board_id=board_id)
-    except Exception as e:
-        logger.error(f"Error updating board settings: {e}")
-        board = await q.selectGlobalUserBoard(client, board_id=board_id)
+    commands = []
+    if display_mode is not None:
+        commands.append(("control", build_set_mode(display_mode)))
+    if auto_rotate is not None:
+        commands.append(("control", build_set_auto_rotate(auto_rotate.lower() == "true")))
+    if "brightness" in update_kwargs:
+        commands.append(("control", build_set_brightness(update_kwargs["brightness"])))
 
-    # Publish control commands to board via Ably
+    # Persist settings and queue the matching control commands in one transaction
     try:
-        ably_key = os.getenv("ABLY_API_KEY", "")
-        if ably_key and board:
-            from ably import AblyRest
-
-            ably = AblyRest(ably_key)
-            user = await q.selectGlobalUser(client)
-            if user:
-                command_channel = ably.channels.get(f"commands:{user.id}")
-
-                if display_mode is not None:
-                    await command_channel.publish(
-                        "control", build_set_mode(display_mode)
-                    )
-
-                if auto_rotate is not None:
-                    await command_channel.publish(
-                        "control",
-                        build_set_auto_rotate(auto_rotate.lower() == "true"),
-                    )
-
-                if "brightness" in update_kwargs:
-                    await command_channel.publish(
-                        "control",
-                        build_set_brightness(update_kwargs["brightness"]),
+        async for tx in client.transaction():
+            async with tx:
+                if hasattr(q, "updateBoardSettings"):
+                    board = await q.updateBoardSettings(
+                        tx,
+                        board_id=board_id,
+                        display_mode=update_kwargs.get("display_mode"),
+                        auto_rotate=update_kwargs.get("auto_rotate"),
+                        brightness=update_kwargs.get("brightness"),
                     )
+                else:
+                    board = await q.selectGlobalUserBoard(tx, board_id=board_id)
+
+                if ably_publisher.configured and board and commands:
+                    user = await q.selectGlobalUserProfile(tx)
+                    if user:
+                        await enqueue_commands(tx, f"commands:{user.id}", commands)
+        command_dispatcher.notify()
     except Exception as e:
-        logger.warning(f"Ably command publish failed (non-fatal): {e}")
+        logger.error(f"Error updating board settings: {e}")
+        board = await q.selectGlobalUserBoard(client, board_id=board_id)
+    invalidate_board(board_id)
 
     # Return only the control panel fragment for HTMX outerHTML swap
     context = get_context(
@@ -564,6 +626,7 @@ async def update_board_ota(
     except Exception as e:
         logger.error(f"Error updating OTA enabled for board {board_id}: {e}")
         board = await q.selectGlobalUserBoard(client, board_id=board_id)
+    invalidate_board(board_id)
 
     context = get_context(
         request,
@@ -586,15 +649,13 @@ async def board_sync_request(
 ):
     """Send a sync request command to the board via Ably."""
     try:
-        ably_key = os.getenv("ABLY_API_KEY", "")
-        if ably_key:
-            from ably import AblyRest
-
-            ably = AblyRest(ably_key)
-            user = await q.selectGlobalUser(client)
+        if ably_publisher.configured:
+            user = await q.selectGlobalUserProfile(client)
             if user:
-                command_channel = ably.channels.get(f"commands:{user.id}")
-                await command_channel.publish("control", build_sync_request())
+                await enqueue_command(
+                    client, f"commands:{user.id}", "control", build_sync_request()
+                )
+                command_dispatcher.notify()
 
         return HTMLResponse(
             '<p class="text-pico-green text-xs">Sync request sent to board.</p>'
@@ -620,37 +681,33 @@ async def board_push_command(
 ):
     """Publish a control command to the board via Ably."""
     try:
-        ably_key = os.getenv("ABLY_API_KEY", "")
-        if not ably_key:
+        if not ably_publisher.configured:
             return HTMLResponse(
                 '<span class="text-red-400">Ably not configured</span>',
                 status_code=503,
             )
 
-        from ably import AblyRest
-
-        ably = AblyRest(ably_key)
-        user = await q.selectGlobalUser(client)
+        user = await q.selectGlobalUserProfile(client)
         if not user:
             return HTMLResponse(
                 '<span class="text-red-400">User not found</span>',
                 status_code=401,
             )
 
-        command_channel = ably.channels.get(f"commands:{user.id}")
-
         # Map command string to typed envelope
         if command == "sync_request":
-            await command_channel.publish("control", build_sync_request())
+            envelope = build_sync_request()
         elif command == "skip_next":
-            await command_channel.publish("control", build_skip_next())
+            envelope = build_skip_next()
         elif command == "skip_prev":
-            await command_channel.publish("control", build_skip_prev())
+            envelope = build_skip_prev()
         else:
             return HTMLResponse(
                 f'<span class="text-red-400">Unknown command: {command}</span>',
                 status_code=400,
             )
+        await enqueue_command(client, f"commands:{user.id}", "control", envelope)
+        command_dispatcher.notify()
 
         return HTMLResponse('<span class="text-pico-green">Command sent</span>')
 
@@ -703,23 +760,18 @@ async def send_board_wifi(
     networks = [{"ssid": ssid, "password": wifi_password, "priority": priority}]
 
     try:
-        ably_key = os.getenv("ABLY_API_KEY", "")
-        if not ably_key:
+        if not ably_publisher.configured:
             return HTMLResponse(
                 '<div class="text-red-400 text-xs p-2">Ably not configured.</div>',
                 status_code=503,
             )
 
-        from ably import AblyRest
-
-        ably = AblyRest(ably_key)
-        user = await q.selectGlobalUser(client)
+        user = await q.selectGlobalUserProfile(client)
         if not user:
             raise HTTPException(status_code=401)
 
-        command_channel = ably.channels.get(f"commands:{user.id}")
         encrypted_cmd = build_wifi_update(networks, wifi_key)
-        await command_channel.publish("control", encrypted_cmd)
+        await ably_publisher.publish(f"commands:{user.id}", "control", encrypted_cmd)
 
         return HTMLResponse(
             '<div class="text-pico-green text-xs p-2">'
@@ -875,7 +927,7 @@ async def delete_friend(friend_id: str, client: AuthenticatedClient):
 @router.get("/avatar/edit", response_class=HTMLResponse, name="app.avatar_edit")
 async def avatar_edit(request: Request, client: AuthenticatedClient):
     templates = get_templates(request)
-    user = await q.selectGlobalUser(client)
+    user = await q.selectGlobalUserProfile(client)
     context = get_context(request, user=user)
     return templates.TemplateResponse("app/pixel/avatar-editor.html", context)
 
@@ -883,35 +935,22 @@ async def avatar_edit(request: Request, client: AuthenticatedClient):
 @router.get("/message/compose", response_class=HTMLResponse, name="app.message_compose")
 async def message_compose(request: Request, client: AuthenticatedClient):
     templates = get_templates(request)
-    friends = await q.selectFriends(client)
+    # Friends and their boards (grouped by board type) in one round trip.
+    friends = await q.selectFriendsWithBoards(client)
     friend_boards = {}
     for rel in friends:
-        try:
-            boards = await client.query(
-                """
-                select Board {
-                  id,
-                  name,
-                  boardType
-                }
-                filter .owner.id = <uuid>$user_id
-                order by .name
-                """,
-                user_id=rel.friend.id,
-            )
-            friend_boards[str(rel.friend.id)] = [
-                {
-                    "id": str(board.id),
-                    "name": board.name,
-                    "boardType": board.boardType.value
-                    if hasattr(board.boardType, "value")
-                    else str(board.boardType),
-                }
-                for board in boards
-            ]
-        except Exception as e:
-            logger.error(f"Error loading boards for friend {rel.friend.id}: {e}")
-            friend_boards[str(rel.friend.id)] = []
+        if rel.friend is None:
+            continue
+        friend_boards[str(rel.friend.id)] = [
+            {
+                "id": str(board.id),
+                "name": board.name,
+                "boardType": board.boardType.value
+                if hasattr(board.boardType, "value")
+                else str(board.boardType),
+            }
+            for board in rel.friend.boards
+        ]
 
     context = get_context(request, friends=friends, friend_boards=friend_boards)
     return templates.TemplateResponse("app/pixel/message-composer.html", context)
@@ -1086,7 +1125,7 @@ async def reset_draft(
         board_type = size_map.get(size, "Galactic")
 
         # Delete existing draft if any
-        existing = await q.selectDraft(client, board_id=board_id if board_id else None)
+        existing = await q.selectDraftMeta(client, board_id=board_id if board_id else None)
         if existing:
             await q.deleteDraft(client, draft_id=existing.id)
 
@@ -1128,10 +1167,22 @@ async def finish_draft(
         )
 
 
+async def _pre_encode_space_pack(graphic_id, png_bytes: bytes, frames: int) -> None:
+    """Warm the Space Pack cache for a graphic that was just sent (best effort)."""
+    try:
+        if await space_pack_cache.get(graphic_id) is None:
+            await space_pack_encoder.encode(graphic_id, png_bytes, frames)
+    except EncoderBusy:
+        logger.info("Space Pack pre-encode skipped: encoder busy")
+    except Exception as cache_err:
+        logger.warning(f"Space Pack pre-encode failed (non-fatal): {cache_err}")
+
+
 @router.post("/message/send", response_class=HTMLResponse, name="app.send_message")
 async def send_message(
     request: Request,
     client: AuthenticatedClient,
+    background_tasks: BackgroundTasks,
     recipient_id: str = Form(None),
     board_id: str = Form(None),
     draft_id: str = Form(None),
@@ -1166,40 +1217,42 @@ async def send_message(
             )
 
         if hasattr(q, "insertMessageWithBoard"):
-            message_result = await q.insertMessageWithBoard(
-                client,
-                graphic_id=graphic_id,
-                recipient_id=UUID(recipient_id),
-            )
-
-            # Publish Ably command to notify recipient's boards
-            try:
-                ably_key = os.getenv("ABLY_API_KEY", "")
-                if ably_key and message_result:
-                    from ably import AblyRest
-
-                    ably = AblyRest(ably_key)
-
-                    # Determine dimensions from draft size
-                    size_str = str(draft.size.value) if hasattr(draft.size, "value") else str(draft.size)
-                    if size_str == "Stellar":
-                        width, height = 16, 16
-                    elif size_str == "Galactic":
-                        width, height = 53, 11
-                    else:
-                        width, height = 32, 32
-
-                    command_channel = ably.channels.get(f"commands:{recipient_id}")
-                    await command_channel.publish("new_message", build_message_sync(
-                        message_id=str(message_result.id),
-                        width=width,
-                        height=height,
-                        frames=draft.frames,
-                        fps=draft.fps,
-                    ))
-                    logger.info(f"Ably command published for message {message_result.id}")
-            except Exception as ably_err:
-                logger.warning(f"Ably command publish failed (non-fatal): {ably_err}")
+            # Determine dimensions from draft size
+            size_str = str(draft.size.value) if hasattr(draft.size, "value") else str(draft.size)
+            if size_str == "Stellar":
+                width, height = 16, 16
+            elif size_str == "Galactic":
+                width, height = 53, 11
+            else:
+                width, height = 32, 32
+
+            # The message and the command notifying the recipient's boards
+            # commit together; the outbox dispatcher publishes it to Ably.
+            async for tx in client.transaction():
+                async with tx:
+                    message_result = await q.insertMessageWithBoard(
+                        tx,
+                        graphic_id=graphic_id,
+                        recipient_id=UUID(recipient_id),
+                    )
+                    if ably_publisher.configured and message_result:
+                        await enqueue_command(
+                            tx,
+                            f"commands:{recipient_id}",
+                            "new_message",
+                            build_message_sync(
+                                message_id=str(message_result.id),
+                                width=width,
+                                height=height,
+                                frames=draft.frames,
+                                fps=draft.fps,
+                            ),
+                        )
+            command_dispatcher.notify()
+
+        # Pre-encode the Space Pack after the response so the recipient's
+        # boards hit a warm cache without the sender waiting on the encode.
+        background_tasks.add_task(_pre_encode_space_pack, graphic_id, draft.binary, draft.frames)
 
         if request.headers.get("HX-Request"):
             response = HTMLResponse('<span class="text-pico-green">Message sent!</span>')
@@ -1289,6 +1342,7 @@ async def delete_graphic(
     """Delete a finished pixel graphic by ID."""
     try:
         await q.deletePixelGraphic(client, graphic_id=graphic_id)
+        space_pack_store.invalidate(graphic_id)
         if request.headers.get("HX-Request"):
             return Response(content="", status_code=200)
         response = Response(content="", status_code=204)
@@ -1310,6 +1364,7 @@ async def delete_message(
     """Delete a received message (recipient-side only). Leaves the sender's original graphic intact."""
     try:
         await q.deleteRecipientMessage(client, message_id=UUID(message_id))
+        space_pack_store.invalidate(message_id)
         if request.headers.get("HX-Request"):
             return Response(content="", status_code=200)
         response = Response(content="", status_code=204)
@@ -1327,258 +1382,388 @@ async def delete_message(
 # =============================================================================
 
 
+async def _load_space_pack(request: Request, item_id: str, version: int) -> Tuple[bytes, str]:
+    """
+    Return (pack, etag) for a Message or PixelGraphic ID at the given SP version.
+
+    Finished packs come from space_pack_store without a Gel round trip. On a
+    miss, encoded pixels are served from the Space Pack cache; the PNG is
+    only fetched and decoded (on the encoder pool) when that misses too.
+    Raises 404 if the item does not exist and 503 (with Retry-After) when
+    the encoder queue is full.
+    """
+    base_client = request.app.state.get_base_client()
+
+    try:
+        item_uuid = UUID(item_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Graphic not found")
+
+    stored = space_pack_store.get(item_uuid, version)
+    if stored is not None:
+        return stored
+
+    # The ID may be a Message (Ably commands) or a PixelGraphic (boot sync).
+    try:
+        source = await q.selectSpacePackSource(base_client, item_id=item_uuid)
+    except Exception as e:
+        logger.error(f"Space Pack query error: {e}")
+        raise HTTPException(status_code=500, detail="Internal error")
+
+    if not source:
+        raise HTTPException(status_code=404, detail="Graphic not found")
+
+    pixel_bytes = await space_pack_cache.get(source.id)
+    if pixel_bytes is None:
+        graphic_binary = await q.selectGraphicBinary(base_client, graphic_id=source.id)
+        if not graphic_binary:
+            raise HTTPException(status_code=404, detail="Graphic not found")
+        try:
+            pixel_bytes = await space_pack_encoder.encode(
+                source.id, graphic_binary, source.frames
+            )
+        except EncoderBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="Space Pack encoder busy",
+                headers={"Retry-After": "2"},
+            )
+
+    def _build() -> Tuple[bytes, str]:
+        pack = build_space_pack(
+            item_id, pixel_bytes, sender=source.sender, fps=source.fps,
+            frames=source.frames, version=version,
+        )
+        return space_pack_store.put(item_uuid, version, pack)
+
+    # Palette indexing and the ETag hash are CPU work; keep them off the loop
+    return await run_in_threadpool(_build)
+
+
 @router.get("/space-pack/{message_id}", name="app.space_pack")
 async def space_pack(
     request: Request,
     message_id: str,
     x_board_id: str = Header(None, alias="X-Board-Id"),
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
 ):
     """
     Serve the Space Pack binary for a message.
-    Authenticated via board secret key headers.
-
-    SP binary format:
-    | Offset | Field      | Size | Type   |
-    | 0      | Magic "SP" | 2B   | Char   |
-    | 2      | Message ID | 16B  | UUID   |
-    | 18     | Meta Len   | 2B   | uint16 |
-    | 20     | Pixel Len  | 4B   | uint32 |
-    | 24     | Metadata   | Var  | JSON   |
-    | End    | Pixel Data | Var  | RGB    |
-    """
-    # Authenticate the board
-    if not x_board_id or not x_board_secret:
-        raise HTTPException(status_code=401, detail="Missing board credentials")
+    Authenticated via board session token or secret key headers.
 
-    base_client = request.app.state.get_base_client()
+    See api.space_pack.build_space_pack for the SP binary format. Boards that
+    send `Accept: application/vnd.spaceos.space-pack; v=2` get the
+    palette-indexed SP v2 layout (v=3 adds delta-encoded animation frames);
+    everyone else gets v1.
 
-    try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(x_board_id))
-    except Exception:
-        board = None
+    Supports single-range `Range` requests (with `If-Range` against the
+    ETag) so boards can resume an interrupted download. Ranges and the ETag
+    come from the stored pack, so each resumed chunk costs a slice, not a
+    rebuild and re-hash.
+    """
+    await authenticate_board(request, x_board_id, x_board_secret, x_board_token)
+
+    version = negotiate_version(request.headers.get("Accept"))
+    sp_data, etag = await _load_space_pack(request, message_id, version)
+    headers = {
+        "Content-Disposition": f"attachment; filename=sp-{message_id}.bin",
+        "Cache-Control": "no-cache",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Vary": "Accept",
+    }
 
-    if not board or not board.secret_key_hash:
-        raise HTTPException(status_code=403, detail="Invalid board")
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_byte_range(range_header, len(sp_data))
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{len(sp_data)}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(sp_data)}"
+        return Response(
+            content=sp_data[start:end + 1],
+            status_code=206,
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
+    return Response(
+        content=sp_data,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
 
-    from werkzeug.security import check_password_hash
 
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        raise HTTPException(status_code=403, detail="Invalid secret key")
+def _parse_byte_range(range_header: str, size: int):
+    """
+    Parse a single-range `Range: bytes=...` header into an inclusive
+    (start, end) pair, or None if it is malformed or unsatisfiable.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+@router.post("/space-packs", name="app.space_pack_batch")
+async def space_pack_batch(
+    request: Request,
+    x_board_id: str = Header(None, alias="X-Board-Id"),
+    x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
+):
+    """
+    Stream several Space Packs back-to-back over one connection, so a board
+    catching up after a long offline period pays for one TLS handshake.
 
-    # Try fetching as a Message first, then fall back to PixelGraphic directly.
-    # The sync endpoint returns PixelGraphic IDs, while Ably commands return Message IDs.
-    msg = None
-    graphic_row = None
+    Expected payload: {"ids": ["uuid", ...]} (at most SPACE_PACK_BATCH_MAX).
+    See api.space_pack.batch_record for the framing. Items that are missing
+    or cannot be encoded right now get a status-only record; the board
+    retries those on its next sync.
+    """
+    await authenticate_board(request, x_board_id, x_board_secret, x_board_token)
 
     try:
-        msg = await q.selectMessageForSpacePack(base_client, message_id=UUID(message_id))
-    except Exception:
-        pass
-
-    if msg:
-        graphic_binary = msg.graphic_binary
-        frames = msg.graphic_frames
-        fps = msg.graphic_fps
-        sender = msg.sender_username or "Unknown"
-    else:
-        # Fall back to PixelGraphic lookup (for artwork synced at boot)
-        try:
-            graphic_row = await base_client.query_single(
-                """\
-                select PixelGraphic {
-                  id,
-                  binary,
-                  size,
-                  frames := [is PixelAnimation].frames ?? <int16>1,
-                  fps := [is PixelAnimation].fps ?? <int16>10,
-                  creator_name := .creator.username ?? "Unknown"
-                }
-                filter .id = <uuid>$graphic_id
-                limit 1\
-                """,
-                graphic_id=UUID(message_id),
-            )
-        except Exception as e:
-            logger.error(f"Space Pack query error: {e}")
-            raise HTTPException(status_code=500, detail="Internal error")
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
 
-        if not graphic_row:
-            raise HTTPException(status_code=404, detail="Graphic not found")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object")
 
-        graphic_binary = graphic_row.binary
-        frames = graphic_row.frames
-        fps = graphic_row.fps
-        sender = graphic_row.creator_name
-
-    # Build SP binary
-    # Metadata JSON
-    meta = json.dumps({
-        "sender": sender,
-        "fps": fps,
-        "is_anim": frames > 1,
-    }).encode("utf-8")
-
-    # Raw pixel data from PNG -> extract RGB888
-    # The graphic binary is stored as PNG, we need to decode it to raw RGB.
-    # Images may have alpha transparency. The web UI (pixel.js) renders using
-    # canvas getImageData() which returns pre-multiplied alpha — so semi-transparent
-    # pixels appear darker (blended against a black background). We must match
-    # that behavior here by compositing RGBA onto black before extracting RGB.
-    from PIL import Image
-    import io
-
-    img = Image.open(io.BytesIO(graphic_binary))
-    if img.mode == "RGBA":
-        background = Image.new("RGB", img.size, (0, 0, 0))
-        background.paste(img, mask=img.split()[3])
-        img = background
-    else:
-        img = img.convert("RGB")
-
-    # Animations are stored as HORIZONTAL spritesheets (frames side-by-side).
-    # The board expects frames as sequential blocks of (frame_width * frame_height * 3) bytes.
-    # We need to crop each frame from the spritesheet and concatenate their RGB data.
-    if frames > 1:
-        frame_width = img.width // frames
-        frame_height = img.height
-        pixel_bytes = bytearray()
-        for i in range(frames):
-            left = i * frame_width
-            frame_img = img.crop((left, 0, left + frame_width, frame_height))
-            pixel_bytes.extend(frame_img.tobytes())
-        pixel_bytes = bytes(pixel_bytes)
-    else:
-        pixel_bytes = img.tobytes()
-
-    # UUID as 16 raw bytes
-    raw_uuid = UUID(message_id).bytes
-
-    # Build the binary package
-    meta_len = len(meta)
-    pixel_len = len(pixel_bytes)
-
-    sp_data = bytearray()
-    sp_data.extend(b"SP")                              # Magic (2B)
-    sp_data.extend(raw_uuid)                           # Message ID (16B)
-    sp_data.extend(struct.pack(">H", meta_len))        # Meta length (2B, uint16 BE)
-    sp_data.extend(struct.pack(">I", pixel_len))        # Pixel length (4B, uint32 BE)
-    sp_data.extend(meta)                               # Metadata (variable)
-    sp_data.extend(pixel_bytes)                        # Pixel data (variable)
+    ids = body.get("ids") or []
+    if not isinstance(ids, list) or len(ids) > SPACE_PACK_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ids must be a list of at most {SPACE_PACK_BATCH_MAX} IDs",
+        )
 
-    return Response(
-        content=bytes(sp_data),
+    version = negotiate_version(request.headers.get("Accept"))
+
+    async def _stream():
+        for item_id in ids:
+            try:
+                sp_data, _ = await _load_space_pack(request, str(item_id), version)
+            except HTTPException as exc:
+                status = BATCH_NOT_FOUND if exc.status_code == 404 else BATCH_FAILED
+                yield batch_record(status)
+                continue
+            except Exception as e:
+                # Keep the framing intact: the board must still get one record
+                # per id and the BATCH_END that tells it the batch is complete.
+                logger.error(f"Space Pack batch item {item_id} failed: {e}")
+                yield batch_record(BATCH_FAILED)
+                continue
+            yield batch_record(BATCH_OK, sp_data)
+        yield batch_record(BATCH_END)
+
+    return StreamingResponse(
+        _stream(),
         media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename=sp-{message_id}.bin",
-            "Cache-Control": "no-cache",
-        },
+        headers={"Cache-Control": "no-cache"},
     )
 
 
-@router.get("/boards/{board_id}/sync", name="app.board_sync")
-async def board_sync(
+@router.post("/boards/{board_id}/session", name="app.board_session")
+async def board_session(
     request: Request,
     board_id: str,
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
 ):
     """
-    Return recent messages for a board's owner, filtered to the board's size.
-    Used by SpaceOS at boot to sync missed messages.
-    Authenticated via board secret key header.
+    Board session handshake: verify the board secret once (scrypt) and return
+    a short-lived signed token for the X-Board-Token header.
     """
     if not x_board_secret:
         raise HTTPException(status_code=401, detail="Missing board secret")
 
-    base_client = request.app.state.get_base_client()
+    identity = await check_board_secret(request, board_id, x_board_secret)
+    return JSONResponse({
+        "token": issue_board_token(identity),
+        "expires_in": BOARD_TOKEN_TTL_SECONDS,
+    })
 
-    try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(board_id))
-    except Exception:
-        board = None
 
-    if not board or not board.secret_key_hash:
-        raise HTTPException(status_code=403, detail="Invalid board")
+_BOARD_SIZES = {"Stellar": (16, 16), "Galactic": (53, 11), "Cosmic": (32, 32)}
+# Inbox page size; matches the limit in selectBoardSync.edgeql.
+_BOARD_SYNC_INBOX_LIMIT = 5
 
-    from werkzeug.security import check_password_hash
 
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        raise HTTPException(status_code=403, detail="Invalid secret key")
+def _parse_board_ids(values) -> list:
+    """
+    Parse a list of UUID strings (dashed or 32-hex) from a board, dropping
+    junk entries. Raises 400 if values is neither a list nor missing.
+    """
+    if values is not None and not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="art and inbox must be lists of IDs")
+    ids = []
+    for value in values or []:
+        try:
+            ids.append(UUID(str(value)))
+        except ValueError:
+            continue
+    return ids
 
-    owner_id = board.owner_id
-    board_size = str(board.boardType.value) if hasattr(board.boardType, "value") else str(board.boardType)
 
-    # Determine board dimensions
-    size_map = {"Stellar": (16, 16), "Galactic": (53, 11), "Cosmic": (32, 32)}
-    board_width, board_height = size_map.get(board_size, (32, 32))
+async def _select_board_sync(request: Request, board, art_ids=(), inbox_ids=(), before=None):
+    """
+    Run the combined sync query for a board. Returns (art, inbox, state) where
+    art/inbox are SpaceOS item dicts and state is the query result (or None
+    if the query failed). before is an optional (sent_at, id) keyset cursor
+    for paging the inbox back past its newest items.
+    """
+    before_sent_at, before_id = before or (None, None)
+    base_client = request.app.state.get_base_client()
+    board_width, board_height = _BOARD_SIZES.get(board.board_type, (32, 32))
+
+    try:
+        state = await q.selectBoardSync(
+            base_client,
+            owner_id=UUID(board.owner_id),
+            board_size=BoardType(board.board_type),
+            inbox_before_sent_at=before_sent_at,
+            inbox_before_id=before_id,
+            art_ids=list(art_ids),
+            inbox_ids=list(inbox_ids),
+        )
+    except Exception as e:
+        logger.error(f"Board sync query error: {e}")
+        return [], [], None
 
-    def _to_item(row, width, height):
+    def _to_item(row):
         return {
             "messageId": str(row.id),
-            "width": width,
-            "height": height,
+            "width": board_width,
+            "height": board_height,
             "frames": row.frames,
             "fps": row.fps,
         }
 
-    # 1. Owner's own artwork (StaticImage + PixelAnimation, excluding drafts/avatars)
-    try:
-        graphics = await base_client.query(
-            """\
-            select PixelGraphic {
-              id,
-              size,
-              created_at,
-              frames := [is PixelAnimation].frames ?? <int16>1,
-              fps := [is PixelAnimation].fps ?? <int16>10,
-            }
-            filter .creator.id = <uuid>$owner_id
-               and .size = <BoardType>$board_size
-               and not .id in (select DraftGraphic.id)
-               and not .id in (select Avatar.id)
-            order by .created_at desc
-            limit 5\
-            """,
-            owner_id=owner_id,
-            board_size=board_size,
-        )
-    except Exception as e:
-        logger.error(f"Board sync art query error: {e}")
-        graphics = []
+    art = [_to_item(row) for row in state.art]
+    inbox = [_to_item(row) for row in state.inbox]
+    return art, inbox, state
+
+
+def _sync_cursor(art: list, inbox: list) -> str:
+    """Opaque cursor identifying the server-side sync set."""
+    digest = hashlib.sha256()
+    for item in art:
+        digest.update(b"a" + item["messageId"].encode("ascii"))
+    for item in inbox:
+        digest.update(b"i" + item["messageId"].encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+@router.get("/boards/{board_id}/sync", name="app.board_sync")
+async def board_sync(
+    request: Request,
+    board_id: str,
+    x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
+    before: str = Query(None),
+):
+    """
+    Return recent messages for a board's owner, filtered to the board's size.
+    Used by SpaceOS firmware without delta sync support to sync missed messages.
+    Authenticated via board session token or secret key header.
+
+    When the inbox page is full, "next" is a cursor; pass it back as ?before=
+    to get the older messages.
+    """
+    board = await authenticate_board(request, board_id, x_board_secret, x_board_token)
+    cursor = _decode_cursor(before) if before else None
+    art_list, inbox_list, state = await _select_board_sync(request, board, before=cursor)
+    body = {"art": art_list, "inbox": inbox_list}
+    if state is not None and len(state.inbox) == _BOARD_SYNC_INBOX_LIMIT:
+        last = state.inbox[-1]
+        if last.sent_at:
+            body["next"] = _encode_cursor(last.sent_at, last.id)
+    return JSONResponse(body)
+
+
+@router.post("/boards/{board_id}/sync", name="app.board_delta_sync")
+async def board_delta_sync(
+    request: Request,
+    board_id: str,
+    x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
+):
+    """
+    Delta sync: the board posts what it already has and gets back only the
+    difference. Authenticated via board session token or secret key header.
+
+    Expected payload (IDs may omit dashes):
+    {
+        "art": ["uuid", ...],        # IDs stored in /art
+        "inbox": ["uuid", ...],      # IDs stored in /inbox
+        "cursor": "..." | null       # cursor from the last complete sync
+    }
+
+    Returns 204 when the board is up to date and its cursor is current, else:
+    {
+        "missing": {"art": [item, ...], "inbox": [item, ...]},
+        "deleted": {"art": ["uuid", ...], "inbox": ["uuid", ...]},
+        "cursor": "..."
+    }
+    where items have the same shape as GET /sync. The board should persist
+    the cursor only once every missing item has been downloaded.
+    """
+    board = await authenticate_board(request, board_id, x_board_secret, x_board_token)
 
-    # 2. Messages sent TO this user with matching graphic size
     try:
-        messages = await base_client.query(
-            """\
-            select Message {
-              id,
-              graphic: {
-                size,
-                frames := [is PixelAnimation].frames ?? <int16>1,
-                fps := [is PixelAnimation].fps ?? <int16>10
-              }
-            }
-            filter .recipient.id = <uuid>$owner_id
-               and .graphic.size = <BoardType>$board_size
-            order by .sent_at desc
-            limit 5\
-            """,
-            owner_id=owner_id,
-            board_size=board_size,
-        )
-    except Exception as e:
-        logger.error(f"Board sync inbox query error: {e}")
-        messages = []
-
-    art_list = [_to_item(g, board_width, board_height) for g in graphics]
-    inbox_list = []
-    for m in messages:
-        inbox_list.append({
-            "messageId": str(m.id),
-            "width": board_width,
-            "height": board_height,
-            "frames": m.graphic.frames,
-            "fps": m.graphic.fps,
-        })
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object")
 
-    return JSONResponse({"art": art_list, "inbox": inbox_list})
+    have_art = _parse_board_ids(body.get("art"))
+    have_inbox = _parse_board_ids(body.get("inbox"))
+
+    art_list, inbox_list, state = await _select_board_sync(
+        request, board, have_art, have_inbox
+    )
+    if state is None:
+        raise HTTPException(status_code=503, detail="Sync unavailable")
+
+    existing_art = set(state.existing_art)
+    existing_inbox = set(state.existing_inbox)
+    have_art_set = {str(i) for i in have_art}
+    have_inbox_set = {str(i) for i in have_inbox}
+
+    missing_art = [item for item in art_list if item["messageId"] not in have_art_set]
+    missing_inbox = [item for item in inbox_list if item["messageId"] not in have_inbox_set]
+    deleted_art = [str(i) for i in have_art if i not in existing_art]
+    deleted_inbox = [str(i) for i in have_inbox if i not in existing_inbox]
+
+    cursor = _sync_cursor(art_list, inbox_list)
+    changed = missing_art or missing_inbox or deleted_art or deleted_inbox
+    if not changed and body.get("cursor") == cursor:
+        return Response(status_code=204)
+
+    return JSONResponse({
+        "missing": {"art": missing_art, "inbox": missing_inbox},
+        "deleted": {"art": deleted_art, "inbox": deleted_inbox},
+        "cursor": cursor,
+    })
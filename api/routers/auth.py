@@ -202,7 +202,7 @@ async def callback_signin(request: Request, client: Client):
         scoped_client = client.with_globals(
             {"ext::auth::client_token": auth_token}
         )
-        existing_user = await q.selectGlobalUser(scoped_client)
+        existing_user = await q.selectGlobalUserProfile(scoped_client)
         if not existing_user:
             logger.info("No User record found for identity — creating one")
             try:
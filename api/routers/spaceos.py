@@ -5,18 +5,33 @@ The pre-signed bundle (spaceos-update.bin) is committed to the repo and never
 generated or signed here. This module:
   - Reads spaceos-update.bin from the project root at startup.
   - Computes its SHA-256 hash once and caches it.
-  - Serves GET /api/spaceos/check for board-authenticated OTA checks.
+  - Serves GET /api/spaceos/check for board-authenticated OTA checks, sending
+    the bundle only to boards the staged rollout (api/ota_rollout.py) has
+    released.
+  - Serves POST /api/spaceos/delta, which returns the signed per-file manifest
+    (spaceos-manifest.bin) plus only the files whose hashes differ from the
+    board's installed manifest. Boards whose MicroPython bytecode ABI matches
+    spaceos-manifest.mpy.bin get precompiled .mpy modules from
+    spaceos-update.mpy.bin instead.
+
+Boards that send `Accept: application/vnd.spaceos.bundle+deflate` get the
+compressed variant of either response, labelled with that Content-Type:
+spaceos-update.deflate.bin (signed over the compressed payload) from /check,
+and a zlib-compressed file list from /delta.
 """
+import functools
 import hashlib
+import json
 import logging
 import os
-from uuid import UUID
+import struct
+import zlib
 
-from fastapi import APIRouter, Header, Query, Request
-from fastapi.responses import Response
-from werkzeug.security import check_password_hash
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
 
-import api.queries as q
+from api.board_auth import authenticate_board, ota_updates_allowed
+from api.ota_rollout import ota_rollout
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -26,9 +41,39 @@ _BUNDLE_PATH = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "..", "spaceos-update.bin")
 )
 
+_MANIFEST_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "spaceos-manifest.bin")
+)
+_MPY_MANIFEST_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "spaceos-manifest.mpy.bin")
+)
+_MPY_BUNDLE_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "spaceos-update.mpy.bin")
+)
+
+_DEFLATE_BUNDLE_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "spaceos-update.deflate.bin")
+)
+
+BUNDLE_DEFLATE_MEDIA_TYPE = "application/vnd.spaceos.bundle+deflate"
+
+# Window bits for compressed delta file lists. Must match sign_spaceos.py:
+# a 4 KB window keeps the board's inflate buffer small.
+_DEFLATE_WBITS = 12
+
 # Cached (bundle_bytes, sha256_hex) — loaded once on first request (or at startup).
 _bundle_cache: tuple[bytes, str] | None = None
 _bundle_loaded: bool = False
+_bundle_stat: os.stat_result | None = None
+
+# Cached (signed_manifest, manifest, files) per delta variant ("source" or
+# "mpy"), where signed_manifest is the 64-byte signature + manifest JSON
+# exactly as signed and files maps each bundled filename to its content.
+_manifest_cache: dict[str, tuple[bytes, dict, dict[str, bytes]] | None] = {}
+
+# Cached (sha256_hex, stat) of spaceos-update.deflate.bin.
+_deflate_cache: tuple[str, os.stat_result] | None = None
+_deflate_loaded: bool = False
 
 
 def load_bundle() -> tuple[bytes, str] | None:
@@ -36,7 +81,7 @@ def load_bundle() -> tuple[bytes, str] | None:
     Load spaceos-update.bin and cache (bytes, sha256_hex).
     Returns None if no bundle exists.
     """
-    global _bundle_cache, _bundle_loaded
+    global _bundle_cache, _bundle_loaded, _bundle_stat
     if _bundle_loaded:
         return _bundle_cache
 
@@ -46,6 +91,7 @@ def load_bundle() -> tuple[bytes, str] | None:
         return None
 
     bundle_bytes = open(_BUNDLE_PATH, "rb").read()
+    _bundle_stat = os.stat(_BUNDLE_PATH)
     bundle_hash = hashlib.sha256(bundle_bytes).hexdigest()
     _bundle_cache = (bundle_bytes, bundle_hash)
     logger.info(
@@ -55,6 +101,195 @@ def load_bundle() -> tuple[bytes, str] | None:
     return _bundle_cache
 
 
+def _bundle_files(payload: bytes) -> dict[str, bytes]:
+    """Split a bundle payload (everything after the signature) into its files."""
+    (count,) = struct.unpack_from(">I", payload, 0)
+    offset = 4
+    files = {}
+    for _ in range(count):
+        (name_len,) = struct.unpack_from(">H", payload, offset)
+        offset += 2
+        name = payload[offset:offset + name_len].decode("utf-8")
+        offset += name_len
+        (size,) = struct.unpack_from(">I", payload, offset)
+        offset += 4
+        files[name] = payload[offset:offset + size]
+        offset += size
+    return files
+
+
+def load_deflate_bundle() -> tuple[str, os.stat_result] | None:
+    """
+    Load spaceos-update.deflate.bin and cache (sha256_hex, stat).
+
+    Returns None when there is no compressed bundle or it does not inflate to
+    the current bundle's payload.
+    """
+    global _deflate_cache, _deflate_loaded
+    if _deflate_loaded:
+        return _deflate_cache
+
+    _deflate_loaded = True
+    bundle = load_bundle()
+    if bundle is None or not os.path.exists(_DEFLATE_BUNDLE_PATH):
+        return None
+
+    compressed = open(_DEFLATE_BUNDLE_PATH, "rb").read()
+    try:
+        payload = zlib.decompress(compressed[64:])
+    except zlib.error as e:
+        logger.error(f"Could not inflate spaceos-update.deflate.bin: {e}")
+        return None
+    if payload != bundle[0][64:]:
+        logger.error("spaceos-update.deflate.bin does not match spaceos-update.bin — compressed OTA disabled")
+        return None
+
+    _deflate_cache = (hashlib.sha256(compressed).hexdigest(), os.stat(_DEFLATE_BUNDLE_PATH))
+    logger.info(
+        f"SpaceOS compressed bundle loaded: {len(compressed)} bytes "
+        f"({len(bundle[0])} uncompressed)"
+    )
+    return _deflate_cache
+
+
+def accepts_deflate(accept: str | None) -> bool:
+    """Whether the board's Accept header lists the compressed bundle type."""
+    return any(
+        media_range.partition(";")[0].strip().lower() == BUNDLE_DEFLATE_MEDIA_TYPE
+        for media_range in (accept or "").split(",")
+    )
+
+
+def _canonical_hash(board_hash: str, bundle_hash: str) -> str:
+    """
+    A board that installed the compressed bundle records its hash as os_hash.
+    Treat that hash as the plain bundle hash.
+    """
+    compressed = load_deflate_bundle()
+    if compressed is not None and board_hash == compressed[0]:
+        return bundle_hash
+    return board_hash
+
+
+def load_manifest(variant: str = "source") -> tuple[bytes, dict, dict[str, bytes]] | None:
+    """
+    Load a signed manifest and the bundle files it describes: "source" is
+    spaceos-manifest.bin over spaceos-update.bin, "mpy" is
+    spaceos-manifest.mpy.bin over spaceos-update.mpy.bin.
+
+    Returns None (that variant unavailable) when the files are missing, or
+    when the manifest does not describe the current release file for file.
+    """
+    if variant in _manifest_cache:
+        return _manifest_cache[variant]
+
+    _manifest_cache[variant] = None
+    bundle = load_bundle()
+    if variant == "mpy":
+        manifest_path, files_path = _MPY_MANIFEST_PATH, _MPY_BUNDLE_PATH
+    else:
+        manifest_path, files_path = _MANIFEST_PATH, None
+    name = os.path.basename(manifest_path)
+    if bundle is None or not os.path.exists(manifest_path) or (
+        files_path and not os.path.exists(files_path)
+    ):
+        logger.info(f"{name} not found — {variant} delta OTA updates not available")
+        return None
+
+    signed_manifest = open(manifest_path, "rb").read()
+    try:
+        manifest = json.loads(signed_manifest[64:])
+        payload = open(files_path, "rb").read()[64:] if files_path else bundle[0][64:]
+        files = _bundle_files(payload)
+    except (ValueError, struct.error) as e:
+        logger.error(f"Could not parse {name} or its bundle: {e}")
+        return None
+
+    if manifest.get("bundle") != bundle[1]:
+        logger.error(f"{name} was signed for a different bundle — {variant} delta updates disabled")
+        return None
+    for file_name, entry in manifest.get("files", {}).items():
+        content = files.get(file_name)
+        if content is None or hashlib.sha256(content).hexdigest() != entry.get("sha256"):
+            logger.error(f"{name} does not match {file_name} in the bundle — {variant} delta updates disabled")
+            return None
+
+    _manifest_cache[variant] = (signed_manifest, manifest, files)
+    logger.info(f"SpaceOS {variant} manifest loaded: {len(manifest['files'])} files")
+    return _manifest_cache[variant]
+
+
+def delta_variant(board_mpy) -> str:
+    """
+    Pick "mpy" when the board's sys.implementation._mpy (bits 0-7: bytecode
+    version, bits 8-9: sub-version) can load the compiled variant, else
+    "source". Bytecode-only .mpy files carry sub-version 0 and only need the
+    version to match; files with native code need both.
+    """
+    loaded = load_manifest("mpy")
+    if loaded is None or not isinstance(board_mpy, int):
+        return "source"
+    version, sub_version = loaded[1].get("mpy", (None, None))
+    if board_mpy & 0xFF == version and sub_version in (0, (board_mpy >> 8) & 3):
+        return "mpy"
+    return "source"
+
+
+def build_delta(
+    board_files: dict[str, str], compress: bool = False, variant: str = "source"
+) -> tuple[bytes, list[str]] | None:
+    """
+    Build a delta bundle for a board whose installed files have board_files
+    hashes ({name: sha256_hex}). Returns (delta_bytes, changed_names), or None
+    when delta updates are unavailable.
+
+    Format:
+        [64 bytes: signature of the manifest]
+        [4 bytes: manifest length, big-endian uint32]
+        [N bytes: manifest JSON, exactly as signed]
+        [file list: the same count/name/content framing as the bundle, holding
+         only the changed files; zlib-compressed when compress is set]
+
+    The board verifies the manifest signature, then checks every file against
+    its manifest hash before installing anything.
+    """
+    loaded = load_manifest(variant)
+    if loaded is None:
+        return None
+    signed_manifest, manifest, _ = loaded
+
+    changed = sorted(
+        name for name, entry in manifest["files"].items()
+        if board_files.get(name) != entry["sha256"]
+    )
+    manifest_bytes = signed_manifest[64:]
+    return b"".join([
+        signed_manifest[:64],
+        struct.pack(">I", len(manifest_bytes)),
+        manifest_bytes,
+        _delta_file_list(tuple(changed), compress, variant),
+    ]), changed
+
+
+@functools.lru_cache(maxsize=64)
+def _delta_file_list(changed: tuple[str, ...], compress: bool, variant: str) -> bytes:
+    """Pack (and optionally compress) the changed files. Most boards in a
+    rollout ask for the same set, so the result is cached."""
+    files = load_manifest(variant)[2]
+    parts = [struct.pack(">I", len(changed))]
+    for name in changed:
+        name_bytes = name.encode("utf-8")
+        parts.append(struct.pack(">H", len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(struct.pack(">I", len(files[name])))
+        parts.append(files[name])
+    file_list = b"".join(parts)
+    if not compress:
+        return file_list
+    compressor = zlib.compressobj(9, zlib.DEFLATED, _DEFLATE_WBITS)
+    return compressor.compress(file_list) + compressor.flush()
+
+
 def get_bundle_hash() -> str | None:
     """Return the current bundle's SHA-256 hash, or None if no bundle exists."""
     result = load_bundle()
@@ -67,37 +302,30 @@ async def ota_check(
     hash: str = Query("", description="SHA-256 of the board's current bundle"),
     x_board_id: str = Header(None, alias="X-Board-Id"),
     x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
+    accept: str = Header(None),
 ):
     """
     OTA update check endpoint for SpaceOS boards.
 
     The board sends its current bundle hash. The server compares it against the
-    hash of spaceos-update.bin. If they differ (and OTA is enabled for this board),
-    the server responds with 200 + the full signed bundle. Otherwise 204.
+    hash of spaceos-update.bin. If they differ, OTA is enabled for this board and
+    the rollout has released its cohort, the server responds with 200 + the full
+    signed bundle. Otherwise 204. The hash a board reports after being sent the
+    bundle tells the rollout whether it applied.
 
-    Authentication: X-Board-Id (board UUID) + X-Board-Secret (raw secret key).
+    Authentication: X-Board-Id (board UUID) + X-Board-Token (session token)
+    or X-Board-Secret (raw secret key).
     """
-    if not x_board_id or not x_board_secret:
-        return Response(status_code=401)
-
-    base_client = request.app.state.get_base_client()
-
     try:
-        board = await q.selectBoardBySecretKey(base_client, board_id=UUID(x_board_id))
-    except Exception:
-        board = None
+        board = await authenticate_board(
+            request, x_board_id, x_board_secret, x_board_token
+        )
+    except HTTPException as exc:
+        return Response(status_code=exc.status_code)
 
-    if not board or not board.secret_key_hash:
-        return Response(status_code=403)
-
-    if not check_password_hash(board.secret_key_hash, x_board_secret):
-        return Response(status_code=403)
-
-    # Respect per-board OTA opt-out (field may not exist until queries are regenerated)
-    ota_enabled = getattr(board, "ota_updates_enabled", True)
-    if ota_enabled is None:
-        ota_enabled = True
-    if not ota_enabled:
+    # Respect per-board OTA opt-out
+    if not await ota_updates_allowed(request, board):
         logger.info(f"OTA disabled for board {x_board_id[:8]}")
         return Response(status_code=204)
 
@@ -105,18 +333,114 @@ async def ota_check(
     if bundle is None:
         return Response(status_code=204)
 
-    bundle_bytes, bundle_hash = bundle
+    bundle_hash = bundle[1]
+    hash = _canonical_hash(hash, bundle_hash)
+    client = request.app.state.get_base_client()
+    await ota_rollout.record_check(client, board.board_id, hash, bundle_hash)
 
     if hash and hash == bundle_hash:
         return Response(status_code=204)
 
+    if not await ota_rollout.released(client, board, bundle_hash):
+        ota_rollout.record_held()
+        return Response(status_code=204)
+
+    await ota_rollout.record_sent(client, board.board_id, bundle_hash)
+
     logger.info(
         f"Sending OTA bundle to board {x_board_id[:8]} "
         f"(board_hash={hash[:12] if hash else 'none'}, "
         f"bundle_hash={bundle_hash[:12]})"
     )
-    return Response(
-        content=bundle_bytes,
+    # Served from disk so the body is streamed (sendfile where the server
+    # supports it) with a Content-Length, which the board's urequests needs
+    # to read the bundle straight to flash.
+    compressed = load_deflate_bundle() if accepts_deflate(accept) else None
+    if compressed is not None:
+        return FileResponse(
+            _DEFLATE_BUNDLE_PATH,
+            media_type=BUNDLE_DEFLATE_MEDIA_TYPE,
+            stat_result=compressed[1],
+        )
+    return FileResponse(
+        _BUNDLE_PATH,
         media_type="application/octet-stream",
+        stat_result=_bundle_stat,
+    )
+
+
+@router.post("/delta", name="spaceos.delta")
+async def ota_delta(
+    request: Request,
+    body: dict = Body(default_factory=dict),
+    x_board_id: str = Header(None, alias="X-Board-Id"),
+    x_board_secret: str = Header(None, alias="X-Board-Secret"),
+    x_board_token: str = Header(None, alias="X-Board-Token"),
+    accept: str = Header(None),
+):
+    """
+    Delta OTA update endpoint for SpaceOS boards.
+
+    The board posts {"hash": "<os_hash>", "files": {"app.py": "<sha256>", ...},
+    "mpy": <sys.implementation._mpy>} from its installed manifest (an empty
+    "files" for a board without one). "mpy" selects the .mpy variant when it
+    matches; older firmware omits it and gets source. "repair": true marks a
+    board whose installed modules no longer import (e.g. after a MicroPython
+    reflash); it is served even outside the released rollout cohort.
+    Responds 200 + a delta bundle holding the signed manifest and only the files
+    that differ, 204 when up to date or not yet released, or 404 when the server
+    has no manifest for the current bundle, in which case the board falls back
+    to GET /check.
+
+    Authentication is the same as /check.
+    """
+    try:
+        board = await authenticate_board(
+            request, x_board_id, x_board_secret, x_board_token
+        )
+    except HTTPException as exc:
+        return Response(status_code=exc.status_code)
+
+    if not await ota_updates_allowed(request, board):
+        return Response(status_code=204)
+
+    bundle = load_bundle()
+    if bundle is None:
+        return Response(status_code=204)
+    bundle_hash = bundle[1]
+    if load_manifest() is None:
+        return Response(status_code=404)
+
+    board_hash = _canonical_hash(str(body.get("hash") or ""), bundle_hash)
+    board_files = body.get("files") or {}
+    if not isinstance(board_files, dict):
+        raise HTTPException(status_code=400, detail="files must be an object")
+    client = request.app.state.get_base_client()
+    await ota_rollout.record_check(client, board.board_id, board_hash, bundle_hash)
+
+    if board_hash == bundle_hash:
+        return Response(status_code=204)
+
+    if body.get("repair") is True:
+        logger.warning(f"Repairing board {board.board_id[:8]} with a full delta")
+    elif not await ota_rollout.released(client, board, bundle_hash):
+        ota_rollout.record_held()
+        return Response(status_code=204)
+
+    compress = accepts_deflate(accept)
+    variant = delta_variant(body.get("mpy"))
+    delta, changed = build_delta(
+        {str(k): str(v) for k, v in board_files.items()},
+        compress=compress,
+        variant=variant,
+    )
+    await ota_rollout.record_sent(client, board.board_id, bundle_hash)
+    logger.info(
+        f"Sending OTA {variant} delta to board {board.board_id[:8]}: {len(changed)} files, "
+        f"{len(delta)} bytes (full bundle {len(bundle[0])} bytes)"
+    )
+    return Response(
+        content=delta,
+        media_type=BUNDLE_DEFLATE_MEDIA_TYPE if compress else "application/octet-stream",
         status_code=200,
     )
@@ -51,7 +51,7 @@ async def check_username(request: Request, username: str, client: Client):
 @router.get("/avatar", response_class=HTMLResponse, name="user.avatar_get")
 async def avatar_get(request: Request, client: Client):
     templates = get_templates(request)
-    current_user = await q.selectGlobalUser(client)
+    current_user = await q.selectGlobalUserProfile(client)
     has_avatar = current_user.avatar is not None if current_user else False
     context = get_context(request, has_avatar=has_avatar, user=current_user)
     return templates.TemplateResponse("app/user/avatar.html", context)
@@ -136,7 +136,7 @@ async def avatar_post(
 
         # Create Avatar object
         try:
-            user = await q.selectGlobalUser(client)
+            user = await q.selectGlobalUserProfile(client)
             if not user:
                 return JSONResponse({"error": "User not found"}, status_code=401)
 
@@ -181,7 +181,7 @@ async def avatar_paint(request: Request):
 async def avatar_editor(request: Request, client: Client):
     """HTMX endpoint to get avatar editor (16x16 only)."""
     templates = get_templates(request)
-    user = await q.selectGlobalUser(client)
+    user = await q.selectGlobalUserProfile(client)
     has_avatar = user.avatar is not None if user else False
     context = get_context(request, user=user, initial_avatar=has_avatar)
     return templates.TemplateResponse("app/user/avatar_editor.html", context)
@@ -211,7 +211,7 @@ async def save_avatar(
             return JSONResponse({"error": "Avatar must be exactly 16x16 pixels"}, status_code=400)
 
         # Create Avatar object
-        user = await q.selectGlobalUser(client)
+        user = await q.selectGlobalUserProfile(client)
         if not user:
             return JSONResponse({"error": "User not found"}, status_code=401)
 
@@ -240,7 +240,7 @@ async def save_avatar(
 async def account_settings(request: Request, client: Client):
     """Account settings page for updating avatar and username."""
     templates = get_templates(request)
-    user = await q.selectGlobalUser(client)
+    user = await q.selectGlobalUserProfile(client)
     if not user:
         raise HTTPException(status_code=401)
 
@@ -266,7 +266,7 @@ async def update_username(
         return JSONResponse({"error": "Username already taken"}, status_code=400)
 
     try:
-        user = await q.selectGlobalUser(client)
+        user = await q.selectGlobalUserProfile(client)
         if not user:
             return JSONResponse({"error": "User not found"}, status_code=401)
 
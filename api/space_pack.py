@@ -0,0 +1,599 @@
+"""
+api/space_pack.py — Space Pack encoding and cache.
+
+A Space Pack (SP) is the binary a board downloads for one piece of art:
+a small header, a JSON metadata blob and the raw frame-major RGB888 pixels.
+Decoding the stored PNG is the expensive part, and a graphic never changes
+once it is finished, so the encoded pixels are cached by graphic ID (plus
+ENCODER_VERSION, so a format change never serves stale bytes):
+
+  - Memory tier: bounded LRU, sized in bytes (SPACE_PACK_CACHE_MB).
+  - Disk tier:   one file per graphic under SPACE_PACK_CACHE_DIR, shared by
+                 every worker process and surviving restarts.
+
+The cache is populated on the first board download or at send time.
+Finished packs (header, metadata and body for one SP version) and their
+ETags are kept in a second, memory-only tier (SpacePackStore), so a
+repeat fetch or a resumed Range request is a dictionary lookup.
+
+Encoding itself runs on a worker pool (SpacePackEncoder) so a large
+animation never blocks the event loop. The pool is bounded: when every
+worker is busy and SPACE_PACK_QUEUE_SIZE jobs are already waiting,
+encode() raises EncoderBusy and the route answers 503 + Retry-After.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from api.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever encode_pixels() output changes so cached entries are ignored.
+ENCODER_VERSION = 1
+
+_DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pmb-space-pack")
+
+
+# =============================================================================
+# Encoding
+# =============================================================================
+
+
+def encode_pixels(png_bytes: bytes, frames: int) -> bytes:
+    """
+    Decode a stored PNG into the frame-major RGB888 layout the board expects.
+
+    Images may have alpha transparency. The web UI (pixel.js) renders using
+    canvas getImageData() which returns pre-multiplied alpha — so semi-transparent
+    pixels appear darker (blended against a black background). We must match
+    that behavior here by compositing RGBA onto black, in the same numpy pass
+    that splits the frames (no separate PIL paste).
+
+    Animations are stored as HORIZONTAL spritesheets (frames side-by-side).
+    The board expects frames as sequential blocks of (frame_width * frame_height * 3) bytes,
+    so the (H, frames * W) sheet is viewed as (H, frames, W) and written out
+    frame-major in a single pass instead of cropping frame by frame.
+    """
+    import numpy as np
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(png_bytes))
+    sheet = np.asarray(img if img.mode == "RGBA" else img.convert("RGB"))
+    frames = max(frames, 1)
+    frame_height, sheet_width, channels = sheet.shape
+    frame_width = sheet_width // frames
+    sheet = sheet[:, : frame_width * frames].reshape(frame_height, frames, frame_width, channels)
+
+    out = np.empty((frames, frame_height, frame_width, 3), dtype=np.uint8)
+    frame_major = out.transpose(1, 0, 2, 3)  # writes land in board order
+    if channels == 3:
+        frame_major[...] = sheet
+        return out.tobytes()
+
+    # rgb * a + black * (1 - a), rounded the way PIL's paste() blends, one
+    # channel at a time so every numpy loop stays long and flat. Pixel art is
+    # nearly always fully opaque or fully clear, where that is just rgb & a.
+    alpha = sheet[..., 3]
+    if not np.any(alpha - 1 < 254):  # every alpha is 0 or 255
+        for channel in range(3):
+            np.bitwise_and(sheet[..., channel], alpha, out=frame_major[..., channel])
+        return out.tobytes()
+
+    alpha = alpha.astype(np.uint16)
+    blended = np.empty_like(alpha)
+    carry = np.empty_like(alpha)
+    for channel in range(3):
+        np.multiply(sheet[..., channel], alpha, out=blended)
+        blended += 128
+        np.right_shift(blended, 8, out=carry)
+        blended += carry
+        np.right_shift(blended, 8, out=frame_major[..., channel], casting="unsafe")
+    return out.tobytes()
+
+
+def _timed_encode(png_bytes: bytes, frames: int) -> Tuple[bytes, float]:
+    """Pool entry point: encode and report CPU-side duration (picklable)."""
+    start = time.perf_counter()
+    pixel_bytes = encode_pixels(png_bytes, frames)
+    return pixel_bytes, time.perf_counter() - start
+
+
+# SP v2 is negotiated with `Accept: application/vnd.spaceos.space-pack; v=2`.
+# Boards that do not send it (all firmware before v2 support) get v1.
+# v=3 is the same indexed layout with delta frames enabled.
+SPACE_PACK_MEDIA_TYPE = "application/vnd.spaceos.space-pack"
+SPACE_PACK_LATEST_VERSION = 3
+
+# Frame type byte at the start of every frame in a delta pack.
+FRAME_KEY = 0
+FRAME_DELTA = 1
+
+# Pixel data is checksummed in chunks of this size (see _pack).
+SPACE_PACK_CHUNK_SIZE = 4096
+
+# Longest run a single RLE pair can describe (run length is one byte).
+_MAX_RUN = 255
+
+
+def negotiate_version(accept: Optional[str]) -> int:
+    """Return the highest SP version the client's Accept header asks for (default 1)."""
+    version = 1
+    for media_range in (accept or "").split(","):
+        media_type, _, params = media_range.partition(";")
+        if media_type.strip().lower() != SPACE_PACK_MEDIA_TYPE:
+            continue
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "v" and value.strip().isdigit():
+                version = max(version, min(int(value), SPACE_PACK_LATEST_VERSION))
+    return version
+
+
+def _pack(magic: bytes, item_id: str, meta: dict, body: bytes) -> bytes:
+    """Assemble header, metadata (with chunk CRCs) and body into one pack."""
+    if len(body) > SPACE_PACK_CHUNK_SIZE:
+        meta = dict(meta)
+        meta["chunk"] = SPACE_PACK_CHUNK_SIZE
+        meta["crc"] = [
+            zlib.crc32(body[i:i + SPACE_PACK_CHUNK_SIZE])
+            for i in range(0, len(body), SPACE_PACK_CHUNK_SIZE)
+        ]
+    meta_bytes = json.dumps(meta).encode("utf-8")
+
+    sp_data = bytearray()
+    sp_data.extend(magic)                                # Magic (2B)
+    sp_data.extend(UUID(str(item_id)).bytes)             # Message ID (16B)
+    sp_data.extend(struct.pack(">H", len(meta_bytes)))   # Meta length (2B, uint16 BE)
+    sp_data.extend(struct.pack(">I", len(body)))         # Pixel length (4B, uint32 BE)
+    sp_data.extend(meta_bytes)                           # Metadata (variable)
+    sp_data.extend(body)                                 # Pixel data (variable)
+    return bytes(sp_data)
+
+
+def _rle_encode(indices) -> bytes:
+    """Encode one frame of palette indices as (run, index) byte pairs."""
+    import numpy as np
+
+    boundaries = np.flatnonzero(np.diff(indices)) + 1
+    starts = np.concatenate(([0], boundaries))
+    lengths = np.diff(np.concatenate((starts, [len(indices)])))
+
+    out = bytearray()
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        index = int(indices[start])
+        while length > 0:
+            run = min(length, _MAX_RUN)
+            out.append(run)
+            out.append(index)
+            length -= run
+    return bytes(out)
+
+
+def _pack_indices(indices, bits: int) -> bytes:
+    """Pack one frame of palette indices at 4 (high nibble first) or 8 bits."""
+    import numpy as np
+
+    if bits == 8:
+        return indices.astype(np.uint8).tobytes()
+    if len(indices) % 2:
+        indices = np.append(indices, 0)
+    pairs = indices.astype(np.uint8).reshape(-1, 2)
+    return ((pairs[:, 0] << 4) | pairs[:, 1]).astype(np.uint8).tobytes()
+
+
+def _delta_encode(previous, current) -> bytes:
+    """Changed pixels between two frames: uint16 count, then (uint16 pixel, uint8 index)."""
+    import numpy as np
+
+    changed = np.flatnonzero(previous != current)
+    entries = np.empty(len(changed), dtype=[("pixel", ">u2"), ("index", "u1")])
+    entries["pixel"] = changed
+    entries["index"] = current[changed]
+    return struct.pack(">H", len(changed)) + entries.tobytes()
+
+
+def encode_indexed(
+    pixel_bytes: bytes, frames: int, delta: bool = False
+) -> Optional[Tuple[dict, bytes]]:
+    """
+    Re-encode frame-major RGB888 pixels as an SP v2 body.
+
+    Returns (meta, body), or None if the art uses more than 256 colours and
+    must be sent as v1. The encoder keeps whichever of packed or RLE frames
+    is smaller for the whole pack.
+
+    With delta=True every frame starts with a type byte: FRAME_KEY followed
+    by a full frame, or FRAME_DELTA followed by the pixels that changed since
+    the previous frame. Frame 0 is always a keyframe; later frames use
+    whichever form is smaller. If no frame benefits, the pack is left as a
+    plain v2 body.
+    """
+    import numpy as np
+
+    frames = max(frames, 1)
+    rgb = np.frombuffer(pixel_bytes, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    keys = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    colors, indices = np.unique(keys, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    palette = np.stack(((colors >> 16) & 0xFF, (colors >> 8) & 0xFF, colors & 0xFF), axis=1)
+    indices = indices.reshape(-1)
+
+    bits = 4 if len(palette) <= 16 else 8
+    per_frame = indices.reshape(frames, -1)
+    packed = [_pack_indices(frame, bits) for frame in per_frame]
+    rle = [_rle_encode(frame) for frame in per_frame]
+    use_rle = sum(map(len, rle)) < sum(map(len, packed))
+    frame_blobs = rle if use_rle else packed
+
+    delta = delta and frames > 1
+    if delta:
+        blobs = [bytes([FRAME_KEY]) + frame_blobs[0]]
+        for i in range(1, frames):
+            changes = _delta_encode(per_frame[i - 1], per_frame[i])
+            if len(changes) < len(frame_blobs[i]):
+                blobs.append(bytes([FRAME_DELTA]) + changes)
+            else:
+                blobs.append(bytes([FRAME_KEY]) + frame_blobs[i])
+        # Skip the per-frame type bytes if no frame is cheaper as a delta
+        delta = any(blob[0] == FRAME_DELTA for blob in blobs)
+        if delta:
+            frame_blobs = blobs
+
+    body = bytearray(palette.astype(np.uint8).tobytes())
+    offset = 0
+    for blob in frame_blobs:
+        body.extend(struct.pack(">I", offset))
+        offset += len(blob)
+    for blob in frame_blobs:
+        body.extend(blob)
+
+    meta = {"format": 2, "colors": len(palette), "bits": bits, "rle": use_rle}
+    if delta:
+        meta["delta"] = True
+    return meta, bytes(body)
+
+
+def build_space_pack(
+    item_id: str,
+    pixel_bytes: bytes,
+    sender: str,
+    fps: int,
+    frames: int,
+    version: int = 1,
+) -> bytes:
+    """
+    Wrap encoded pixels in the SP binary envelope.
+
+    SP binary format:
+    | Offset | Field      | Size | Type   |
+    | 0      | Magic "SP" | 2B   | Char   |
+    | 2      | Message ID | 16B  | UUID   |
+    | 18     | Meta Len   | 2B   | uint16 |
+    | 20     | Pixel Len  | 4B   | uint32 |
+    | 24     | Metadata   | Var  | JSON   |
+    | End    | Pixel Data | Var  | RGB    |
+
+    SP v2 (version=2) uses magic "S2" and the same header. Metadata adds
+    "format": 2, "colors", "bits" (4 or 8) and "rle", and Pixel Data is an
+    indexed body:
+    | Palette  | colors * 3B  | RGB888                                   |
+    | Offsets  | frames * 4B  | uint32 BE, frame start within Frames     |
+    | Frames   | Var          | packed indices, or (run, index) pairs    |
+
+    version=3 adds "delta": true for animations: each frame is prefixed with
+    a type byte, and FRAME_DELTA frames hold a uint16 count followed by
+    (uint16 pixel, uint8 palette index) changes against the previous frame.
+
+    Art with more than 256 colours is always sent as v1; callers check the
+    magic (or the "format" key) rather than assuming the version they asked for.
+
+    Packs whose Pixel Data is larger than SPACE_PACK_CHUNK_SIZE also carry
+    "chunk" (the chunk size) and "crc" (CRC-32 of each chunk of Pixel Data)
+    so a board resuming a download can refetch just a corrupt chunk.
+    """
+    meta = {
+        "sender": sender,
+        "fps": fps,
+        "is_anim": frames > 1,
+    }
+
+    if version >= 2:
+        indexed = encode_indexed(pixel_bytes, frames, delta=version >= 3)
+        if indexed is not None:
+            indexed_meta, body = indexed
+            meta.update(indexed_meta)
+            return _pack(b"S2", item_id, meta, body)
+
+    return _pack(b"SP", item_id, meta, pixel_bytes)
+
+
+# Batch stream framing (POST /app/space-packs). Record statuses:
+BATCH_OK = 0
+BATCH_NOT_FOUND = 1
+BATCH_FAILED = 2
+BATCH_END = 0xFF
+
+SPACE_PACK_BATCH_MAX = int(os.getenv("SPACE_PACK_BATCH_MAX", "20"))
+
+
+def batch_record(status: int, pack: bytes = b"") -> bytes:
+    """
+    Frame one item of a batch download.
+
+    | Offset | Field     | Size | Type   |
+    | 0      | Magic "B" | 1B   | Char   |
+    | 1      | Status    | 1B   | uint8  |
+    | 2      | Pack Len  | 4B   | uint32 |
+    | 6      | Pack      | Var  | SP     |
+
+    Only BATCH_OK records carry a pack; a BATCH_END record closes the stream.
+    """
+    return b"B" + struct.pack(">BI", status, len(pack)) + pack
+
+
+# =============================================================================
+# Cache
+# =============================================================================
+
+
+class SpacePackCache:
+    """Two-tier (memory LRU + disk) cache of encoded Space Pack pixels."""
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[Path]):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(graphic_id) -> str:
+        return f"{graphic_id}-v{ENCODER_VERSION}"
+
+    def _disk_path(self, key: str) -> Optional[Path]:
+        if not self.cache_dir:
+            return None
+        return self.cache_dir / f"{key}.rgb"
+
+    def _remember(self, key: str, pixel_bytes: bytes) -> None:
+        """Insert into the memory tier and evict least-recently-used entries."""
+        if len(pixel_bytes) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = pixel_bytes
+            self._size += len(pixel_bytes)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    async def get(self, graphic_id) -> Optional[bytes]:
+        """Return cached pixels; a disk-tier read runs off the event loop."""
+        key = self._key(graphic_id)
+
+        with self._lock:
+            pixel_bytes = self._entries.get(key)
+            if pixel_bytes is not None:
+                self._entries.move_to_end(key)
+                metrics.incr("space_pack.cache_hit.memory")
+                return pixel_bytes
+
+        path = self._disk_path(key)
+        if path is None:
+            metrics.incr("space_pack.cache_miss")
+            return None
+        try:
+            pixel_bytes = await asyncio.to_thread(path.read_bytes)
+        except OSError:
+            metrics.incr("space_pack.cache_miss")
+            return None
+
+        metrics.incr("space_pack.cache_hit.disk")
+        self._remember(key, pixel_bytes)
+        return pixel_bytes
+
+    def put(self, graphic_id, pixel_bytes: bytes) -> None:
+        key = self._key(graphic_id)
+        self._remember(key, pixel_bytes)
+
+        path = self._disk_path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            temp_path.write_bytes(pixel_bytes)
+            temp_path.replace(path)
+        except OSError as e:
+            logger.warning(f"Space Pack disk cache write failed for {graphic_id}: {e}")
+
+
+def pack_etag(pack: bytes) -> str:
+    """Strong ETag for a finished pack: changes with sender, SP version and encoder output."""
+    return f'"{hashlib.sha256(pack).hexdigest()[:32]}"'
+
+
+class SpacePackStore:
+    """
+    Memory LRU of finished Space Packs and their ETags, keyed by
+    (item ID, SP version) and sized in bytes.
+
+    A pack never changes once built (the art is final and senders cannot be
+    renamed), so a hit is served without touching Gel, the encoder or
+    build_space_pack. That also makes every Range request of a resumed
+    download a slice of the stored bytes. Routes that delete a message or
+    graphic call invalidate(); other workers may keep serving a deleted
+    item's pack until it is evicted, which is harmless since boards only
+    fetch IDs the server listed. Metrics: space_pack.pack_hit,
+    space_pack.pack_miss, space_pack.pack_bytes (gauge).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[bytes, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(item_id, version: int) -> Tuple[str, int]:
+        return str(item_id).lower(), version
+
+    def get(self, item_id, version: int) -> Optional[Tuple[bytes, str]]:
+        key = self._key(item_id, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.incr("space_pack.pack_hit" if entry is not None else "space_pack.pack_miss")
+        return entry
+
+    def put(self, item_id, version: int, pack: bytes) -> Tuple[bytes, str]:
+        """Store pack and return (pack, etag)."""
+        entry = (pack, pack_etag(pack))
+        if len(pack) > self.max_bytes:
+            return entry
+        key = self._key(item_id, version)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._entries[key] = entry
+            self._size += len(pack)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+            metrics.gauge("space_pack.pack_bytes", self._size)
+        return entry
+
+    def invalidate(self, item_id) -> None:
+        with self._lock:
+            for version in range(1, SPACE_PACK_LATEST_VERSION + 1):
+                entry = self._entries.pop(self._key(item_id, version), None)
+                if entry is not None:
+                    self._size -= len(entry[0])
+
+
+def _cache_dir_from_env() -> Optional[Path]:
+    cache_dir = os.getenv("SPACE_PACK_CACHE_DIR", _DEFAULT_CACHE_DIR)
+    return Path(cache_dir) if cache_dir else None
+
+
+space_pack_cache = SpacePackCache(
+    max_bytes=int(os.getenv("SPACE_PACK_CACHE_MB", "64")) * 1024 * 1024,
+    cache_dir=_cache_dir_from_env(),
+)
+
+space_pack_store = SpacePackStore(
+    max_bytes=int(os.getenv("SPACE_PACK_STORE_MB", "32")) * 1024 * 1024,
+)
+
+
+# =============================================================================
+# Encoder pool
+# =============================================================================
+
+
+class EncoderBusy(Exception):
+    """Raised when the encoder pool and its queue are full."""
+
+
+class SpacePackEncoder:
+    """
+    Bounded thread- or process-pool for encode_pixels().
+
+    Concurrent requests for the same graphic share one encode job. Metrics:
+    space_pack.encode (worker time), space_pack.encode_wait (queue + worker
+    time as seen by the caller), space_pack.queue_depth, space_pack.rejected.
+    """
+
+    def __init__(self, cache: SpacePackCache, mode: str, workers: int, queue_size: int):
+        self.cache = cache
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self._executor: Optional[Executor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="space-pack"
+                )
+            logger.info(f"Space Pack encoder: {self.mode} pool, {self.workers} workers")
+        return self._executor
+
+    def _set_depth(self) -> None:
+        metrics.gauge("space_pack.in_flight", self._pending)
+        metrics.gauge("space_pack.queue_depth", max(0, self._pending - self.workers))
+
+    def _finish(self, key: str) -> None:
+        self._inflight.pop(key, None)
+        self._pending -= 1
+        self._set_depth()
+
+    async def _run(self, graphic_id, png_bytes: bytes, frames: int) -> bytes:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        pixel_bytes, encode_seconds = await loop.run_in_executor(
+            self._get_executor(), _timed_encode, png_bytes, frames
+        )
+
+        metrics.observe("space_pack.encode", encode_seconds)
+        metrics.observe("space_pack.encode_wait", time.perf_counter() - start)
+        await loop.run_in_executor(None, self.cache.put, graphic_id, pixel_bytes)
+        return pixel_bytes
+
+    async def encode(self, graphic_id, png_bytes: bytes, frames: int) -> bytes:
+        """
+        Encode png_bytes on the pool and store the result in the cache.
+        Callers check the cache first. Raises EncoderBusy if the pool has no
+        room for another job.
+        """
+        key = str(graphic_id)
+        future = self._inflight.get(key)
+        if future is None:
+            if self._pending >= self.capacity:
+                metrics.incr("space_pack.rejected")
+                raise EncoderBusy()
+            self._pending += 1
+            self._set_depth()
+            future = asyncio.ensure_future(self._run(graphic_id, png_bytes, frames))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._finish(key))
+
+        # shield() so one cancelled request does not cancel a shared job
+        return await asyncio.shield(future)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+space_pack_encoder = SpacePackEncoder(
+    space_pack_cache,
+    mode=os.getenv("SPACE_PACK_ENCODER", "thread").strip().lower(),
+    workers=int(os.getenv("SPACE_PACK_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    queue_size=int(os.getenv("SPACE_PACK_QUEUE_SIZE", "16")),
+)
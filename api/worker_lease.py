@@ -0,0 +1,105 @@
+"""
+api/worker_lease.py — Run a background job in one API worker at a time.
+
+Some background jobs must not run in every worker process: the presence
+proxy resumes a persistent MQTT session under a fixed client id, and the
+OTA rollout scheduler notifies boards. Each of them is wrapped in a
+WorkerLease, a named WorkerLease row in Gel that one worker holds at a time:
+
+    lease = WorkerLease("presence-proxy")
+    await lease.run_while_held(client_getter, lambda: _run(...))
+
+Every worker tries to take the row every ttl/3. A row is free once its
+expires_at has passed, so a worker that dies is replaced within one ttl.
+The holder renews on the same schedule. If a renewal fails, because Gel is
+unreachable or another worker took over, the job is cancelled right away,
+before the row can expire and be taken by someone else. On shutdown the
+holder deletes the row so the next worker takes over without waiting.
+
+Metrics: worker_lease.acquired, worker_lease.lost.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+import api.queries as q
+from api.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_LEASE_TTL = timedelta(seconds=float(os.getenv("WORKER_LEASE_TTL_SECONDS", "30")))
+
+
+class WorkerLease:
+    """Named lease; the worker holding it runs the job, the others wait."""
+
+    def __init__(self, name: str, ttl: timedelta = WORKER_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.held = False
+        self._running = False
+
+    async def acquire(self, client) -> bool:
+        """Take or renew the lease. Returns whether this worker holds it."""
+        row = await q.acquireWorkerLease(client, ttl=self.ttl, name=self.name, holder=self.holder)
+        return row is not None
+
+    async def release(self, client) -> None:
+        await q.releaseWorkerLease(client, name=self.name, holder=self.holder)
+
+    async def run_while_held(
+        self,
+        client_getter: Callable[[], Any],
+        job_factory: Callable[[], Awaitable[None]],
+    ) -> None:
+        """Run job_factory() while this worker holds the lease, until stopped."""
+        self._running = True
+        interval = self.ttl.total_seconds() / 3
+        job: Optional[asyncio.Task] = None
+
+        try:
+            while self._running:
+                try:
+                    self.held = await self.acquire(client_getter())
+                except Exception as e:
+                    logger.warning(f"[LEASE] Could not renew {self.name}: {e}")
+                    self.held = False
+
+                if self.held and job is None:
+                    logger.info(f"[LEASE] {self.name} acquired by {self.holder}")
+                    metrics.incr("worker_lease.acquired")
+                    job = asyncio.create_task(job_factory())
+                elif not self.held and job is not None:
+                    logger.warning(f"[LEASE] {self.name} lost, stopping the job")
+                    metrics.incr("worker_lease.lost")
+                    job.cancel()
+                    await asyncio.gather(job, return_exceptions=True)
+                    job = None
+
+                if job is not None and job.done():
+                    # The job finished on its own; nothing left to lead.
+                    if not job.cancelled() and job.exception() is not None:
+                        logger.error(f"[LEASE] {self.name} job failed: {job.exception()}")
+                    break
+
+                await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if job is not None:
+                job.cancel()
+                await asyncio.gather(job, return_exceptions=True)
+            if self.held:
+                self.held = False
+                try:
+                    await self.release(client_getter())
+                except Exception as e:
+                    logger.warning(f"[LEASE] Could not release {self.name}: {e}")
+
+    def stop(self) -> None:
+        self._running = False
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Benchmark and correctness harness for the firmware's ECDSA P-256 verifier.
+
+Times space-os/ecdsa_p256.verify_digest (Straus/Shamir over width-w NAF with
+a precomputed G table) against the previous double-and-add version, and
+counts the point operations each one performs. Those counts, not CPython
+timings, are what decide boot time on an RP2040, where each one is a handful
+of 256-bit multiplications.
+
+Correctness is checked against signatures made with `cryptography`: valid
+signatures, tampered digests and signatures, out-of-range r/s, edge-case
+digests (zero, n, all ones), and the shipped G table itself.
+
+    python scripts/bench_ecdsa.py
+    python scripts/bench_ecdsa.py --signatures 500 --repeat 20
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, utils
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "space-os"))
+sys.modules.setdefault("uhashlib", hashlib)
+
+import ecdsa_p256  # noqa: E402
+
+_P = ecdsa_p256._P
+_N = ecdsa_p256._N
+
+
+def _jmul(k: int, px: int, py: int):
+    """The original double-and-add scalar multiplication, kept as the baseline."""
+    qx, qy, qz = 0, 1, 0
+    rx, ry, rz = px, py, 1
+    while k:
+        if k & 1:
+            qx, qy, qz = ecdsa_p256._jadd(qx, qy, qz, rx, ry, rz)
+        rx, ry, rz = ecdsa_p256._jdouble(rx, ry, rz)
+        k >>= 1
+    if qz == 0:
+        return None
+    zinv = pow(qz, _P - 2, _P)
+    zinv2 = zinv * zinv % _P
+    return (qx * zinv2 % _P, qy * zinv2 * zinv % _P)
+
+
+def verify_digest_baseline(public_key: bytes, digest: bytes, signature: bytes) -> bool:
+    """The original verify_digest: two separate scalar multiplications."""
+    if len(public_key) != 64 or len(signature) != 64 or len(digest) != 32:
+        return False
+    r = int.from_bytes(signature[:32], "big")
+    s = int.from_bytes(signature[32:], "big")
+    if not (1 <= r < _N and 1 <= s < _N):
+        return False
+    qx = int.from_bytes(public_key[:32], "big")
+    qy = int.from_bytes(public_key[32:], "big")
+    w = pow(s, _N - 2, _N)
+    u1 = int.from_bytes(digest, "big") * w % _N
+    u2 = r * w % _N
+    p1 = _jmul(u1, ecdsa_p256._GX, ecdsa_p256._GY)
+    p2 = _jmul(u2, qx, qy)
+    if p1 is None or p2 is None:
+        pt = p2 if p1 is None else p1
+    else:
+        jx, jy, jz = ecdsa_p256._jadd(p1[0], p1[1], 1, p2[0], p2[1], 1)
+        if jz == 0:
+            return False
+        zinv = pow(jz, _P - 2, _P)
+        pt = (jx * zinv * zinv % _P, 0)
+    return pt is not None and pt[0] % _N == r
+
+
+def _keypair():
+    key = ec.generate_private_key(ec.SECP256R1())
+    numbers = key.public_key().public_numbers()
+    return key, numbers.x.to_bytes(32, "big") + numbers.y.to_bytes(32, "big")
+
+
+def _sign_digest(key, digest: bytes) -> bytes:
+    der = key.sign(digest, ec.ECDSA(utils.Prehashed(hashes.SHA256())))
+    r, s = utils.decode_dss_signature(der)
+    return r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+
+def _flip(data: bytes, index: int) -> bytes:
+    out = bytearray(data)
+    out[index] ^= 1
+    return bytes(out)
+
+
+def check(signatures: int) -> List[str]:
+    """Cross-check both verifiers against cryptography; return failure descriptions."""
+    failures: List[str] = []
+
+    for i, (x, y) in enumerate(ecdsa_p256._G_TABLE):
+        expected = ec.derive_private_key(2 * i + 1, ec.SECP256R1()).public_key().public_numbers()
+        if (x, y) != (expected.x, expected.y):
+            failures.append(f"_G_TABLE[{i}] is not {2 * i + 1}G")
+
+    cases = []
+    for _ in range(signatures):
+        key, public_key = _keypair()
+        digest = hashlib.sha256(os.urandom(32)).digest()
+        cases.append((key, public_key, digest))
+    key, public_key = _keypair()
+    for digest in (bytes(32), _N.to_bytes(32, "big"), b"\xff" * 32, (1).to_bytes(32, "big")):
+        cases.append((key, public_key, digest))
+
+    for key, public_key, digest in cases:
+        signature = _sign_digest(key, digest)
+        r_bytes, s_bytes = signature[:32], signature[32:]
+        expectations = [
+            ("valid", digest, signature, True),
+            ("tampered digest", _flip(digest, 31), signature, False),
+            ("tampered r", digest, _flip(signature, 31), False),
+            ("tampered s", digest, _flip(signature, 63), False),
+            ("r = 0", digest, bytes(32) + s_bytes, False),
+            ("s = n", digest, r_bytes + _N.to_bytes(32, "big"), False),
+        ]
+        for label, d, sig, want in expectations:
+            for name, fn in (("new", ecdsa_p256.verify_digest), ("baseline", verify_digest_baseline)):
+                if fn(public_key, d, sig) is not want:
+                    failures.append(f"{name}: {label} (digest {digest.hex()[:16]}...)")
+
+    message = os.urandom(1000)
+    der = key.sign(message, ec.ECDSA(hashes.SHA256()))
+    r, s = utils.decode_dss_signature(der)
+    if not ecdsa_p256.verify(public_key, message, r.to_bytes(32, "big") + s.to_bytes(32, "big")):
+        failures.append("verify() rejected a signature over a message")
+    return failures
+
+
+def count_ops(fn: Callable, *args) -> dict:
+    """Run fn once, counting calls to each point operation."""
+    counts = {"double": 0, "add": 0, "mixed add": 0}
+    originals = {}
+    for attr, label in (("_jdouble", "double"), ("_jadd", "add"), ("_jadd_affine", "mixed add")):
+        original = getattr(ecdsa_p256, attr)
+        originals[attr] = original
+
+        def counted(*a, _original=original, _label=label):
+            counts[_label] += 1
+            return _original(*a)
+
+        setattr(ecdsa_p256, attr, counted)
+    try:
+        fn(*args)
+    finally:
+        for attr, original in originals.items():
+            setattr(ecdsa_p256, attr, original)
+    return counts
+
+
+def _time(fn: Callable, args: tuple, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the SpaceOS ECDSA P-256 verifier.")
+    parser.add_argument(
+        "--signatures",
+        type=int,
+        default=100,
+        help="Random signatures to cross-check against cryptography (default: 100).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=10,
+        help="Runs per timing; the best time is reported (default: 10).",
+    )
+    args = parser.parse_args()
+
+    key, public_key = _keypair()
+    digest = hashlib.sha256(b"spaceos-update.bin").digest()
+    signature = _sign_digest(key, digest)
+    case = (public_key, digest, signature)
+
+    print(f"{'verifier':<10}{'ms':>9}{'doubles':>9}{'adds':>7}{'mixed':>7}")
+    results = {}
+    for name, fn in (("baseline", verify_digest_baseline), ("new", ecdsa_p256.verify_digest)):
+        seconds = _time(fn, case, args.repeat)
+        ops = count_ops(fn, *case)
+        results[name] = seconds
+        print(
+            f"{name:<10}{seconds * 1000:>9.2f}{ops['double']:>9}{ops['add']:>7}"
+            f"{ops['mixed add']:>7}"
+        )
+    print(f"speedup {results['baseline'] / results['new']:.1f}x")
+
+    failures = check(args.signatures)
+    if failures:
+        print(f"\n{len(failures)} failures:")
+        for failure in failures[:20]:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"\nAgrees with cryptography on {args.signatures + 4} digests and the G table.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Query benchmark for the page loads that fan out to Gel.
+
+Seeds a throwaway user with a configurable amount of content (boards, art,
+drafts, friends with boards, friend requests, received messages), then times
+each case's previous query sequence against its replacement and reports
+latency and result size. Result size is the length of the JSON result
+(bytes columns arrive base64-encoded), a stand-in for what Gel sends back.
+
+    # against the project's Gel instance (gel.toml / GEL_* env)
+    python scripts/bench_queries.py
+    python scripts/bench_queries.py --case compose --friends 10 100 1000 --budget-ms 40
+    python scripts/bench_queries.py --case messages --messages 500 5000 50000
+
+Exits non-zero when a replacement query's p95 is over --budget-ms, or its
+result is over --byte-budget (listing queries must not grow with the size of
+the images they list), so it can gate a deploy. The seeded rows are deleted
+afterwards unless --keep is given.
+
+The messages case reads the last inbox page with offset and with a keyset
+cursor. Across several --messages sizes the keyset rows should stay flat
+while the offset rows grow with the inbox.
+
+Queries that read the ClientTokenIdentity global are run with that global
+(and current_user) swapped for the seeded user, since the benchmark has no
+auth token to sign in with.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import gel
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+QUERIES_DIR = PROJECT_ROOT / "queries"
+
+
+@dataclass
+class Seed:
+    prefix: str
+    user_id: uuid.UUID
+    identity_id: uuid.UUID
+    messages: int = 0
+    # (sent_at, id) of the last message before the deepest inbox page.
+    deep_cursor: Optional[dict] = field(default=None, repr=False)
+
+
+def query_text(name: str) -> str:
+    """queries/<name>.edgeql with the auth globals bound to parameters."""
+    text = (QUERIES_DIR / f"{name}.edgeql").read_text()
+    return (
+        text.replace("global ext::auth::ClientTokenIdentity", "(<ext::auth::Identity><uuid>$bench_identity)")
+        .replace("global current_user", "(<User><uuid>$bench_user)")
+    )
+
+
+def _bind(text: str, seed: Seed, kwargs: dict) -> dict:
+    args = dict(kwargs)
+    if "$bench_identity" in text:
+        args["bench_identity"] = seed.identity_id
+    if "$bench_user" in text:
+        args["bench_user"] = seed.user_id
+    return args
+
+
+async def run_query(client, seed: Seed, name: str, **kwargs) -> int:
+    """Run a generated query as seed's user; return the JSON result size."""
+    text = query_text(name)
+    result = await client.query_json(text, **_bind(text, seed, kwargs))
+    return len(result)
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+
+async def seed_dataset(client, args) -> Seed:
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    blob = os.urandom(args.png_bytes)
+    identity = await client.query_single(
+        'insert ext::auth::LocalIdentity { issuer := "local", subject := <str>$subject }',
+        subject=prefix,
+    )
+    user = await client.query_single(
+        """
+        insert User {
+          identity := <ext::auth::Identity><uuid>$identity_id,
+          username := <str>$prefix
+        }
+        """,
+        identity_id=identity.id,
+        prefix=prefix,
+    )
+    await client.execute(
+        """
+        with
+          me := <User><uuid>$user_id,
+          boards := (
+            for i in range_unpack(range(0, <int64>$boards)) union (
+              insert Board { owner := me, boardType := BoardType.Cosmic, name := 'board ' ++ <str>i }
+            )
+          ),
+          friends := (
+            for i in range_unpack(range(0, <int64>$friends)) union (
+              insert User { username := <str>$prefix ++ '-friend-' ++ <str>i }
+            )
+          ),
+          friendships := (
+            for f in friends union (insert Friend { user1 := me, user2 := f })
+          ),
+          friend_boards := (
+            for f in friends union (
+              for j in range_unpack(range(0, <int64>$friend_boards)) union (
+                insert Board {
+                  owner := f,
+                  boardType := array_get([BoardType.Stellar, BoardType.Galactic, BoardType.Cosmic], j % 3),
+                  name := f.username ++ ' board ' ++ <str>j
+                }
+              )
+            )
+          ),
+          requests := (
+            for i in range_unpack(range(0, <int64>$requests)) union (
+              insert FriendRequest {
+                sender := (insert User { username := <str>$prefix ++ '-requester-' ++ <str>i }),
+                recipient := me
+              }
+            )
+          )
+        select (count(boards), count(friendships), count(friend_boards), count(requests))
+        """,
+        user_id=user.id,
+        prefix=prefix,
+        boards=args.boards,
+        friends=args.friends,
+        friend_boards=args.friend_boards,
+        requests=args.requests,
+    )
+    await client.execute(
+        """
+        with
+          me := <User><uuid>$user_id,
+          statics := (
+            for i in range_unpack(range(0, <int64>$graphics // 2)) union (
+              insert StaticImage { binary := <bytes>$blob, size := BoardType.Cosmic, creator := me }
+            )
+          ),
+          animations := (
+            for i in range_unpack(range(0, <int64>$graphics - <int64>$graphics // 2)) union (
+              insert PixelAnimation {
+                binary := <bytes>$blob, size := BoardType.Cosmic, creator := me, frames := 24, fps := 12
+              }
+            )
+          ),
+          drafts := (
+            for i in range_unpack(range(0, <int64>$drafts)) union (
+              insert DraftGraphic { binary := <bytes>$blob, size := BoardType.Cosmic, creator := me, frames := 8 }
+            )
+          )
+        select (count(statics), count(animations), count(drafts))
+        """,
+        user_id=user.id,
+        blob=blob,
+        graphics=args.graphics,
+        drafts=args.drafts,
+    )
+    await client.execute(
+        """
+        with
+          me := <User><uuid>$user_id,
+          senders := array_agg((select User filter .username like <str>$prefix ++ '-friend-%'))
+        for i in range_unpack(range(0, <int64>$messages)) union (
+          with sender := senders[i % len(senders)]
+          insert Message {
+            graphic := (insert StaticImage {
+              binary := <bytes>$blob, size := BoardType.Cosmic, creator := sender, is_message_graphic := true
+            }),
+            sender := sender,
+            recipient := me
+          }
+        )
+        """,
+        user_id=user.id,
+        prefix=prefix,
+        blob=blob,
+        messages=args.messages if args.friends else 0,
+    )
+    return Seed(
+        prefix=prefix,
+        user_id=user.id,
+        identity_id=identity.id,
+        messages=args.messages if args.friends else 0,
+    )
+
+
+async def delete_dataset(client, seed: Seed) -> None:
+    like = seed.prefix + "%"
+    for statement in (
+        "delete Message filter .sender.username like <str>$like or .recipient.username like <str>$like",
+        "delete PixelGraphic filter .creator.username like <str>$like",
+        "delete Friend filter .user1.username like <str>$like",
+        "delete FriendRequest filter .recipient.username like <str>$like",
+        "delete Board filter .owner.username like <str>$like",
+        "delete User filter .username like <str>$like",
+    ):
+        await client.execute(statement, like=like)
+    await client.execute(
+        "delete ext::auth::Identity filter .id = <uuid>$id", id=seed.identity_id
+    )
+
+
+# ---------------------------------------------------------------------------
+# Cases: (previous query sequence, replacement)
+# ---------------------------------------------------------------------------
+
+
+async def dashboard_sequential(client, seed: Seed) -> int:
+    """home() before selectDashboard: seven queries, one after another."""
+    size = 0
+    for name in (
+        "selectGlobalUser",
+        "selectManyGlobalUserBoards",
+        "selectFriends",
+        "selectFriendRequests",
+        "selectUserDrafts",
+        "selectUserGraphics",
+        "selectUserMessagesRecent",
+    ):
+        size += await run_query(client, seed, name)
+    return size
+
+
+async def dashboard_composite(client, seed: Seed) -> int:
+    return await run_query(client, seed, "selectDashboard", graphics_limit=5, messages_limit=5)
+
+
+async def compose_per_friend(client, seed: Seed) -> int:
+    """message_compose before selectFriendsWithBoards: one board query per friend."""
+    text = query_text("selectFriends")
+    friends = json.loads(await client.query_json(text, **_bind(text, seed, {})))
+    size = 0
+    for rel in friends:
+        if rel["friend"] is None:
+            continue
+        size += len(await client.query_json(
+            """
+            select Board {
+              id,
+              name,
+              boardType
+            }
+            filter .owner.id = <uuid>$user_id
+            order by .name
+            """,
+            user_id=uuid.UUID(rel["friend"]["id"]),
+        ))
+    return size
+
+
+async def compose_nested(client, seed: Seed) -> int:
+    return await run_query(client, seed, "selectFriendsWithBoards")
+
+
+# selectUserGraphics as it was before it stopped selecting image bytes.
+_ART_LIST_WITH_BINARY = """
+with
+  user := assert_single(
+    select User
+    filter assert_single(.identity = (<ext::auth::Identity><uuid>$bench_identity))
+  )
+select g := PixelGraphic {
+  id,
+  binary,
+  size,
+  created_at,
+  updated_at,
+  frames := [is PixelAnimation].frames ?? <int16>1,
+  fps := [is PixelAnimation].fps ?? <int16>10
+}
+filter g.creator = user
+  and not (g is DraftGraphic)
+  and not (g is Avatar)
+  and not exists (select Message filter .graphic = g)
+order by g.updated_at desc
+"""
+
+
+async def art_with_binary(client, seed: Seed) -> int:
+    return len(await client.query_json(_ART_LIST_WITH_BINARY, bench_identity=seed.identity_id))
+
+
+async def art_listing(client, seed: Seed) -> int:
+    return await run_query(client, seed, "selectUserGraphics")
+
+
+# /app/messages page size.
+_MESSAGES_PAGE = 20
+
+# selectUserMessages as it was before keyset pagination.
+_MESSAGES_OFFSET_PAGE = """
+with
+  user := assert_single(
+    select User
+    filter (<ext::auth::Identity><uuid>$bench_identity) in .identity
+  )
+select Message {
+  id,
+  sent_at,
+  is_read,
+  sender: { id, username },
+  graphic: {
+    id,
+    size,
+    frames := [is PixelAnimation].frames ?? <int16>1,
+    fps := [is PixelAnimation].fps ?? <int16>10
+  }
+}
+filter .recipient = user
+order by .sent_at desc
+offset <int64>$offset
+limit <int64>$limit
+"""
+
+
+def _deepest_offset(seed: Seed) -> int:
+    return max(0, seed.messages - _MESSAGES_PAGE)
+
+
+async def messages_offset(client, seed: Seed) -> int:
+    """The last inbox page, reached with offset."""
+    return len(await client.query_json(
+        _MESSAGES_OFFSET_PAGE,
+        bench_identity=seed.identity_id,
+        offset=_deepest_offset(seed),
+        limit=_MESSAGES_PAGE,
+    ))
+
+
+async def messages_keyset(client, seed: Seed) -> int:
+    """The same page, reached with the (sent_at, id) cursor of the page before."""
+    if seed.deep_cursor is None:
+        seed.deep_cursor = {"before_sent_at": None, "before_id": None}
+        offset = _deepest_offset(seed)
+        if offset:
+            row = await client.query_single(
+                """
+                select Message { sent_at, id }
+                filter .recipient.id = <uuid>$user_id
+                order by .sent_at desc then .id desc
+                offset <int64>$offset
+                limit 1
+                """,
+                user_id=seed.user_id,
+                offset=offset - 1,
+            )
+            seed.deep_cursor = {"before_sent_at": row.sent_at, "before_id": row.id}
+    return await run_query(
+        client, seed, "selectUserMessages", limit=_MESSAGES_PAGE, **seed.deep_cursor
+    )
+
+
+CaseFn = Callable[[object, Seed], Awaitable[int]]
+CASES: Dict[str, Tuple[CaseFn, CaseFn]] = {
+    "dashboard": (dashboard_sequential, dashboard_composite),
+    "compose": (compose_per_friend, compose_nested),
+    "art": (art_with_binary, art_listing),
+    "messages": (messages_offset, messages_keyset),
+}
+
+
+async def _time(fn: CaseFn, client, seed: Seed, repeat: int) -> Tuple[List[float], int]:
+    size = await fn(client, seed)  # warm the query cache
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn(client, seed)
+        samples.append(time.perf_counter() - start)
+    return samples, size
+
+
+def _p95(samples: List[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+async def main_async(args) -> int:
+    client = gel.create_async_client()
+    over_budget = []
+    try:
+        for friends, messages in itertools.product(args.friends, args.messages):
+            # One dataset per social-graph and inbox size, so per-friend and
+            # per-page costs show up as rows that grow with the dataset.
+            sized = argparse.Namespace(**{**vars(args), "friends": friends, "messages": messages})
+            seed = await seed_dataset(client, sized)
+            label_size = f"{friends} friends, {messages} messages"
+            print(
+                f"\nSeeded {seed.prefix}: {args.boards} boards, {args.graphics} graphics, "
+                f"{args.drafts} drafts, {friends} friends x {args.friend_boards} boards, "
+                f"{args.requests} requests, {messages} messages "
+                f"({args.png_bytes:,} B images)"
+            )
+            try:
+                print(f"{'case':<12}{'query':<12}{'p50 ms':>9}{'p95 ms':>9}{'result B':>12}")
+                for case in args.case:
+                    previous, replacement = CASES[case]
+                    for label, fn in (("previous", previous), ("new", replacement)):
+                        samples, size = await _time(fn, client, seed, args.repeat)
+                        p95 = _p95(samples) * 1000
+                        print(
+                            f"{case:<12}{label:<12}{statistics.median(samples) * 1000:>9.2f}"
+                            f"{p95:>9.2f}{size:>12,}"
+                        )
+                        if fn is not replacement:
+                            continue
+                        if p95 > args.budget_ms:
+                            over_budget.append(
+                                f"{case} ({label_size}): p95 {p95:.1f} ms > {args.budget_ms:g} ms"
+                            )
+                        if size > args.byte_budget:
+                            over_budget.append(
+                                f"{case} ({label_size}): {size:,} B > {args.byte_budget:,} B"
+                            )
+            finally:
+                if not args.keep:
+                    await delete_dataset(client, seed)
+    finally:
+        await client.aclose()
+
+    if over_budget:
+        print("\nOver budget:\n  " + "\n  ".join(over_budget))
+        return 1
+    print(f"\nAll cases within {args.budget_ms:g} ms (p95) and {args.byte_budget:,} B.")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark page-load queries against Gel.")
+    parser.add_argument("--case", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--boards", type=int, default=5)
+    parser.add_argument("--graphics", type=int, default=200)
+    parser.add_argument("--drafts", type=int, default=20)
+    parser.add_argument(
+        "--friends",
+        type=int,
+        nargs="+",
+        default=[30, 300],
+        help="Friend counts to seed; each gets its own dataset (default: 30 300).",
+    )
+    parser.add_argument("--friend-boards", type=int, default=2, help="Boards per friend.")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument(
+        "--messages",
+        type=int,
+        nargs="+",
+        default=[500],
+        help="Inbox sizes to seed; the messages case reads the last page of each (default: 500).",
+    )
+    parser.add_argument("--png-bytes", type=int, default=8192, help="Size of each seeded image.")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=50.0,
+        help="Fail when a replacement query's p95 exceeds this (default: 50).",
+    )
+    parser.add_argument(
+        "--byte-budget",
+        type=int,
+        default=256 * 1024,
+        help="Fail when a replacement query's result exceeds this many bytes "
+        "(default: 256 KiB, the same as LIST_RESULT_BYTE_BUDGET).",
+    )
+    parser.add_argument("--keep", action="store_true", help="Leave the seeded rows in place.")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for Space Pack pixel encoding.
+
+Compares api.space_pack.encode_pixels against the previous per-frame
+crop()/tobytes() loop across board sizes and frame counts, and checks that
+both produce identical bytes.
+
+    python scripts/bench_space_pack.py
+    python scripts/bench_space_pack.py --frames 1 24 96 --repeat 50
+"""
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from api.space_pack import encode_pixels  # noqa: E402
+
+BOARD_SIZES = {
+    "Stellar": (16, 16),
+    "Galactic": (53, 11),
+    "Cosmic": (32, 32),
+}
+
+
+def encode_pixels_loop(png_bytes: bytes, frames: int) -> bytes:
+    """The original crop-per-frame implementation, kept as the baseline."""
+    img = Image.open(io.BytesIO(png_bytes))
+    if img.mode == "RGBA":
+        background = Image.new("RGB", img.size, (0, 0, 0))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    else:
+        img = img.convert("RGB")
+
+    if frames <= 1:
+        return img.tobytes()
+
+    frame_width = img.width // frames
+    frame_height = img.height
+    pixel_bytes = bytearray()
+    for i in range(frames):
+        left = i * frame_width
+        frame_img = img.crop((left, 0, left + frame_width, frame_height))
+        pixel_bytes.extend(frame_img.tobytes())
+    return bytes(pixel_bytes)
+
+
+def _make_sheet(width: int, height: int, frames: int, seed: int) -> bytes:
+    """Pixel-art-like RGBA spritesheet PNG: a 16-colour palette, some translucency."""
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, size=(16, 4), dtype=np.uint8)
+    palette[:, 3] = rng.choice([0, 128, 255, 255], size=16).astype(np.uint8)
+    indices = rng.integers(0, 16, size=(height, width * frames))
+    buf = io.BytesIO()
+    Image.fromarray(palette[indices], "RGBA").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def decode_only(png_bytes: bytes, frames: int) -> bytes:
+    """PNG decode alone — the floor both implementations share."""
+    img = Image.open(io.BytesIO(png_bytes))
+    img.load()
+    return b""
+
+
+def _time(fn: Callable[[bytes, int], bytes], png: bytes, frames: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(png, frames)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Space Pack pixel encoding.")
+    parser.add_argument(
+        "--frames",
+        type=int,
+        nargs="+",
+        default=[1, 8, 24, 48, 96],
+        help="Frame counts to test (default: 1 8 24 48 96).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="Runs per case; the best time is reported (default: 20).",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'board':<10}{'frames':>7}{'decode ms':>11}{'loop ms':>10}"
+        f"{'numpy ms':>10}{'speedup':>9}"
+    )
+    failures: List[str] = []
+    for name, (width, height) in BOARD_SIZES.items():
+        for frames in args.frames:
+            png = _make_sheet(width, height, frames, seed=frames)
+            if encode_pixels(png, frames) != encode_pixels_loop(png, frames):
+                failures.append(f"{name} x{frames}")
+
+            decode_s = _time(decode_only, png, frames, args.repeat)
+            loop_s = _time(encode_pixels_loop, png, frames, args.repeat)
+            numpy_s = _time(encode_pixels, png, frames, args.repeat)
+            print(
+                f"{name:<10}{frames:>7}{decode_s * 1000:>11.3f}{loop_s * 1000:>10.3f}"
+                f"{numpy_s * 1000:>10.3f}{loop_s / numpy_s:>8.1f}x"
+            )
+
+    if failures:
+        print(f"\nOutput mismatch: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nOutputs identical for all cases.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for queries/*.edgeql.
+
+Seeds a large "crowd" user (thousands of graphics, drafts, messages and
+friends) and a small target user, then runs `analyze` on every read-only
+query as the target user. A query that scans rows in proportion to the
+whole table, rather than to the target user's data, shows up as a plan
+node touching crowd-sized row counts. Examples are an anti-join against
+every DraftGraphic, or a per-graphic probe of Message with no index.
+
+A plan node's touched rows are its actual rows plus the rows its filter
+removed, times its loops. Each query's worst node must stay under
+--max-rows. That limit sits between the target user's data and the crowd.
+
+    # against a disposable Gel 6+ instance (gel.toml / GEL_* env)
+    python scripts/check_query_plans.py
+    python scripts/check_query_plans.py --query selectUserGraphics selectBoardSync -v
+
+Queries with insert, update or delete are skipped. So are the ones in
+ALLOWED_SCANS, which scan by design. Parameters are filled in from their
+casts: ids ending in user_id / owner_id / recipient_id get the target
+user, optionals are left empty, and other values are placeholders. Every
+analyze runs in a transaction that is rolled back. The seeded rows are
+deleted afterwards unless --keep is given.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import gel
+
+from bench_queries import QUERIES_DIR, Seed, _bind, delete_dataset, query_text, seed_dataset
+
+# Queries whose plans are expected to grow with a whole table, and why.
+ALLOWED_SCANS = {
+    "searchUserByUsername": "substring (ilike '%...%') search cannot use an index",
+}
+
+_PARAM = re.compile(r"<(optional\s+)?((?:array<[\w:]+>)|[\w:]+)>\$(\w+)")
+_DML = re.compile(r"^\s*[^#\n]*\b(insert|update|delete)\b", re.M | re.I)
+_USER_PARAMS = ("user_id", "owner_id", "recipient_id")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _placeholder(type_name: str, name: str, seed: Seed) -> Any:
+    """A value of type_name for parameter name, or raise KeyError."""
+    if type_name.startswith("array<"):
+        return []
+    if type_name == "uuid":
+        return seed.user_id if name.endswith(_USER_PARAMS) else uuid.uuid4()
+    return {
+        "str": seed.prefix,
+        "int16": 5,
+        "int32": 5,
+        "int64": 5,
+        "float32": 0.5,
+        "float64": 0.5,
+        "bool": False,
+        "bytes": b"",
+        "json": "{}",
+        "datetime": datetime.now(timezone.utc) - timedelta(minutes=10),
+        "duration": timedelta(days=1),
+        "BoardType": "Cosmic",
+        "DisplayMode": "inbox",
+    }[type_name]
+
+
+def query_args(text: str, seed: Seed) -> Dict[str, Any]:
+    args: Dict[str, Any] = {}
+    for optional, type_name, name in _PARAM.findall(text):
+        if name in args or name.startswith("bench_"):
+            continue
+        args[name] = None if optional else _placeholder(type_name, name, seed)
+    return _bind(text, seed, args)
+
+
+def _norm(key: str) -> str:
+    return re.sub(r"[\s_]", "", key).lower()
+
+
+def _plan_nodes(node: Any) -> Iterator[dict]:
+    """Every dict in an analyze result that reports actual row counts."""
+    if isinstance(node, dict):
+        keys = {_norm(k): v for k, v in node.items()}
+        if "actualrows" in keys:
+            yield keys
+        for value in node.values():
+            yield from _plan_nodes(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_nodes(value)
+
+
+def worst_node(plan: Any) -> Optional[Tuple[int, str]]:
+    """(touched rows, description) of the plan node that touches the most rows."""
+    worst = None
+    for node in _plan_nodes(plan):
+        loops = node.get("actualloops") or node.get("loops") or 1
+        touched = int(
+            ((node.get("actualrows") or 0) + (node.get("rowsremovedbyfilter") or 0)) * loops
+        )
+        label = str(node.get("nodetype") or node.get("plantype") or "?")
+        relation = node.get("relationname") or node.get("alias")
+        if relation:
+            label += f" on {relation}"
+        if worst is None or touched > worst[0]:
+            worst = (touched, label)
+    return worst
+
+
+async def analyze(client, name: str, seed: Seed) -> Any:
+    text = query_text(name)
+    args = query_args(text, seed)
+    result = None
+    try:
+        async for tx in client.transaction():
+            async with tx:
+                result = await tx.query_single("analyze " + text, **args)
+                raise _Rollback
+    except _Rollback:
+        pass
+    return json.loads(result) if isinstance(result, str) else result
+
+
+async def main_async(args) -> int:
+    names = args.query or sorted(p.stem for p in QUERIES_DIR.glob("*.edgeql"))
+    client = gel.create_async_client()
+    failures: List[str] = []
+    try:
+        crowd = await seed_dataset(client, argparse.Namespace(
+            boards=args.crowd // 10, graphics=args.crowd, drafts=args.crowd // 2,
+            friends=args.crowd // 10, friend_boards=2, requests=args.crowd // 10,
+            messages=args.crowd, png_bytes=64,
+        ))
+        target = await seed_dataset(client, argparse.Namespace(
+            boards=3, graphics=20, drafts=5, friends=5, friend_boards=2, requests=3,
+            messages=20, png_bytes=64,
+        ))
+        print(f"Seeded crowd {crowd.prefix} ({args.crowd} rows per table) and target {target.prefix}")
+        try:
+            print(f"{'query':<32}{'rows':>9}  worst node")
+            for name in names:
+                text = query_text(name)
+                if _DML.search(text):
+                    if args.verbose:
+                        print(f"{name:<32}{'-':>9}  skipped (writes)")
+                    continue
+                try:
+                    plan = await analyze(client, name, target)
+                except KeyError as e:
+                    print(f"{name:<32}{'-':>9}  skipped (no placeholder for {e})")
+                    continue
+                worst = worst_node(plan)
+                if worst is None:
+                    failures.append(f"{name}: analyze output has no row counts")
+                    continue
+                touched, label = worst
+                note = ""
+                if name in ALLOWED_SCANS:
+                    note = f"  (allowed: {ALLOWED_SCANS[name]})"
+                elif touched > args.max_rows:
+                    failures.append(f"{name}: {label} touched {touched:,} rows > {args.max_rows:,}")
+                    note = "  OVER"
+                print(f"{name:<32}{touched:>9,}  {label}{note}")
+                if args.verbose:
+                    print(json.dumps(plan, indent=2)[:4000])
+        finally:
+            if not args.keep:
+                await delete_dataset(client, target)
+                await delete_dataset(client, crowd)
+    finally:
+        await client.aclose()
+
+    if failures:
+        print("\nPlans that grow with the table:\n  " + "\n  ".join(failures))
+        return 1
+    print(f"\nEvery plan stays under {args.max_rows:,} rows.")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check query plans stay O(user data).")
+    parser.add_argument("--query", nargs="+", help="Query names to check (default: all).")
+    parser.add_argument(
+        "--crowd",
+        type=int,
+        default=5000,
+        help="Graphics and messages seeded for the crowd user (default: 5000).",
+    )
+    parser.add_argument(
+        "--max-rows",
+        type=int,
+        default=1000,
+        help="Fail when a plan node touches more rows than this (default: 1000).",
+    )
+    parser.add_argument("--keep", action="store_true", help="Leave the seeded rows in place.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print each plan.")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
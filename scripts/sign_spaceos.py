@@ -10,6 +10,10 @@ Usage:
     python scripts/sign_spaceos.py --key /path/to/private.pem
     python scripts/sign_spaceos.py --key /path/to/seed.hex
 
+    # Also ship precompiled .mpy modules to boards whose MicroPython matches
+    # mpy-cross's bytecode version (pip install mpy-cross):
+    python scripts/sign_spaceos.py --key /path/to/private.pem --mpy-cross mpy-cross
+
     # Sign a release using a PEM stored in 1Password (uses desktop app auth):
     python scripts/sign_spaceos.py --1password "op://VaultName/ItemName/FieldName" --account your-account-name
 
@@ -17,9 +21,14 @@ Usage:
     "Integrate with other apps" is enabled under Settings → Developer.
     You will be prompted to approve access via the desktop app.
 
-The signed bundle (spaceos-update.bin) is written to the project root and
-should be committed to the repo. The server serves it as-is; it never sees
-the private key.
+The signed bundle (spaceos-update.bin), its deflate-compressed variant
+(spaceos-update.deflate.bin, signed over the compressed payload) and the
+signed per-file manifest (spaceos-manifest.bin) are written to the project
+root and should be committed to the repo together. With --mpy-cross, the
+.mpy variant (spaceos-update.mpy.bin and spaceos-manifest.mpy.bin) is written
+and committed as well. The server serves the bundle as-is, and builds
+delta updates from the manifest plus the files inside the bundle; it never
+sees the private key.
 
 Requires: pip install cryptography onepassword-sdk
 """
@@ -27,16 +36,33 @@ Requires: pip install cryptography onepassword-sdk
 import argparse
 import asyncio
 import hashlib
+import json
 import os
+import shutil
 import struct
+import subprocess
 import sys
+import tempfile
+import zlib
 from pathlib import Path
 
 # Files excluded from the OTA bundle — immutable on the board
-EXCLUDED = frozenset({"main.py", "update_key.py", "secrets.py", "os_hash", ".updating"})
+EXCLUDED = frozenset({"main.py", "update_key.py", "secrets.py", "os_hash", ".updating", "os_manifest.json"})
 
 SPACE_OS_DIR = Path(__file__).parent.parent / "space-os"
 OUTPUT_FILE = Path(__file__).parent.parent / "spaceos-update.bin"
+MANIFEST_FILE = Path(__file__).parent.parent / "spaceos-manifest.bin"
+DEFLATE_OUTPUT_FILE = Path(__file__).parent.parent / "spaceos-update.deflate.bin"
+MPY_OUTPUT_FILE = Path(__file__).parent.parent / "spaceos-update.mpy.bin"
+MPY_MANIFEST_FILE = Path(__file__).parent.parent / "spaceos-manifest.mpy.bin"
+
+# main.py imports these before it checks for updates, so they must load on any
+# firmware. They are always shipped as source, even in the .mpy variant.
+SOURCE_ONLY = frozenset({"config.py", "wifi.py", "wifi_store.py", "ecdsa_p256.py"})
+
+# A 4 KB window costs a little ratio over zlib's default 32 KB but keeps the
+# board's inflate buffer small. api/routers/spaceos.py uses the same value.
+DEFLATE_WBITS = 12
 
 
 # ---------------------------------------------------------------------------
@@ -44,18 +70,8 @@ OUTPUT_FILE = Path(__file__).parent.parent / "spaceos-update.bin"
 # ---------------------------------------------------------------------------
 
 
-def build_payload(space_os_dir: Path) -> bytes:
-    """
-    Collect all updatable files and pack them into the bundle payload.
-
-    Format:
-        [4 bytes: file count, big-endian uint32]
-        for each file (sorted by name for reproducibility):
-            [2 bytes: filename length, big-endian uint16]
-            [N bytes: filename (UTF-8 basename)]
-            [4 bytes: file content length, big-endian uint32]
-            [M bytes: file content]
-    """
+def collect_files(space_os_dir: Path) -> list[tuple[str, bytes]]:
+    """Return (name, content) for every updatable file, sorted by name for reproducibility."""
     files = []
     for path in sorted(space_os_dir.iterdir()):
         if (
@@ -70,7 +86,21 @@ def build_payload(space_os_dir: Path) -> bytes:
     if not files:
         print("ERROR: No updatable files found in space-os/", file=sys.stderr)
         sys.exit(1)
+    return files
+
+
+def build_payload(files: list[tuple[str, bytes]]) -> bytes:
+    """
+    Pack the updatable files into the bundle payload.
 
+    Format:
+        [4 bytes: file count, big-endian uint32]
+        for each file:
+            [2 bytes: filename length, big-endian uint16]
+            [N bytes: filename (UTF-8 basename)]
+            [4 bytes: file content length, big-endian uint32]
+            [M bytes: file content]
+    """
     parts = [struct.pack(">I", len(files))]
     for name, content in files:
         name_bytes = name.encode("utf-8")
@@ -82,6 +112,81 @@ def build_payload(space_os_dir: Path) -> bytes:
     return b"".join(parts)
 
 
+def compress_payload(payload: bytes) -> bytes:
+    """zlib-wrap the payload for boards that inflate with MicroPython's deflate module."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, DEFLATE_WBITS)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def compile_mpy(
+    files: list[tuple[str, bytes]], mpy_cross: str
+) -> tuple[list[tuple[str, bytes]], list[int]]:
+    """
+    Cross-compile updatable modules to .mpy bytecode.
+
+    Returns the new file list, with each compiled module replacing its source,
+    and the bytecode ABI as [mpy version, sub-version] read from the .mpy
+    header. Modules in SOURCE_ONLY, non-Python files, and modules that fail
+    to compile are kept as source.
+    """
+    out = []
+    abi = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, content in files:
+            if not name.endswith(".py") or name in SOURCE_ONLY:
+                out.append((name, content))
+                continue
+            src = Path(tmp) / name
+            dst = src.with_suffix(".mpy")
+            src.write_bytes(content)
+            try:
+                subprocess.run(
+                    [mpy_cross, "-o", str(dst), str(src)],
+                    check=True, capture_output=True, text=True,
+                )
+            except subprocess.CalledProcessError as e:
+                print(f"  ! {name}: mpy-cross failed, shipping source ({e.stderr.strip()})")
+                out.append((name, content))
+                continue
+            compiled = dst.read_bytes()
+            # .mpy header: b"M", version, (arch << 2) | sub-version, ...
+            abi = [compiled[1], compiled[2] & 3]
+            out.append((dst.name, compiled))
+            print(f"  + {dst.name} ({len(compiled):,} bytes, source {len(content):,})")
+
+    if abi is None:
+        print("ERROR: mpy-cross did not compile any module", file=sys.stderr)
+        sys.exit(1)
+    return out, abi
+
+
+def build_manifest(
+    files: list[tuple[str, bytes]], bundle_hash: str, mpy_abi: list[int] | None = None
+) -> bytes:
+    """
+    Describe every file in the bundle by content hash, for delta updates.
+
+    {"bundle": "<sha256 of spaceos-update.bin>",
+     "files": {"app.py": {"sha256": "...", "size": 1234}, ...}}
+
+    The .mpy variant adds "mpy": [version, sub-version], the bytecode ABI a
+    board's sys.implementation._mpy must match.
+
+    The board keeps the verified manifest as /os_manifest.json and sends its
+    file hashes with each check, so the server can return only the files that
+    changed. "bundle" becomes the board's /os_hash once the delta is applied.
+    """
+    manifest = {
+        "bundle": bundle_hash,
+        **({"mpy": mpy_abi} if mpy_abi else {}),
+        "files": {
+            name: {"sha256": hashlib.sha256(content).hexdigest(), "size": len(content)}
+            for name, content in files
+        },
+    }
+    return json.dumps(manifest, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
 # ---------------------------------------------------------------------------
 # Key loading
 # ---------------------------------------------------------------------------
@@ -241,6 +346,13 @@ def cmd_sign(args):
         )
         sys.exit(1)
 
+    mpy_cross = None
+    if args.mpy_cross:
+        mpy_cross = shutil.which(args.mpy_cross)
+        if mpy_cross is None:
+            print(f"ERROR: mpy-cross not found: {args.mpy_cross}", file=sys.stderr)
+            sys.exit(1)
+
     # Resolve the private key — from 1Password or from a local file
     if args.onepassword:
         if not args.account:
@@ -267,7 +379,8 @@ def cmd_sign(args):
         sys.exit(1)
 
     print(f"Building bundle from {SPACE_OS_DIR}/")
-    payload = build_payload(SPACE_OS_DIR)
+    files = collect_files(SPACE_OS_DIR)
+    payload = build_payload(files)
     print(
         f"Bundle payload: {len(payload):,} bytes, {struct.unpack('>I', payload[:4])[0]} files"
     )
@@ -281,13 +394,39 @@ def cmd_sign(args):
 
     OUTPUT_FILE.write_bytes(bundle)
 
+    print("Signing compressed bundle...")
+    compressed = compress_payload(payload)
+    compressed_signature = sign(compressed)
+    assert len(compressed_signature) == 64
+    DEFLATE_OUTPUT_FILE.write_bytes(compressed_signature + compressed)
+
+    print("Signing manifest...")
+    manifest = build_manifest(files, bundle_hash)
+    manifest_signature = sign(manifest)
+    assert len(manifest_signature) == 64
+    MANIFEST_FILE.write_bytes(manifest_signature + manifest)
+
+    mpy_abi = None
+    if mpy_cross:
+        print("Compiling .mpy variant...")
+        mpy_files, mpy_abi = compile_mpy(files, mpy_cross)
+        mpy_payload = build_payload(mpy_files)
+        MPY_OUTPUT_FILE.write_bytes(sign(mpy_payload) + mpy_payload)
+        mpy_manifest = build_manifest(mpy_files, bundle_hash, mpy_abi)
+        MPY_MANIFEST_FILE.write_bytes(sign(mpy_manifest) + mpy_manifest)
+
     print(f"\n{'=' * 50}")
     print(f"Output:      {OUTPUT_FILE}")
+    print(f"Manifest:    {MANIFEST_FILE} ({len(files)} files)")
     print(f"Total size:  {len(bundle):,} bytes")
+    print(f"Compressed:  {DEFLATE_OUTPUT_FILE} ({64 + len(compressed):,} bytes)")
+    if mpy_abi:
+        print(f".mpy:        {MPY_OUTPUT_FILE} ({64 + len(mpy_payload):,} bytes, mpy v{mpy_abi[0]}.{mpy_abi[1]})")
     print(f"SHA-256:     {bundle_hash}")
     print(f"Public key:  {pub_bytes.hex()}")
     print(f"{'=' * 50}")
-    print(f"\nCommit spaceos-update.bin to the repo to publish this release.")
+    print(f"\nCommit spaceos-update.bin, spaceos-update.deflate.bin and spaceos-manifest.bin"
+          f"{' (and the .mpy variant)' if mpy_abi else ''} to the repo to publish this release.")
     print(f"Verify update_key.py contains:")
     print(f"  PUBLIC_KEY = bytes.fromhex('{pub_bytes.hex()}')")
 
@@ -324,6 +463,11 @@ def main():
         metavar="ACCOUNT_NAME",
         help="Your 1Password account name as shown in the top-left of the desktop app (required with --1password)",
     )
+    parser.add_argument(
+        "--mpy-cross",
+        metavar="PATH",
+        help="mpy-cross executable; also build the precompiled .mpy variant for boards with a matching MicroPython",
+    )
 
     args = parser.parse_args()
 
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Simulate many SpaceOS boards against an MQTT broker to load-test the
+presence proxy offline.
+
+Each simulated board connects with the same Last Will as the firmware
+(space-os/ably_mqtt.py), publishes "online" to status/{user}/{board}, sends
+read receipts, then either disconnects cleanly (publishing "offline") or
+drops its socket so the broker fires the will.
+
+    # everything in one process: amqtt broker + proxy + boards
+    pip install amqtt
+    python scripts/simulate_boards.py --embedded-broker --proxy --boards 2000
+
+    # against a separately running broker (e.g. mosquitto -p 1883)
+    python scripts/simulate_boards.py --port 1883 --boards 5000
+
+With --proxy the presence proxy runs in-process against the broker (no Gel
+client, and Ably publishes are skipped unless ABLY_API_KEY is set) and the
+script reports how long it took to drain every expected status message.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import time
+import uuid
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import aiomqtt  # noqa: E402
+
+
+async def _board(args, index: int, start_gate: asyncio.Semaphore, results: dict) -> None:
+    user_id = str(uuid.UUID(int=index % args.users + 1))
+    board_id = str(uuid.uuid4())
+    topic = f"status/{user_id}/{board_id}"
+    offline = json.dumps({"state": "offline", "type": "presence"}).encode()
+
+    client = aiomqtt.Client(
+        args.host,
+        args.port,
+        identifier=f"spaceos-{board_id}",
+        username="simulated-board",
+        password="",
+        keepalive=60,
+        will=aiomqtt.Will(topic, offline, qos=1, retain=False),
+    )
+    async with contextlib.AsyncExitStack() as stack:
+        async with start_gate:
+            try:
+                await stack.enter_async_context(client)
+            except aiomqtt.MqttError as e:
+                results["connect_failed"] += 1
+                logging.debug(f"board {index} connect failed: {e}")
+                return
+        results["connected"] += 1
+
+        try:
+            await client.publish(topic, json.dumps({"state": "online", "type": "presence"}), qos=1)
+            for _ in range(args.receipts):
+                await asyncio.sleep(random.uniform(0, args.spread))
+                receipt = {"action": "mark_read", "msg_id": str(uuid.uuid4()), "type": "read_receipt"}
+                await client.publish(topic, json.dumps(receipt), qos=1)
+            results["published"] += 1 + args.receipts
+
+            await asyncio.sleep(random.uniform(0, args.spread))
+            if random.random() < args.drop_fraction:
+                results["dropped"] += 1
+                _drop(client)
+            else:
+                await client.publish(topic, offline, qos=1)
+                results["published"] += 1
+        except Exception as e:
+            results["errors"] += 1
+            logging.debug(f"board {index} error: {e}")
+            _drop(client)
+
+
+def _drop(client: aiomqtt.Client) -> None:
+    """
+    Cut the connection without a DISCONNECT packet, so the broker fires the
+    will. aiomqtt only disconnects cleanly, so this reaches the paho socket.
+    """
+    sock = client._client.socket()
+    if sock is not None:
+        sock.shutdown(socket.SHUT_RDWR)
+
+
+async def main_async(args) -> None:
+    broker = None
+    if args.embedded_broker:
+        from amqtt.broker import Broker
+
+        broker = Broker({
+            "listeners": {"default": {"type": "tcp", "bind": f"{args.host}:{args.port}"}},
+        })
+        await broker.start()
+        print(f"Embedded amqtt broker on {args.host}:{args.port}")
+
+    metrics = None
+    proxy_task = None
+    if args.proxy:
+        os.environ.update({
+            "PRESENCE_MQTT_HOST": args.host,
+            "PRESENCE_MQTT_PORT": str(args.port),
+            "PRESENCE_MQTT_TLS": "false",
+            "PRESENCE_MQTT_USERNAME": "presence-proxy",
+            "PRESENCE_MQTT_PASSWORD": "",
+        })
+        from api import presence_proxy
+        from api.metrics import metrics
+
+        proxy_task = asyncio.create_task(presence_proxy.start_proxy(lambda: None))
+        await asyncio.sleep(0.5)  # let the proxy subscribe first
+
+    results = {k: 0 for k in ("connected", "connect_failed", "published", "dropped", "errors")}
+    gate = asyncio.Semaphore(args.concurrent_connects)
+    start = time.perf_counter()
+    await asyncio.gather(*(_board(args, i, gate, results) for i in range(args.boards)))
+    boards_done = time.perf_counter() - start
+    expected = results["published"] + results["dropped"]  # each drop fires one will
+
+    print(f"{args.boards} boards in {boards_done:.2f}s: {results}")
+
+    if proxy_task is not None:
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            counters = metrics.snapshot()["counters"]
+            if counters.get("presence.messages", 0) >= expected:
+                break
+            await asyncio.sleep(0.05)
+        # Let the workers finish what they were handed.
+        await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - start
+        snapshot = metrics.snapshot()
+        counters = snapshot["counters"]
+        received = counters.get("presence.messages", 0)
+        print(
+            f"Proxy received {received}/{expected} messages in {elapsed:.2f}s "
+            f"({received / elapsed:.0f} msg/s)"
+        )
+        print(f"  online={counters.get('presence.online', 0)} "
+              f"offline={counters.get('presence.offline', 0)} "
+              f"read_receipt={counters.get('presence.read_receipt', 0)} "
+              f"errors={counters.get('presence.errors', 0)}")
+        print(f"  handle timing: {snapshot['timings'].get('presence.handle')}")
+        from api import presence_proxy
+
+        presence_proxy.stop_proxy()
+        proxy_task.cancel()
+        await asyncio.gather(proxy_task, return_exceptions=True)
+
+    if broker is not None:
+        await broker.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate SpaceOS boards over MQTT.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--boards", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=250, help="Distinct owners to spread boards over.")
+    parser.add_argument("--receipts", type=int, default=3, help="Read receipts per board.")
+    parser.add_argument("--spread", type=float, default=0.5, help="Max random delay between a board's messages (s).")
+    parser.add_argument("--drop-fraction", type=float, default=0.5,
+                        help="Fraction of boards that drop their socket (fires the LWT).")
+    parser.add_argument("--concurrent-connects", type=int, default=200)
+    parser.add_argument("--embedded-broker", action="store_true",
+                        help="Run an amqtt broker in-process (pip install amqtt).")
+    parser.add_argument("--proxy", action="store_true", help="Run the presence proxy in-process.")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
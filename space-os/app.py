@@ -5,6 +5,7 @@ import time
 import json
 import gc
 import machine
+import random
 import urequests
 
 import config
@@ -16,6 +17,7 @@ import space_pack
 import storage
 import player
 import buttons
+import board_auth
 
 
 # =============================================================================
@@ -72,6 +74,7 @@ _paused = False                   # Playback paused
 _brightness = 0.5                 # Current brightness (0.0–1.0)
 _message_list = []                # Current directory listing
 _pending_commands = []            # Queue of incoming commands
+_os_update_at = None              # ticks_ms deadline for a scheduled OTA reboot
 _in_settings_mode = False         # Whether on-board settings menu is active
 _settings_index = 0               # Current settings menu item
 
@@ -119,10 +122,8 @@ def _fetch_server_settings():
     """Fetch board settings from server and apply them."""
     global _auto_rotate, _brightness, _current_dir
     url = f"{config.API_URL}/ably/boards/{config.BOARD_ID}/settings"
-    headers = {
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-        "Content-Type": "application/json",
-    }
+    headers = board_auth.headers()
+    headers["Content-Type"] = "application/json"
 
     print(f"[HTTP] POST {url}")
     try:
@@ -140,6 +141,8 @@ def _fetch_server_settings():
             print(f"[SETTINGS] Server settings applied: mode={mode} auto_rotate={_auto_rotate} brightness={_brightness}")
         else:
             response.close()
+            if response.status_code == 401:
+                board_auth.invalidate()
             print(f"[SETTINGS] Server settings fetch failed: {response.status_code}")
     except Exception as e:
         print(f"[SETTINGS] Server settings fetch error: {e}")
@@ -160,10 +163,8 @@ def _show_boot_animation():
 def _get_ably_token():
     """Request an Ably token from the server."""
     url = f"{config.API_URL}/ably/boards/{config.BOARD_ID}/token"
-    headers = {
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-        "Content-Type": "application/json",
-    }
+    headers = board_auth.headers()
+    headers["Content-Type"] = "application/json"
 
     print(f"[HTTP] POST {url}")
     try:
@@ -177,6 +178,8 @@ def _get_ably_token():
             return token
         else:
             print(f"[HTTP] Body: {response.text[:200]}")
+            if response.status_code == 401:
+                board_auth.invalidate()
             response.close()
             return None
     except Exception as e:
@@ -266,110 +269,121 @@ def _attempt_reconnect():
 # Boot Sync
 # =============================================================================
 
+def _load_sync_cursor():
+    try:
+        with open(config.SYNC_CURSOR_FILE, "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _save_sync_cursor(cursor):
+    try:
+        with open(config.SYNC_CURSOR_FILE, "w") as f:
+            f.write(cursor)
+    except OSError as e:
+        print(f"[SYNC] Could not save cursor: {e}")
+
+
+def _sync_download(pending):
+    """
+    Download missing items in one batch request.
+    pending maps message ID -> (sync item, target directory).
+    Returns (synced, all_ok).
+    """
+    _TMP = "/tmp_sp.bin"
+
+    def _store(sp):
+        item, directory = pending.get(sp["message_id"], ({}, config.INBOX_DIR))
+        metadata = {
+            "sender": sp["sender"],
+            "fps": sp["fps"],
+            "is_anim": sp["is_anim"],
+            "width": item.get("width", _BOARD_WIDTH),
+            "height": item.get("height", _BOARD_HEIGHT),
+            "frames": item.get("frames", 1),
+        }
+        metadata.update(sp["pack"])
+        storage.save_message_from_file(sp["message_id"], _TMP, metadata, directory=directory)
+        gc.collect()
+
+    delivered = space_pack.download_batch(list(pending.keys()), _TMP, _store)
+
+    # Retry stragglers one at a time; single downloads resume from .part files
+    for item_id in pending:
+        if item_id in delivered:
+            continue
+        print(f"[SYNC] Retrying {item_id[:12]}... individually")
+        sp = space_pack.download_streaming(item_id, _TMP)
+        if sp is None:
+            print(f"[SYNC] Failed to download {item_id[:12]}...")
+            continue
+        _store(sp)
+        delivered.add(item_id)
+
+    return len(delivered), len(delivered) == len(pending)
+
+
 def _boot_sync():
-    """Fetch recent messages from server and download any we don't have locally."""
+    """
+    Delta sync with the server: post the IDs we hold plus the last cursor,
+    then download only what is missing and drop what was deleted server-side.
+    A 204 means nothing changed since the last complete sync.
+    """
     url = f"{config.API_URL}/app/boards/{config.BOARD_ID}/sync"
-    headers = {
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-    }
+    headers = board_auth.headers()
+    headers["Content-Type"] = "application/json"
 
-    print(f"[HTTP] GET {url}")
+    # Dashless IDs keep the digest small (20 items per directory at most)
+    local_art_ids = storage.list_messages(config.ART_DIR)
+    local_inbox_ids = storage.list_messages(config.INBOX_DIR)
+    payload = json.dumps({
+        "art": [uid.replace("-", "") for uid in local_art_ids],
+        "inbox": [uid.replace("-", "") for uid in local_inbox_ids],
+        "cursor": _load_sync_cursor(),
+    })
+    print(f"[SYNC] Local: {len(local_art_ids)} art, {len(local_inbox_ids)} inbox")
+
+    print(f"[HTTP] POST {url}")
     try:
-        response = urequests.get(url, headers=headers)
-        print(f"[HTTP] <- {response.status_code} ({len(response.content)} bytes)")
+        response = urequests.post(url, headers=headers, data=payload)
+        print(f"[HTTP] <- {response.status_code}")
+        if response.status_code == 204:
+            response.close()
+            print("[SYNC] Up to date.")
+            return
         if response.status_code != 200:
             print(f"[HTTP] Body: {response.text[:200]}")
+            if response.status_code == 401:
+                board_auth.invalidate()
             response.close()
             return
         data = response.json()
         response.close()
     except Exception as e:
-        print(f"[HTTP] GET {url} EXCEPTION: {e}")
-        return
-
-    art_items = data.get("art", [])
-    inbox_items = data.get("inbox", [])
-    total = len(art_items) + len(inbox_items)
-
-    if total == 0:
-        print("[SYNC] No items to sync.")
+        print(f"[HTTP] POST {url} EXCEPTION: {e}")
         return
 
-    print(f"[SYNC] Server has {len(art_items)} art, {len(inbox_items)} inbox")
+    missing = data.get("missing", {})
+    deleted = data.get("deleted", {})
 
-    synced = 0
+    for directory, key in ((config.ART_DIR, "art"), (config.INBOX_DIR, "inbox")):
+        for uid in deleted.get(key, []):
+            print(f"[SYNC] Removing {key} {uid[:12]}... (deleted on server)")
+            storage.delete_message(uid, directory)
 
-    if art_items:
-        local_art_ids = set(storage.list_messages(config.ART_DIR))
-        print(f"[SYNC] Local art: {len(local_art_ids)}")
-        for i, item in enumerate(art_items):
+    pending = {}
+    for directory, key in ((config.ART_DIR, "art"), (config.INBOX_DIR, "inbox")):
+        for item in missing.get(key, []):
             item_id = item.get("messageId", "")
-            status = "LOCAL" if item_id in local_art_ids else "NEW"
-            print(f"[SYNC]   art[{i}] {item_id[:12]}... {status}")
+            print(f"[SYNC]   {key} {item_id[:12]}... NEW")
+            pending[item_id] = (item, directory)
 
-        _TMP = "/tmp_sp.bin"
-        for item in art_items:
-            item_id = item.get("messageId", "")
-            if item_id in local_art_ids:
-                continue
-
-            print(f"[SYNC] Downloading art {item_id[:12]}...")
-            sp = space_pack.download_streaming(item_id, _TMP)
-            if sp is None:
-                print(f"[SYNC] Failed to download art {item_id[:12]}...")
-                continue
-
-            width = item.get("width", _BOARD_WIDTH)
-            height = item.get("height", _BOARD_HEIGHT)
-            frames = item.get("frames", 1)
-
-            metadata = {
-                "sender": sp["sender"],
-                "fps": sp["fps"],
-                "is_anim": sp["is_anim"],
-                "width": width,
-                "height": height,
-                "frames": frames,
-            }
-            storage.save_message_from_file(sp["message_id"], _TMP, metadata, directory=config.ART_DIR)
-            synced += 1
-            gc.collect()
-
-    if inbox_items:
-        local_inbox_ids = set(storage.list_messages(config.INBOX_DIR))
-        print(f"[SYNC] Local inbox: {len(local_inbox_ids)}")
-        for i, item in enumerate(inbox_items):
-            item_id = item.get("messageId", "")
-            status = "LOCAL" if item_id in local_inbox_ids else "NEW"
-            print(f"[SYNC]   inbox[{i}] {item_id[:12]}... {status}")
+    synced, all_ok = _sync_download(pending) if pending else (0, True)
 
-        _TMP = "/tmp_sp.bin"
-        for item in inbox_items:
-            item_id = item.get("messageId", "")
-            if item_id in local_inbox_ids:
-                continue
-
-            print(f"[SYNC] Downloading inbox {item_id[:12]}...")
-            sp = space_pack.download_streaming(item_id, _TMP)
-            if sp is None:
-                print(f"[SYNC] Failed to download inbox {item_id[:12]}...")
-                continue
-
-            width = item.get("width", _BOARD_WIDTH)
-            height = item.get("height", _BOARD_HEIGHT)
-            frames = item.get("frames", 1)
-
-            metadata = {
-                "sender": sp["sender"],
-                "fps": sp["fps"],
-                "is_anim": sp["is_anim"],
-                "width": width,
-                "height": height,
-                "frames": frames,
-            }
-            storage.save_message_from_file(sp["message_id"], _TMP, metadata, directory=config.INBOX_DIR)
-            synced += 1
-            gc.collect()
+    # Only advance the cursor once everything arrived, so failures retry next sync
+    if all_ok and data.get("cursor"):
+        _save_sync_cursor(data["cursor"])
 
     print(f"[SYNC] Synced {synced} new items (art + inbox).")
 
@@ -385,10 +399,8 @@ def _publish_inventory():
     last_eviction = storage.get_last_eviction()
 
     url = f"{config.API_URL}/ably/boards/{config.BOARD_ID}/inventory"
-    headers = {
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-        "Content-Type": "application/json",
-    }
+    headers = board_auth.headers()
+    headers["Content-Type"] = "application/json"
     payload = json.dumps({
         "inbox_count": len(inbox_ids),
         "art_count": len(art_ids),
@@ -399,6 +411,8 @@ def _publish_inventory():
 
     try:
         response = urequests.post(url, headers=headers, data=payload)
+        if response.status_code == 401:
+            board_auth.invalidate()
         response.close()
         print(f"[INVENTORY] Published: inbox={len(inbox_ids)} art={len(art_ids)}")
     except Exception as e:
@@ -419,6 +433,7 @@ def _on_command(payload):
 def _process_commands():
     """Process pending command queue with typed routing."""
     global _current_index, _message_list, _current_dir, _auto_rotate, _brightness, _paused
+    global _os_update_at
 
     while _pending_commands:
         payload = _pending_commands.pop(0)
@@ -485,11 +500,18 @@ def _process_commands():
             wifi_store.handle_wifi_update(payload)
 
         elif cmd_type == "os_update":
-            # A new SpaceOS version is available. Reboot now so main.py
-            # can download and apply the update.
-            print("[CMD] OTA update available — rebooting to apply...")
-            wifi.disconnect()
-            machine.reset()
+            # A new SpaceOS version is available. The server releases it in
+            # waves and lists the boards in this one; reboot after a random
+            # delay so main.py can download and apply the update without
+            # every notified board hitting the server at once.
+            boards = payload.get("boards")
+            if boards is not None and config.BOARD_ID not in boards:
+                print("[CMD] OTA update not for this board yet — ignoring")
+            elif _os_update_at is None:
+                jitter_ms = int(payload.get("jitter", 0)) * 1000
+                delay_ms = random.randint(0, jitter_ms) if jitter_ms > 0 else 0
+                _os_update_at = time.ticks_add(time.ticks_ms(), delay_ms)
+                print(f"[CMD] OTA update available — rebooting in {delay_ms // 1000}s to apply...")
 
         else:
             print(f"[CMD] Unknown command type: {cmd_type}")
@@ -521,7 +543,9 @@ def _handle_content_sync(payload, target_dir):
         "height": height,
         "frames": frames,
     }
+    metadata.update(sp["pack"])
     eviction_info = storage.save_message(sp["message_id"], sp["pixel_data"], metadata, directory=target_dir)
+    pixel_data = space_pack.load(sp["pixel_data"], metadata)
 
     if eviction_info and eviction_info.get("evicted"):
         _publish_eviction_event(eviction_info)
@@ -535,12 +559,12 @@ def _handle_content_sync(payload, target_dir):
     if target_dir == config.INBOX_DIR:
         if sp["is_anim"] and frames > 1:
             player.play_animation(
-                sp["pixel_data"],
+                pixel_data,
                 width, height, frames, fps,
                 on_loop_complete=lambda: ably_mqtt.publish_read_receipt(sp["message_id"]),
             )
         else:
-            player.render_static(sp["pixel_data"], width, height)
+            player.render_static(pixel_data, width, height)
             ably_mqtt.publish_read_receipt(sp["message_id"])
 
     _publish_inventory()
@@ -599,7 +623,8 @@ def _render_current():
     frames = metadata.get("frames", 1)
     fps = metadata.get("fps", config.DEFAULT_FPS)
 
-    print(f"[RENDER] Drawing {width}x{height} {frames}f {len(pixel_data)}B")
+    print(f"[RENDER] Drawing {width}x{height} {frames}f {len(pixel_data)}B v{metadata.get('format', 1)}")
+    pixel_data = space_pack.load(pixel_data, metadata)
     if frames > 1 and not _paused:
         player.start_animation(pixel_data, width, height, frames, fps)
     else:
@@ -821,6 +846,11 @@ def run():
         if _pending_commands:
             _process_commands()
 
+        if _os_update_at is not None and time.ticks_diff(now, _os_update_at) >= 0:
+            print("[CMD] Rebooting to apply OTA update...")
+            wifi.disconnect()
+            machine.reset()
+
         if not wifi.is_connected():
             if time.ticks_diff(now, reconnect_timer) > config.RECONNECT_INTERVAL_MS:
                 reconnect_timer = now
@@ -0,0 +1,85 @@
+# board_auth.py - Board session token for authenticated HTTP requests
+# The raw secret is only sent to the session handshake; every other request
+# carries the short-lived X-Board-Token, which the server validates without
+# re-running scrypt. Falls back to X-Board-Secret if the handshake fails,
+# and backs off before trying the handshake again.
+import time
+import urequests
+
+import config
+
+
+# Refresh this long before the server-side expiry to absorb clock/latency skew.
+_REFRESH_MARGIN_MS = 60 * 1000
+# Wait this long after a failed handshake, doubling up to the max.
+_RETRY_MIN_MS = 30 * 1000
+_RETRY_MAX_MS = 10 * 60 * 1000
+
+_token = None
+_expires_at = 0  # time.ticks_ms() deadline
+_retry_at = None  # time.ticks_ms() before which no handshake is attempted
+_retry_ms = _RETRY_MIN_MS
+
+
+def _handshake():
+    """Exchange the board secret for a session token. Returns True on success."""
+    global _token, _expires_at, _retry_at, _retry_ms
+    url = f"{config.API_URL}/app/boards/{config.BOARD_ID}/session"
+    headers = {
+        "X-Board-Secret": config.BOARD_SECRET_KEY,
+    }
+
+    # Any token left over has expired or been rejected; never send it again.
+    _token = None
+    token = None
+    print(f"[HTTP] POST {url}")
+    try:
+        response = urequests.post(url, headers=headers)
+        if response.status_code == 200:
+            data = response.json()
+            token = data.get("token")
+            if not token:
+                print("[AUTH] Session handshake returned no token")
+        else:
+            print(f"[AUTH] Session handshake failed: {response.status_code}")
+        response.close()
+    except Exception as e:
+        print(f"[AUTH] Session handshake error: {e}")
+
+    if not token:
+        _retry_at = time.ticks_add(time.ticks_ms(), _retry_ms)
+        print(f"[AUTH] Using X-Board-Secret; next handshake in {_retry_ms // 1000}s")
+        _retry_ms = min(_retry_ms * 2, _RETRY_MAX_MS)
+        return False
+
+    _token = token
+    _retry_at = None
+    _retry_ms = _RETRY_MIN_MS
+    lifetime_ms = int(data.get("expires_in", 0)) * 1000 - _REFRESH_MARGIN_MS
+    _expires_at = time.ticks_add(time.ticks_ms(), max(lifetime_ms, 0))
+    print("[AUTH] Session token acquired")
+    return True
+
+
+def headers():
+    """Return auth headers for a board request, refreshing the token if due."""
+    now = time.ticks_ms()
+    if _token is None or time.ticks_diff(_expires_at, now) <= 0:
+        if _retry_at is None or time.ticks_diff(_retry_at, now) <= 0:
+            _handshake()
+
+    if _token:
+        return {
+            "X-Board-Id": config.BOARD_ID,
+            "X-Board-Token": _token,
+        }
+    return {
+        "X-Board-Id": config.BOARD_ID,
+        "X-Board-Secret": config.BOARD_SECRET_KEY,
+    }
+
+
+def invalidate():
+    """Drop the current token (e.g. after a 401) so the next request re-handshakes."""
+    global _token
+    _token = None
@@ -45,3 +45,6 @@ RECONNECT_INTERVAL_MS = 60000  # 60 seconds between reconnection attempts
 
 # Local settings file (persisted on device between reboots)
 SETTINGS_FILE = "/settings.json"
+
+# Cursor from the last complete delta sync (opaque, issued by the server)
+SYNC_CURSOR_FILE = "/sync_cursor"
@@ -8,11 +8,25 @@
 # Signature format:   64 bytes — raw R || S, big-endian
 # Hash:               SHA-256 via uhashlib (C implementation, essentially instant)
 #
-# The two scalar multiplications in verify() are pure Python and still take
-# ~10–20 s on RP2040, but that is unavoidable in any asymmetric scheme.
+# verify() computes u1·G + u2·Q in a single pass (Straus/Shamir): the two
+# scalars share one chain of 256 doublings instead of two, and are recoded
+# as width-w NAF so only about one bit in w+1 costs an addition. G's odd
+# multiples are precomputed below in affine form, so additions of G use the
+# cheaper mixed Jacobian-affine formula. The result is compared with r in
+# projective form, which saves the final inversion. Together this roughly
+# halves the big-integer work of the original double-and-add version.
+# Run scripts/bench_ecdsa.py to time it and check it against `cryptography`.
 
 import uhashlib
 
+try:
+    import micropython
+except ImportError:
+    # CPython (scripts/bench_ecdsa.py). On MicroPython the compiler handles
+    # @micropython.native itself and emits machine code for the hot loops.
+    class micropython:
+        native = staticmethod(lambda f: f)
+
 # ---------------------------------------------------------------------------
 # NIST P-256 (secp256r1) parameters
 # ---------------------------------------------------------------------------
@@ -22,6 +36,79 @@ _A = 0xFFFFFFFF00000001000000000000000000000000FFFFFFFFFFFFFFFFFFFFFFFC  # = -3
 _GX = 0x6B17D1F2E12C4247F8BCE6E563A440F277037D812DEB33A0F4A13945D898C296
 _GY = 0x4FE342E2FE1A7F9B8EE7EB4A7C0F9E162BCE33576B315ECECBB6406837BF51F5
 
+# NAF window widths. G's table is fixed (2^(w-2) affine points below); Q's
+# table is built per verify in Jacobian form, so it stays small.
+_G_WINDOW = 7
+_Q_WINDOW = 5
+
+# Odd multiples 1G, 3G, ..., 63G in affine coordinates: _G_TABLE[i] = (2i+1)·G.
+_G_TABLE = (
+    (0x6B17D1F2E12C4247F8BCE6E563A440F277037D812DEB33A0F4A13945D898C296,
+     0x4FE342E2FE1A7F9B8EE7EB4A7C0F9E162BCE33576B315ECECBB6406837BF51F5),  # 1G
+    (0x5ECBE4D1A6330A44C8F7EF951D4BF165E6C6B721EFADA985FB41661BC6E7FD6C,
+     0x8734640C4998FF7E374B06CE1A64A2ECD82AB036384FB83D9A79B127A27D5032),  # 3G
+    (0x51590B7A515140D2D784C85608668FDFEF8C82FD1F5BE52421554A0DC3D033ED,
+     0xE0C17DA8904A727D8AE1BF36BF8A79260D012F00D4D80888D1D0BB44FDA16DA4),  # 5G
+    (0x8E533B6FA0BF7B4625BB30667C01FB607EF9F8B8A80FEF5B300628703187B2A3,
+     0x73EB1DBDE03318366D069F83A6F5900053C73633CB041B21C55E1A86C1F400B4),  # 7G
+    (0xEA68D7B6FEDF0B71878938D51D71F8729E0ACB8C2C6DF8B3D79E8A4B90949EE0,
+     0x2A2744C972C9FCE787014A964A8EA0C84D714FEAA4DE823FE85A224A4DD048FA),  # 9G
+    (0x3ED113B7883B4C590638379DB0C21CDA16742ED0255048BF433391D374BC21D1,
+     0x9099209ACCC4C8A224C843AFA4F4C68A090D04DA5E9889DAE2F8EEFCE82A3740),  # 11G
+    (0x177C837AE0AC495A61805DF2D85EE2FC792E284B65EAD58A98E15D9D46072C01,
+     0x63BB58CD4EBEA558A24091ADB40F4E7226EE14C3A1FB4DF39C43BBE2EFC7BFD8),  # 13G
+    (0xF0454DC6971ABAE7ADFB378999888265AE03AF92DE3A0EF163668C63E59B9D5F,
+     0xB5B93EE3592E2D1F4E6594E51F9643E62A3B21CE75B5FA3F47E59CDE0D034F36),  # 15G
+    (0x47776904C0F1CC3A9C0984B66F75301A5FA68678F0D64AF8BA1ABCE34738A73E,
+     0xAA005EE6B5B957286231856577648E8381B2804428D5733F32F787FF71F1FCDC),  # 17G
+    (0xCB6D2861102C0C25CE39B7C17108C507782C452257884895C1FC7B74AB03ED83,
+     0x58D7614B24D9EF515C35E7100D6D6CE4A496716E30FA3E03E39150752BCECDAA),  # 19G
+    (0x3250FCF686637C7B2E4AC86EB473BCA53A582139F42B1523FD76364E67399E83,
+     0x42E7C342667D359397B3090D1D7EB88C897CD3C33B566A8215DE24A071D48C09),  # 21G
+    (0x0E91C7239C2640D7D28A3E39D4583FA63C0BC0A5DF64A4FE672E573045CA7896,
+     0x5DF65C3B550DBA221A22733BB8E0BD6D7E68833575E7A5AE138046543140AD55),  # 23G
+    (0x3A67E2554B0C0BB685F4F52D8C07FA8441652FC5B76F1B2484A4DC45F200D687,
+     0x27D0F1872F1FCF4326DAF267163AFB0D8C188AF735A7618AA9ED16B302F79324),  # 25G
+    (0x184FFA5819D80D51DEBA2FAC4611F378576355BD683E54ABF2E201173B0883D1,
+     0xC0A66E276688F359A4C6D90826CB999545BDECCC63F0491620D242C260906E6F),  # 27G
+    (0xD6D33ADEFA195B07A7C36DA090853B8CFD8CD1C688B58A41DEDD693D1C784DEF,
+     0x84AABA16EE195D7E3F78245F558A5DCB09A166AB4B95EDED550C124593D1BCA6),  # 29G
+    (0x301D9E502DC7E05DA85DA026A7AE9AA0FAC9DB7D52A95B3E3E3F9AA0A1B45B8B,
+     0x6551B6F6B3061223E0D23C026B017D72298D9AE46887CA61D58DB6AEA17EE267),  # 31G
+    (0x9807D699FCD81356FA9AA25B89D9D34EA03B0A533AA872FD65C100F3CB2CD793,
+     0xC2A59CDCCAB11BF286A01A4D1D091B2FFFE630B96C5878532F6BF92479634AF4),  # 33G
+    (0xD58D4A589ED27D168FFA3AD7326C48CA94E8E1FE92AF9700A12D389033BB291A,
+     0xD45514D102726B8576EA92632DC7FEF667271C163B034979A5B0C9C6F586B9D5),  # 35G
+    (0x419A6A646DDB817DD6B0978611A826AAE0D21379246BFD4473A92894502B3348,
+     0x332544CF1102F584545C9FB1954C2FD513C6D072F3DEE1E2DB1D6C81B09214B2),  # 37G
+    (0x22A682F7C3996D4D42014976A179046E547B942DD2D138D4A0C199DDFB2776C4,
+     0x4F4606B0102223EEB918C9835A54356C979DCC310265B0685347F649CBAA285D),  # 39G
+    (0x67A6BEC240DEE0651CF258D2E6CFE8AA6067C5C3D4175A593A7DE694995D2FA2,
+     0xDE692B7022D131586C249B49464D44991542C7EE209ACA6C49C24CE1441FEED5),  # 41G
+    (0x986AE2506F1FF104D04230861D8F4B498F4BC4C6D009B30F7544DC129B82D28D,
+     0x003CCCC0A6460E0AE328A4D97D3C7B61D86FC6289C189F2525110C441BB07E97),  # 43G
+    (0xA891D06670BDE99B3ECD0F5DDFF0672E0F5F609EDD29D6D979C78080FAE0BA03,
+     0xB596CD922CBFA1C1419A88C4033C1CE71C6B38F0FEB0F2CCEFC3EDC8166934AE),  # 45G
+    (0x42C315CC48958708595361EA83071BBCDD5B31583E19066D51D689227B1C0D7C,
+     0x649A61CE571B95852914D1DFBB7A799074F1A1E1EB87F164D6C4A72BB2F9B1B9),  # 47G
+    (0xF785B0E098068875BB22B146866E6C0528FB7EA9758FD4FD7D228CE6A5674455,
+     0x73FDB0BF6080DA6EE15C767F0D9F5B414B04B6FD5F3AA60AE7BC490C10D62408),  # 49G
+    (0x672C4A514D9DE43EAADEE6863C1D68BC95F7EB56E81008FF044360F0018E22B1,
+     0x548C7E9196A25BFE611DE5A4ACE203F7136246589704D9419935399191F37104),  # 51G
+    (0x6F01BD49C9D952455A47802254B88039982B1CA78DE9B983F126EC9F7449D036,
+     0x1562080FF1D5DEAB11A0F21A608776CEA78551BFC3749B08360233DD989E17DB),  # 53G
+    (0x079DBA7BA068C9267571A109FE7FEA2CC2A595B762C1EADADEC1DFF7DF6E60A0,
+     0xDC1E19B743D4D1811D223F9D2A9588AB83EB2DF35751A397FB0DA5AEB4824DEA),  # 55G
+    (0xC116E30EBB4D2865126D45A8EA907F86289D406E2D6C6BD88ABD97B1D0F56077,
+     0xE9478823C35B30C2B8B16D9BB13B87657D5BD5E89E59C8C5313FD7FDA410C206),  # 57G
+    (0x665F1A6FFE0C6437765B2784FCA9BDF7E50941119E8DC8ECA2B6EA0E0FAA4B45,
+     0x490E2CA49FFD18C26E8CCA29F7EAC37F7DEDE5BF81E215BC6E25A6602B7F4CCF),  # 59G
+    (0x059CCB19EDD3DA9A2D3A6B3D8D9900013E7910A08B724FD55939AC380D32AF0E,
+     0xBB6AD7ECCAD49159DA65281B9345638E1621F7A33956CECD928E1E3C97FE91D1),  # 61G
+    (0x6A9501D85BF5DC802A1F28A08ACC7D8FDF53C8AF01A7CD3832A290825D8BDAC1,
+     0xCA640AD19347374381C6C6E44A3C56A3F8461B5C697A6F3530AFF53D5F1EF1A3),  # 63G
+)
+
 
 # ---------------------------------------------------------------------------
 # Jacobian projective coordinates  (X:Y:Z)  where affine x=X/Z², y=Y/Z³.
@@ -29,6 +116,7 @@ _GY = 0x4FE342E2FE1A7F9B8EE7EB4A7C0F9E162BCE33576B315ECECBB6406837BF51F5
 # ---------------------------------------------------------------------------
 
 
+@micropython.native
 def _jdouble(X1, Y1, Z1):
     """Point doubling — uses the a=−3 shortcut valid for P-256."""
     if Z1 == 0:
@@ -43,6 +131,7 @@ def _jdouble(X1, Y1, Z1):
     return (X3, Y3, Z3)
 
 
+@micropython.native
 def _jadd(X1, Y1, Z1, X2, Y2, Z2):
     """Full Jacobian point addition (both points in projective coordinates)."""
     if Z1 == 0:
@@ -67,23 +156,79 @@ def _jadd(X1, Y1, Z1, X2, Y2, Z2):
     return (X3, Y3, Z3)
 
 
-def _jmul(k, Px, Py):
+@micropython.native
+def _jadd_affine(X1, Y1, Z1, x2, y2):
+    """Mixed addition of a Jacobian point and an affine point (Z2 = 1)."""
+    if Z1 == 0:
+        return (x2, y2, 1)
+    Z1sq = Z1 * Z1 % _P
+    H = (x2 * Z1sq - X1) % _P
+    R = (y2 * Z1sq * Z1 - Y1) % _P
+    if H == 0:
+        return _jdouble(X1, Y1, Z1) if R == 0 else (0, 1, 0)
+    H2 = H * H % _P
+    H3 = H * H2 % _P
+    V = X1 * H2 % _P
+    X3 = (R * R - H3 - 2 * V) % _P
+    Y3 = (R * (V - X3) - Y1 * H3) % _P
+    Z3 = Z1 * H % _P
+    return (X3, Y3, Z3)
+
+
+def _wnaf(k, w):
     """
-    Scalar multiplication k*(Px,Py) using double-and-add.
-    Returns affine (x, y) or None for the point at infinity.
+    Width-w NAF digits of k, least significant first. Every digit is 0 or
+    odd with |d| < 2^(w-1), and any w consecutive digits hold at most one
+    non-zero.
     """
-    Qx, Qy, Qz = 0, 1, 0  # accumulator — starts at infinity
-    Rx, Ry, Rz = Px, Py, 1  # current bit-value of P in Jacobian
+    digits = []
+    window = 1 << w
+    half = window >> 1
     while k:
+        d = 0
         if k & 1:
-            Qx, Qy, Qz = _jadd(Qx, Qy, Qz, Rx, Ry, Rz)
-        Rx, Ry, Rz = _jdouble(Rx, Ry, Rz)
+            d = k & (window - 1)
+            if d >= half:
+                d -= window
+            k -= d
+        digits.append(d)
         k >>= 1
-    if Qz == 0:
-        return None
-    Zinv = pow(Qz, _P - 2, _P)
-    Zinv2 = Zinv * Zinv % _P
-    return (Qx * Zinv2 % _P, Qy * Zinv2 * Zinv % _P)
+    return digits
+
+
+def _odd_multiples(x, y, count):
+    """[P, 3P, 5P, ...] (count points, Jacobian) for an affine point P."""
+    table = [(x, y, 1)]
+    if count > 1:
+        X2, Y2, Z2 = _jdouble(x, y, 1)
+        for _ in range(count - 1):
+            X, Y, Z = table[-1]
+            table.append(_jadd(X, Y, Z, X2, Y2, Z2))
+    return table
+
+
+def _mul_add(u1, u2, Qx, Qy):
+    """u1·G + u2·Q as a Jacobian point, with one shared doubling chain."""
+    q_table = _odd_multiples(Qx, Qy, 1 << (_Q_WINDOW - 2))
+    g_digits = _wnaf(u1, _G_WINDOW)
+    q_digits = _wnaf(u2, _Q_WINDOW)
+    g_len = len(g_digits)
+    q_len = len(q_digits)
+
+    X, Y, Z = 0, 1, 0
+    for i in range(max(g_len, q_len) - 1, -1, -1):
+        X, Y, Z = _jdouble(X, Y, Z)
+        if i < g_len:
+            d = g_digits[i]
+            if d:
+                x, y = _G_TABLE[(d if d > 0 else -d) >> 1]
+                X, Y, Z = _jadd_affine(X, Y, Z, x, y if d > 0 else _P - y)
+        if i < q_len:
+            d = q_digits[i]
+            if d:
+                qX, qY, qZ = q_table[(d if d > 0 else -d) >> 1]
+                X, Y, Z = _jadd(X, Y, Z, qX, qY if d > 0 else _P - qY, qZ)
+    return X, Y, Z
 
 
 # ---------------------------------------------------------------------------
@@ -103,7 +248,19 @@ def verify(public_key, message, signature):
     Returns:
         True if valid, False otherwise.
     """
-    if len(public_key) != 64 or len(signature) != 64:
+    h_obj = uhashlib.sha256()
+    h_obj.update(message)
+    return verify_digest(public_key, h_obj.digest(), signature)
+
+
+def verify_digest(public_key, digest, signature):
+    """
+    Verify an ECDSA P-256 signature over a precomputed SHA-256 digest.
+
+    Lets callers hash a message as it streams in (e.g. an OTA bundle written
+    to flash in chunks) instead of holding it in RAM for verify().
+    """
+    if len(public_key) != 64 or len(signature) != 64 or len(digest) != 32:
         return False
 
     r = int.from_bytes(signature[:32], "big")
@@ -114,31 +271,20 @@ def verify(public_key, message, signature):
     Qx = int.from_bytes(public_key[:32], "big")
     Qy = int.from_bytes(public_key[32:], "big")
 
-    h_obj = uhashlib.sha256()
-    h_obj.update(message)
-    e = int.from_bytes(h_obj.digest(), "big")
+    e = int.from_bytes(digest, "big")
 
     w = pow(s, _N - 2, _N)  # modular inverse of s
     u1 = e * w % _N
     u2 = r * w % _N
 
     # X = u1·G + u2·Q
-    P1 = _jmul(u1, _GX, _GY)
-    P2 = _jmul(u2, Qx, Qy)
-
-    if P1 is None:
-        pt = P2
-    elif P2 is None:
-        pt = P1
-    else:
-        jx, jy, jz = _jadd(P1[0], P1[1], 1, P2[0], P2[1], 1)
-        if jz == 0:
-            return False
-        Zinv = pow(jz, _P - 2, _P)
-        Zinv2 = Zinv * Zinv % _P
-        pt = (jx * Zinv2 % _P, jy * Zinv2 * Zinv % _P)
-
-    if pt is None:
+    X, Y, Z = _mul_add(u1, u2, Qx, Qy)
+    if Z == 0:
         return False
 
-    return pt[0] % _N == r
+    # Valid iff x(X) mod n == r, where x = X/Z². Rather than invert Z, test
+    # X == x·Z² for the (at most two) x < p that reduce to r.
+    Zsq = Z * Z % _P
+    if X == r * Zsq % _P:
+        return True
+    return r + _N < _P and X == (r + _N) * Zsq % _P
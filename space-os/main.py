@@ -4,12 +4,17 @@
 # Responsibilities (in order):
 #   1. Detect and recover from interrupted updates (.updating flag).
 #   2. Connect to WiFi.
-#   3. Check for a new OTA bundle from the server.
+#   3. Check for a new OTA update from the server (a per-file delta when the
+#      server supports it, else the full bundle).
 #   4. If update available: verify Ed25519 signature, apply files, reboot.
 #   5. Hand off to app.py (the updatable OS entry point).
 #
 # This file intentionally stays small. All normal OS functionality lives in app.py.
+import gc
+import io
 import os
+import sys
+import json
 import time
 import machine
 import uhashlib
@@ -32,6 +37,11 @@ import wifi_store
 import ecdsa_p256
 import update_key
 
+try:
+    import deflate  # MicroPython 1.21+
+except ImportError:
+    deflate = None
+
 
 # =============================================================================
 # Constants
@@ -39,6 +49,10 @@ import update_key
 
 OS_HASH_FILE = "/os_hash"
 UPDATING_FLAG = "/.updating"
+MANIFEST_NAME = "os_manifest.json"   # signed per-file manifest of the installed OS
+REPAIR_FLAG = "/.repair"            # set when the installed modules cannot be imported
+CHUNK_SIZE = 1024                    # bytes read from the socket / written to flash at a time
+DEFLATE_TYPE = "application/vnd.spaceos.bundle+deflate"
 
 
 # =============================================================================
@@ -59,10 +73,25 @@ def _write_os_hash(hash_hex):
         f.write(hash_hex)
 
 
-def _sha256_hex(data):
-    h = uhashlib.sha256()
-    h.update(data)
-    return "".join("{:02x}".format(b) for b in h.digest())
+def _hex(digest):
+    return "".join("{:02x}".format(b) for b in digest)
+
+
+def _read_manifest_hashes():
+    """Return {filename: sha256_hex} from the installed manifest, or {} if none."""
+    try:
+        with open("/" + MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+        return {name: entry["sha256"] for name, entry in manifest["files"].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _remove_manifest():
+    try:
+        os.remove("/" + MANIFEST_NAME)
+    except OSError:
+        pass
 
 
 # =============================================================================
@@ -84,15 +113,85 @@ def _cleanup_partial_files():
 
 
 # =============================================================================
-# Bundle application (safe write with .updating flag)
+# Bundle application (streamed to flash, safe write with .updating flag)
 # =============================================================================
+#
+# Updates are never held in RAM. The response body is read CHUNK_SIZE bytes
+# at a time and each file is written straight to /<name>.new while SHA-256
+# runs over the stream. The signature is checked against that digest only
+# once everything is on flash, and the .new files are renamed over the
+# originals only if it matches. Memory use stays constant as the OS grows.
+#
+# Compressed responses (DEFLATE_TYPE) are inflated on the fly by
+# deflate.DeflateIO between the hashing reader and the file writer, so the
+# signature still covers the bytes as sent.
 
-def _apply_bundle(bundle_data):
+class _HashingReader(io.IOBase):
+    """Wrap a response stream, feeding every byte read into hashers.
+
+    Subclasses io.IOBase with readinto() so deflate.DeflateIO can read
+    through it.
     """
-    Verify Ed25519 signature and apply an OTA bundle.
 
-    Bundle format:
-        [64 bytes: Ed25519 signature of everything after]
+    def __init__(self, stream, hashers):
+        self._stream = stream
+        self._hashers = hashers
+
+    def readinto(self, buf):
+        n = self._stream.readinto(buf)
+        if n:
+            view = memoryview(buf)[:n]
+            for h in self._hashers:
+                h.update(view)
+        return n
+
+    def read(self, size):
+        data = self._stream.read(size)
+        if data:
+            for h in self._hashers:
+                h.update(data)
+        return data
+
+    def drain(self):
+        """Consume (and hash) anything left in the stream."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes, or return None if the stream ends first."""
+    buf = b""
+    while len(buf) < size:
+        data = stream.read(size - len(buf))
+        if not data:
+            return None
+        buf += data
+    return buf
+
+
+def _begin_update():
+    try:
+        with open(UPDATING_FLAG, "w") as f:
+            f.write("1")
+        return True
+    except Exception as e:
+        print(f"[UPDATE] Could not write .updating flag: {e}")
+        return False
+
+
+def _abort_update():
+    """Discard unverified .new files and clear the flag."""
+    _cleanup_partial_files()
+    try:
+        os.remove(UPDATING_FLAG)
+    except OSError:
+        pass
+
+
+def _receive_files(stream, expected=None):
+    """
+    Stream the file list into /<name>.new files:
+
         [4 bytes: file count, big-endian uint32]
         for each file:
             [2 bytes: filename length, big-endian uint16]
@@ -100,84 +199,86 @@ def _apply_bundle(bundle_data):
             [4 bytes: file content length, big-endian uint32]
             [M bytes: file content]
 
-    Returns True on success (board will machine.reset() after return).
-    Returns False if verification or parsing fails (caller continues normally).
+    expected maps filename -> manifest entry; when given, every file must be
+    listed and match its sha256. Returns the names written, or None.
     """
-    if len(bundle_data) < 68:  # 64-byte sig + at least 4 bytes
-        print("[UPDATE] Bundle too small to be valid")
-        return False
-
-    signature = bundle_data[:64]
-    payload = bundle_data[64:]
-
-    # --- Ed25519 signature verification ---
-    print("[UPDATE] Verifying signature (this may take a moment)...")
-    if not ecdsa_p256.verify(update_key.PUBLIC_KEY, payload, signature):
-        print("[UPDATE] Signature verification FAILED — aborting update")
-        return False
-    print("[UPDATE] Signature OK")
-
-    # --- Parse bundle ---
-    if len(payload) < 4:
+    header = _read_exact(stream, 4)
+    if header is None:
         print("[UPDATE] Malformed bundle: missing file count")
-        return False
-
-    file_count = int.from_bytes(payload[0:4], "big")
-    offset = 4
-    files = []
+        return None
+    file_count = int.from_bytes(header, "big")
+    names = []
 
     for _ in range(file_count):
-        if offset + 2 > len(payload):
+        header = _read_exact(stream, 2)
+        if header is None:
             print("[UPDATE] Malformed bundle: truncated name length")
-            return False
-        name_len = int.from_bytes(payload[offset:offset + 2], "big")
-        offset += 2
-
-        if offset + name_len > len(payload):
+            return None
+        raw_name = _read_exact(stream, int.from_bytes(header, "big"))
+        if raw_name is None:
             print("[UPDATE] Malformed bundle: truncated filename")
-            return False
-        name = payload[offset:offset + name_len].decode("utf-8")
-        offset += name_len
-
-        if offset + 4 > len(payload):
+            return None
+        name = raw_name.decode("utf-8")
+        if not name or "/" in name or name.startswith("."):
+            print(f"[UPDATE] Malformed bundle: bad filename {name!r}")
+            return None
+        header = _read_exact(stream, 4)
+        if header is None:
             print("[UPDATE] Malformed bundle: truncated content length")
-            return False
-        content_len = int.from_bytes(payload[offset:offset + 4], "big")
-        offset += 4
+            return None
+        remaining = int.from_bytes(header, "big")
+        size = remaining
+
+        entry = None
+        if expected is not None:
+            entry = expected.get(name)
+            if entry is None:
+                print(f"[UPDATE] {name} is not in the signed manifest — aborting update")
+                return None
+        h = uhashlib.sha256()
+        try:
+            with open("/" + name + ".new", "wb") as f:
+                while remaining:
+                    data = stream.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        print("[UPDATE] Malformed bundle: truncated content for " + name)
+                        return None
+                    f.write(data)
+                    h.update(data)
+                    remaining -= len(data)
+        except OSError as e:
+            print(f"[UPDATE] Failed to write /{name}.new: {e}")
+            return None
 
-        if offset + content_len > len(payload):
-            print("[UPDATE] Malformed bundle: truncated content for " + name)
-            return False
-        content = payload[offset:offset + content_len]
-        offset += content_len
+        if entry is not None and _hex(h.digest()) != entry.get("sha256"):
+            print(f"[UPDATE] {name} does not match the signed manifest — aborting update")
+            return None
+        names.append(name)
+        print(f"[UPDATE] Wrote /{name}.new ({size} bytes)")
 
-        files.append((name, content))
-        print(f"[UPDATE] Parsed: {name} ({content_len} bytes)")
+    return names
 
-    new_hash = _sha256_hex(bundle_data)
 
-    # --- Safe write: set flag, write .new, rename ---
-    # Step 1: Write .updating flag
-    try:
-        with open(UPDATING_FLAG, "w") as f:
-            f.write("1")
-    except Exception as e:
-        print(f"[UPDATE] Could not write .updating flag: {e}")
-        return False
+def _finish_update(names, new_hash, manifest_bytes=None):
+    """
+    Rename verified .new files over the originals and record the new hash.
 
-    # Step 2: Write all files with .new suffix
-    for name, content in files:
-        new_path = "/" + name + ".new"
+    manifest_bytes is installed alongside the files after a delta update. A
+    full bundle carries no manifest, so the old one is removed and the next
+    delta check fetches every file once.
+    """
+    if manifest_bytes is not None:
         try:
-            with open(new_path, "wb") as f:
-                f.write(content)
-            print(f"[UPDATE] Wrote {new_path}")
-        except Exception as e:
-            print(f"[UPDATE] Failed to write {new_path}: {e}")
-            # Continue — cleanup on next boot will retry the update
+            with open("/" + MANIFEST_NAME + ".new", "wb") as f:
+                f.write(manifest_bytes)
+            names = names + [MANIFEST_NAME]
+        except OSError as e:
+            print(f"[UPDATE] Could not write manifest: {e}")
+            _remove_manifest()
+    else:
+        _remove_manifest()
 
-    # Step 3: Rename .new -> original
-    for name, _ in files:
+    for name in names:
         src = "/" + name + ".new"
         dst = "/" + name
         try:
@@ -190,30 +291,164 @@ def _apply_bundle(bundle_data):
         except Exception as e:
             print(f"[UPDATE] Rename failed: {src} -> {dst}: {e}")
 
-    # Step 4: Write new hash
+    # A module switching between source and .mpy leaves its other form
+    # behind; drop it, since MicroPython imports name.py before name.mpy.
+    for name in names:
+        base, _, ext = name.rpartition(".")
+        other = {"py": ".mpy", "mpy": ".py"}.get(ext)
+        if other and base != "main":
+            try:
+                os.remove("/" + base + other)
+                print(f"[UPDATE] Removed /{base}{other}")
+            except OSError:
+                pass
+
     _write_os_hash(new_hash)
 
-    # Step 5: Remove .updating flag
-    try:
-        os.remove(UPDATING_FLAG)
-    except OSError:
-        pass
+    for flag in (UPDATING_FLAG, REPAIR_FLAG):
+        try:
+            os.remove(flag)
+        except OSError:
+            pass
 
     print(f"[UPDATE] Update applied. New hash: {new_hash[:16]}...")
     return True
 
 
+def _inflated(stream, compressed):
+    return deflate.DeflateIO(stream, deflate.ZLIB) if compressed else stream
+
+
+def _apply_bundle(stream, compressed=False):
+    """
+    Stream, verify and apply a full OTA bundle.
+
+    Bundle format:
+        [64 bytes: ECDSA P-256 signature of everything after]
+        [file list, see _receive_files — zlib-compressed if compressed]
+
+    Returns True on success (board will machine.reset() after return).
+    Returns False if verification or parsing fails (caller continues normally).
+    """
+    signature = _read_exact(stream, 64)
+    if signature is None:
+        print("[UPDATE] Bundle too small to be valid")
+        return False
+
+    payload_hash = uhashlib.sha256()   # what the signature covers
+    bundle_hash = uhashlib.sha256()    # the whole file, recorded as os_hash
+    bundle_hash.update(signature)
+    reader = _HashingReader(stream, (payload_hash, bundle_hash))
+
+    if not _begin_update():
+        return False
+    try:
+        names = _receive_files(_inflated(reader, compressed))
+    except Exception as e:  # socket errors, corrupt deflate data
+        print(f"[UPDATE] Download failed: {e}")
+        names = None
+    if names is None:
+        _abort_update()
+        return False
+    reader.drain()
+
+    print("[UPDATE] Verifying signature (this may take a moment)...")
+    if not ecdsa_p256.verify_digest(update_key.PUBLIC_KEY, payload_hash.digest(), signature):
+        print("[UPDATE] Signature verification FAILED — aborting update")
+        _abort_update()
+        return False
+    print("[UPDATE] Signature OK")
+
+    return _finish_update(names, _hex(bundle_hash.digest()))
+
+
+def _apply_delta(stream, compressed=False):
+    """
+    Stream, verify and apply a delta update from POST /api/spaceos/delta.
+
+    Delta format:
+        [64 bytes: signature of the manifest]
+        [4 bytes: manifest length, big-endian uint32]
+        [N bytes: manifest JSON]
+        [file list, see _receive_files — only the files that changed,
+         zlib-compressed if compressed]
+
+    The manifest (a few hundred bytes) is read and verified first. Each file
+    must then match its manifest hash before anything is renamed. The
+    manifest's "bundle" hash becomes os_hash.
+    """
+    signature = _read_exact(stream, 64)
+    header = _read_exact(stream, 4) if signature is not None else None
+    if header is None:
+        print("[UPDATE] Delta too small to be valid")
+        return False
+    manifest_bytes = _read_exact(stream, int.from_bytes(header, "big"))
+    if manifest_bytes is None:
+        print("[UPDATE] Malformed delta: truncated manifest")
+        return False
+
+    print("[UPDATE] Verifying manifest signature (this may take a moment)...")
+    if not ecdsa_p256.verify(update_key.PUBLIC_KEY, manifest_bytes, signature):
+        print("[UPDATE] Signature verification FAILED — aborting update")
+        return False
+    print("[UPDATE] Signature OK")
+
+    try:
+        manifest = json.loads(manifest_bytes)
+        entries = manifest["files"]
+        new_hash = manifest["bundle"]
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"[UPDATE] Malformed manifest: {e}")
+        return False
+
+    if not _begin_update():
+        return False
+    try:
+        names = _receive_files(_inflated(stream, compressed), entries)
+    except Exception as e:  # socket errors, corrupt deflate data
+        print(f"[UPDATE] Download failed: {e}")
+        names = None
+    if names is None:
+        _abort_update()
+        return False
+
+    print(f"[UPDATE] {len(names)} of {len(entries)} files changed")
+    return _finish_update(names, new_hash, manifest_bytes)
+
+
 # =============================================================================
 # OTA check
 # =============================================================================
 
-def _safe_request(url, headers):
-    """Make an HTTP GET with one retry for cold starts.
+def _ota_headers():
+    headers = {
+        "X-Board-Id": config.BOARD_ID,
+        "X-Board-Secret": config.BOARD_SECRET_KEY,
+    }
+    if deflate is not None:
+        headers["Accept"] = DEFLATE_TYPE + ", application/octet-stream"
+    return headers
+
+
+def _is_compressed(response):
+    """Whether the server sent the deflate variant (per its Content-Type)."""
+    headers = getattr(response, "headers", None) or {}
+    for key in headers:
+        if key.lower() == "content-type":
+            return deflate is not None and DEFLATE_TYPE in headers[key]
+    return False
+
+
+def _safe_request(url, headers, data=None):
+    """Make an HTTP GET (or a POST when data is given) with one retry for cold starts.
 
     Returns the response object or None.
     """
     for attempt in range(2):
         try:
+            if data is not None:
+                print(f"[UPDATE] POST (attempt {attempt + 1}) {url}")
+                return urequests.post(url, headers=headers, data=data)
             print(f"[UPDATE] GET (attempt {attempt + 1}) {url}")
             return urequests.get(url, headers=headers)
         except OSError as e:
@@ -225,18 +460,76 @@ def _safe_request(url, headers):
     return None
 
 
+def _check_for_delta():
+    """
+    Ask the server for only the files that differ from the installed manifest.
+    Returns True/False like _check_for_update, or None if the server has no
+    delta support (caller falls back to the full bundle).
+    """
+    url = f"{config.API_URL}/api/spaceos/delta"
+    headers = _ota_headers()
+    headers["Content-Type"] = "application/json"
+    body = {"hash": _read_os_hash(), "files": _read_manifest_hashes()}
+    mpy = getattr(sys.implementation, "_mpy", None)
+    if mpy is not None:
+        body["mpy"] = mpy  # bytecode ABI; the server sends matching .mpy modules
+    try:
+        os.stat(REPAIR_FLAG)
+        body["repair"] = True
+    except OSError:
+        pass
+    body = json.dumps(body)
+
+    try:
+        response = _safe_request(url, headers, data=body)
+        if response is None:
+            print("[UPDATE] OTA check timed out — launching local OS")
+            return False
+
+        status = response.status_code
+
+        if status == 204:
+            response.close()
+            print("[UPDATE] Already up to date.")
+            return False
+
+        if status == 200:
+            compressed = _is_compressed(response)
+            print(f"[UPDATE] Receiving {'compressed ' if compressed else ''}delta...")
+            try:
+                applied = _apply_delta(response.raw, compressed)
+            finally:
+                response.close()
+            if applied:
+                return True
+            print("[UPDATE] Delta apply failed — continuing with current OS")
+            return False
+
+        response.close()
+        if status in (404, 405):
+            print("[UPDATE] No delta updates on server — checking full bundle")
+            return None
+        print(f"[UPDATE] Unexpected status: {status}")
+        return False
+
+    except Exception as e:
+        print(f"[UPDATE] OTA delta check error: {e}")
+        return False
+
+
 def _check_for_update():
     """
     Query the server for an OTA update.
     Returns True if a successful update was applied (caller should machine.reset()).
     Returns False if already up to date, OTA disabled, or any error.
     """
+    delta_result = _check_for_delta()
+    if delta_result is not None:
+        return delta_result
+
     os_hash = _read_os_hash()
     url = f"{config.API_URL}/api/spaceos/check?hash={os_hash}"
-    headers = {
-        "X-Board-Id": config.BOARD_ID,
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-    }
+    headers = _ota_headers()
 
     try:
         response = _safe_request(url, headers)
@@ -252,16 +545,16 @@ def _check_for_update():
             return False
 
         if status == 200:
-            bundle_data = response.content
-            response.close()
-            size = len(bundle_data)
-            print(f"[UPDATE] Bundle received: {size} bytes")
-
-            if _apply_bundle(bundle_data):
+            compressed = _is_compressed(response)
+            print(f"[UPDATE] Receiving {'compressed ' if compressed else ''}bundle...")
+            try:
+                applied = _apply_bundle(response.raw, compressed)
+            finally:
+                response.close()
+            if applied:
                 return True
-            else:
-                print("[UPDATE] Bundle apply failed — continuing with current OS")
-                return False
+            print("[UPDATE] Bundle apply failed — continuing with current OS")
+            return False
 
         response.close()
         print(f"[UPDATE] Unexpected status: {status}")
@@ -276,6 +569,30 @@ def _check_for_update():
 # Boot sequence
 # =============================================================================
 
+# Updatable modules in dependency order. They are imported one at a time so
+# the boot log shows what each costs: source is compiled on the board, .mpy
+# bytecode is loaded as-is.
+APP_MODULES = ("storage", "board_auth", "space_pack", "player", "buttons",
+               "commands", "ably_mqtt", "app")
+
+
+def _import_app():
+    """Import app (and its modules), logging time and heap used per module."""
+    boot_start = time.ticks_ms()
+    module = None
+    for name in APP_MODULES:
+        gc.collect()
+        free = gc.mem_free()
+        start = time.ticks_ms()
+        module = __import__(name)
+        kind = "mpy" if getattr(module, "__file__", "").endswith(".mpy") else "py"
+        print(f"[BOOT] import {name} ({kind}): "
+              f"{time.ticks_diff(time.ticks_ms(), start)} ms, {free - gc.mem_free()} B")
+    print(f"[BOOT] Modules loaded in {time.ticks_diff(time.ticks_ms(), boot_start)} ms, "
+          f"{gc.mem_free()} B free")
+    return module
+
+
 def main():
     # 0. Kill the LEDs immediately to reduce EMI and voltage sag during WiFi.
     #    Auto-detect board type (Cosmic / Galactic / Stellar) the same way
@@ -316,6 +633,9 @@ def main():
         os.stat(UPDATING_FLAG)
         print("[BOOT] Interrupted update detected — cleaning up and retrying")
         _cleanup_partial_files()
+        # Some files may already be renamed; drop the manifest so the retry
+        # re-fetches every file rather than trusting stale hashes.
+        _remove_manifest()
         try:
             os.remove(UPDATING_FLAG)
         except OSError:
@@ -346,8 +666,6 @@ def main():
             # never reached
 
     # 4. Hand off to the updatable OS — free bootstrapper-only modules first
-    import sys
-    import gc
     for mod in ("ecdsa_p256", "uhashlib",
                  "cosmic", "galactic", "stellar", "picographics"):
         try:
@@ -357,7 +675,21 @@ def main():
     gc.collect()
 
     print("[BOOT] Launching SpaceOS...")
-    import app
+    try:
+        app = _import_app()
+    except ValueError as e:
+        if "mpy" not in str(e):
+            raise
+        # "incompatible .mpy file": MicroPython was reflashed with another
+        # bytecode version. Ask the server for every module again, for this
+        # ABI, on the next boot.
+        print(f"[BOOT] Installed modules do not load ({e}) — repairing on next boot")
+        _remove_manifest()
+        _write_os_hash("")
+        with open(REPAIR_FLAG, "w") as f:
+            f.write("1")
+        time.sleep(5)
+        machine.reset()
     app.run()
 
 
@@ -3,6 +3,7 @@ import time
 import gc
 
 import config
+from space_pack import IndexedPack, FRAME_DELTA
 
 
 # Hardware references (set by main.py after board detection)
@@ -20,6 +21,11 @@ _anim_last_frame = 0    # ticks_ms of last frame render
 _anim_loops = 0         # number of completed loops
 _anim_active = False     # whether an animation is playing
 
+# What the display buffer currently holds, so delta frames can be applied
+# in place. Reset whenever anything else draws to the display.
+_shown_pack = None
+_shown_frame = -1
+
 
 def init(unicorn, graphics):
     """Initialize with hardware references."""
@@ -33,7 +39,8 @@ def render_frame(pixel_data, width, height, frame_index=0):
     Render a single frame of RGB888 pixel data to the display.
 
     Args:
-        pixel_data: Raw bytes (R,G,B per pixel, all frames concatenated)
+        pixel_data: Raw bytes (R,G,B per pixel, all frames concatenated),
+                    or an IndexedPack for SP v2 content
         width: Frame width in pixels
         height: Frame height in pixels
         frame_index: Which frame to render (0-based)
@@ -42,6 +49,11 @@ def render_frame(pixel_data, width, height, frame_index=0):
         print("[PLAYER] No graphics/unicorn reference!")
         return
 
+    if isinstance(pixel_data, IndexedPack):
+        _render_indexed(pixel_data, width, height, frame_index)
+        return
+    _forget_shown()
+
     frame_size = width * height * 3
     offset = frame_index * frame_size
 
@@ -76,6 +88,116 @@ def render_frame(pixel_data, width, height, frame_index=0):
     gc.collect()
 
 
+def _pens_for(pack):
+    """Create one pen per palette entry, once per pack. Black maps to None (skipped)."""
+    if pack.pens is None:
+        pack.pens = [
+            _graphics.create_pen(r, g, b) if (r or g or b) else None
+            for r, g, b in pack.palette()
+        ]
+    return pack.pens
+
+
+def _forget_shown():
+    global _shown_pack, _shown_frame
+    _shown_pack = None
+    _shown_frame = -1
+
+
+def _draw_keyframe(pack, width, height, start, end):
+    """Clear and draw a full indexed frame (packed or RLE) into the buffer."""
+    pens = _pens_for(pack)
+    data = pack.data
+
+    _graphics.set_pen(_graphics.create_pen(0, 0, 0))
+    _graphics.clear()
+
+    total = width * height
+    if pack.rle:
+        # Runs are drawn as horizontal spans, split where they wrap a row
+        pos = 0
+        for ptr in range(start, end - 1, 2):
+            run = data[ptr]
+            pen = pens[data[ptr + 1]]
+            if pen is not None:
+                _graphics.set_pen(pen)
+                p = pos
+                stop = min(pos + run, total)
+                while p < stop:
+                    y = p // width
+                    x = p - y * width
+                    span = min(width - x, stop - p)
+                    _graphics.pixel_span(x, y, span)
+                    p += span
+            pos += run
+    else:
+        last_pen = None
+        for p in range(total):
+            if pack.bits == 8:
+                index = data[start + p]
+            else:
+                byte = data[start + (p >> 1)]
+                index = byte & 0x0F if p & 1 else byte >> 4
+            pen = pens[index]
+            if pen is not None:
+                if pen is not last_pen:
+                    _graphics.set_pen(pen)
+                    last_pen = pen
+                _graphics.pixel(p % width, p // width)
+
+
+def _apply_delta(pack, width, start):
+    """Draw only the pixels a FRAME_DELTA frame changes (start is past the type byte)."""
+    pens = _pens_for(pack)
+    data = pack.data
+    black = None
+    count = (data[start] << 8) | data[start + 1]
+    ptr = start + 2
+    for _ in range(count):
+        pixel = (data[ptr] << 8) | data[ptr + 1]
+        pen = pens[data[ptr + 2]]
+        if pen is None:
+            if black is None:
+                black = _graphics.create_pen(0, 0, 0)
+            pen = black
+        _graphics.set_pen(pen)
+        _graphics.pixel(pixel % width, pixel // width)
+        ptr += 3
+
+
+def _render_indexed(pack, width, height, frame_index):
+    """
+    Render one frame of an SP v2 pack (palette-indexed, packed or RLE).
+
+    Delta frames are applied in place when the display already shows the
+    previous frame of the same pack; otherwise the nearest keyframe is drawn
+    and the deltas up to frame_index are replayed before the single update().
+    """
+    global _shown_pack, _shown_frame
+
+    if frame_index >= pack.frames:
+        print(f"[PLAYER] Frame {frame_index} out of range ({pack.frames} frames)")
+        return
+
+    if pack.frame_kind(frame_index) == FRAME_DELTA and _shown_pack is pack and _shown_frame == frame_index - 1:
+        _apply_delta(pack, width, pack.frame_bounds(frame_index)[0] + 1)
+    else:
+        key = frame_index
+        while key > 0 and pack.frame_kind(key) == FRAME_DELTA:
+            key -= 1
+        start, end = pack.frame_bounds(key)
+        if pack.delta:
+            start += 1
+        _draw_keyframe(pack, width, height, start, end)
+        for i in range(key + 1, frame_index + 1):
+            _apply_delta(pack, width, pack.frame_bounds(i)[0] + 1)
+
+    _shown_pack = pack
+    _shown_frame = frame_index
+    _unicorn.update(_graphics)
+    gc.collect()
+
+
 def start_animation(pixel_data, width, height, total_frames, fps):
     """
     Begin non-blocking animation playback. Call tick() in the main loop
@@ -200,6 +322,7 @@ def show_warp_animation(width, height, duration_ms=2000):
 
     import random
 
+    _forget_shown()
     start = time.ticks_ms()
     stars = [(random.randint(0, width - 1), random.randint(0, height - 1)) for _ in range(15)]
 
@@ -236,6 +359,7 @@ def clear_display():
     _anim_active = False
     if not _graphics or not _unicorn:
         return
+    _forget_shown()
     _graphics.set_pen(_graphics.create_pen(0, 0, 0))
     _graphics.clear()
     _unicorn.update(_graphics)
@@ -271,6 +395,7 @@ def render_settings_screen(width, height, item_name, value_str):
 
     global _anim_active
     _anim_active = False
+    _forget_shown()
 
     _graphics.set_pen(_graphics.create_pen(0, 0, 0))
     _graphics.clear()
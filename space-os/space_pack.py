@@ -3,9 +3,11 @@ import os
 import struct
 import json
 import gc
+import binascii
 import urequests
 
 import config
+import board_auth
 
 
 # SP binary format offsets:
@@ -15,6 +17,80 @@ import config
 # 20:  Pixel length (4 bytes, uint32)
 # 24:  Metadata (variable, JSON string)
 # End: Pixel data (variable, raw RGB888)
+#
+# SP v2 (magic "S2") keeps the header; metadata adds format/colors/bits/rle
+# and pixel data is palette-indexed:
+#   palette (colors * 3B RGB) | frame offsets (frames * uint32) | frames
+# Each frame is packed indices (4-bit high nibble first, or 8-bit) or
+# (run, index) byte pairs when rle is set. With delta set, each frame starts
+# with a type byte: FRAME_KEY + a full frame, or FRAME_DELTA + uint16 count
+# + count * (uint16 pixel, uint8 palette index) changes since the previous
+# frame. We ask for v=3 (indexed + delta) via Accept; the server may still
+# answer v1 (e.g. art with more than 256 colours).
+
+ACCEPT = "application/vnd.spaceos.space-pack; v=3"
+FRAME_KEY = 0
+FRAME_DELTA = 1
+_MAGICS = (b"SP", b"S2")
+_CHUNK = 4096
+_PACK_KEYS = ("format", "colors", "bits", "rle", "delta")
+
+
+def _headers():
+    headers = board_auth.headers()
+    headers["Accept"] = ACCEPT
+    return headers
+
+
+def _pack_info(meta):
+    """Format fields to persist alongside a v2 pack (empty for v1)."""
+    if meta.get("format", 1) < 2:
+        return {}
+    return {key: meta[key] for key in _PACK_KEYS if key in meta}
+
+
+class IndexedPack:
+    """A stored SP v2 body, decoded lazily one frame at a time by player.py."""
+
+    def __init__(self, data, info, frames):
+        self.data = data
+        self.colors = info.get("colors", 0)
+        self.bits = info.get("bits", 8)
+        self.rle = info.get("rle", False)
+        self.delta = info.get("delta", False)
+        self.frames = max(frames, 1)
+        self.pens = None  # filled in by player on first render
+
+        palette_len = self.colors * 3
+        self._offsets_at = palette_len
+        self._frames_at = palette_len + self.frames * 4
+
+    def palette(self):
+        data = self.data
+        return [(data[i], data[i + 1], data[i + 2]) for i in range(0, self.colors * 3, 3)]
+
+    def frame_kind(self, frame_index):
+        """FRAME_KEY or FRAME_DELTA (always FRAME_KEY for non-delta packs)."""
+        if not self.delta:
+            return FRAME_KEY
+        return self.data[self.frame_bounds(frame_index)[0]]
+
+    def frame_bounds(self, frame_index):
+        """(start, end) byte range of frame_index within data (including any type byte)."""
+        at = self._offsets_at + frame_index * 4
+        start = self._frames_at + struct.unpack(">I", self.data[at:at + 4])[0]
+        if frame_index + 1 < self.frames:
+            end = self._frames_at + struct.unpack(">I", self.data[at + 4:at + 8])[0]
+        else:
+            end = len(self.data)
+        return start, end
+
+
+def load(pixel_data, metadata):
+    """Wrap stored pixel bytes for player: IndexedPack for v2, raw bytes for v1."""
+    if metadata.get("format", 1) >= 2:
+        return IndexedPack(pixel_data, metadata, metadata.get("frames", 1))
+    return pixel_data
 
 
 def download(message_id):
@@ -22,14 +98,11 @@ def download(message_id):
     Download a Space Pack from the server.
 
     Returns:
-        dict with keys: message_id, sender, fps, is_anim, pixel_data
+        dict with keys: message_id, sender, fps, is_anim, pack, pixel_data
         or None on failure
     """
     url = f"{config.API_URL}/app/space-pack/{message_id}"
-    headers = {
-        "X-Board-Id": config.BOARD_ID,
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-    }
+    headers = _headers()
 
     print(f"[HTTP] GET {url}")
 
@@ -40,6 +113,8 @@ def download(message_id):
 
         if response.status_code != 200:
             print(f"[HTTP] Body: {response.text[:200]}")
+            if response.status_code == 401:
+                board_auth.invalidate()
             response.close()
             return None
 
@@ -63,8 +138,9 @@ def parse(data):
     Parse a Space Pack binary blob.
 
     Returns:
-        dict with keys: message_id, sender, fps, is_anim, pixel_data
-        or None on failure
+        dict with keys: message_id, sender, fps, is_anim, pack, pixel_data
+        or None on failure. pack holds the v2 format fields (empty for v1);
+        merge it into the stored metadata so load() can decode the pixels.
     """
     if len(data) < 24:
         print("[SP] Data too short for header")
@@ -72,7 +148,7 @@ def parse(data):
 
     # Check magic bytes
     magic = data[0:2]
-    if magic != b"SP":
+    if magic not in _MAGICS:
         print(f"[SP] Invalid magic: {magic}")
         return None
 
@@ -122,117 +198,360 @@ def parse(data):
         "sender": meta.get("sender", "Unknown"),
         "fps": meta.get("fps", config.DEFAULT_FPS),
         "is_anim": meta.get("is_anim", False),
+        "pack": _pack_info(meta),
         "pixel_data": pixel_data,
     }
 
 
+def _read_exact(stream, n):
+    """Read exactly n bytes from stream (fewer only at EOF)."""
+    buf = stream.read(n)
+    while buf is not None and len(buf) < n:
+        more = stream.read(n - len(buf))
+        if not more:
+            break
+        buf += more
+    return buf or b""
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _read_header(stream):
+    """
+    Read and validate the fixed header and metadata of one pack.
+    Returns (message_id, meta, meta_len, pixel_len), or None if malformed.
+    """
+    # Parse the fixed 24-byte header inline (magic + uuid + meta_len + pixel_len)
+    header = _read_exact(stream, 24)
+    if len(header) < 24:
+        print(f"[SP] Short header ({len(header)} bytes)")
+        return None
+
+    if header[:2] not in _MAGICS:
+        print(f"[SP] Invalid magic: {header[:2]}")
+        return None
+
+    raw_uuid = header[2:18]
+    uid_hex = "".join("{:02x}".format(b) for b in raw_uuid)
+    msg_id = f"{uid_hex[:8]}-{uid_hex[8:12]}-{uid_hex[12:16]}-{uid_hex[16:20]}-{uid_hex[20:]}"
+
+    meta_len = struct.unpack(">H", header[18:20])[0]
+    pixel_len = struct.unpack(">I", header[20:24])[0]
+
+    # Read metadata JSON (a few hundred bytes, plus chunk CRCs for big packs)
+    meta_bytes = _read_exact(stream, meta_len)
+    if len(meta_bytes) < meta_len:
+        print(f"[SP] Short metadata ({len(meta_bytes)}/{meta_len})")
+        return None
+
+    try:
+        meta = json.loads(meta_bytes)
+    except Exception as e:
+        print(f"[SP] Metadata parse error: {e}")
+        return None
+
+    gc.collect()
+    return msg_id, meta, meta_len, pixel_len
+
+
+def _copy_to(stream, f, remaining):
+    """Stream up to remaining bytes into f, one chunk at a time. Returns bytes still missing."""
+    while remaining > 0:
+        chunk = stream.read(min(_CHUNK, remaining))
+        if not chunk:
+            break
+        f.write(chunk)
+        remaining -= len(chunk)
+        gc.collect()
+    return remaining
+
+
+def _result(msg_id, meta):
+    return {
+        "message_id": msg_id,
+        "sender": meta.get("sender", "Unknown"),
+        "fps": meta.get("fps", config.DEFAULT_FPS),
+        "is_anim": meta.get("is_anim", False),
+        "pack": _pack_info(meta),
+    }
+
+
+def _read_pack(stream, pixel_out_path):
+    """
+    Read one Space Pack from stream, writing its pixel data to pixel_out_path.
+
+    Returns a metadata dict (without pixel_data), or None on a malformed or
+    truncated pack (pixel_out_path is removed). Does not close stream.
+    """
+    parsed = _read_header(stream)
+    if parsed is None:
+        return None
+    msg_id, meta, _, pixel_len = parsed
+
+    # Stream pixel data directly to flash — never held in RAM beyond one chunk
+    try:
+        with open(pixel_out_path, "wb") as f:
+            remaining = _copy_to(stream, f, pixel_len)
+    except Exception as e:
+        print(f"[SP] Pixel stream error: {e}")
+        _remove(pixel_out_path)
+        return None
+
+    if remaining > 0:
+        print(f"[SP] Incomplete pixel data ({remaining} bytes missing)")
+        _remove(pixel_out_path)
+        return None
+
+    print(
+        f"[SP] Streamed OK: id={msg_id[:12]}... sender={meta.get('sender', '?')} {pixel_len}B pixels"
+    )
+    gc.collect()
+    return _result(msg_id, meta)
+
+
+# =============================================================================
+# Resumable single downloads
+# =============================================================================
+# Pixel data is streamed to /sp-<id>.part with the pack header kept in
+# /sp-<id>.json (ETag, metadata, pixel offset). An interrupted download keeps
+# both and resumes with Range + If-Range; once complete, each chunk is checked
+# against the CRCs in the metadata and only corrupt chunks are refetched.
+
+def _part_paths(message_id):
+    return f"/sp-{message_id}.part", f"/sp-{message_id}.json"
+
+
+def _file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+
+def _load_state(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _header_value(response, name):
+    """Case-insensitive response header lookup (urequests keeps server casing)."""
+    headers = getattr(response, "headers", None) or {}
+    name = name.lower()
+    for key in headers:
+        if key.lower() == name:
+            return headers[key]
+    return None
+
+
+def discard_partial(message_id):
+    """Delete any partial download state for message_id."""
+    part_path, state_path = _part_paths(message_id)
+    _remove(part_path)
+    _remove(state_path)
+
+
+def _bad_chunks(part_path, meta):
+    """Indices of pixel chunks whose CRC does not match (empty if no CRCs sent)."""
+    crcs = meta.get("crc")
+    chunk_size = meta.get("chunk")
+    if not crcs or not chunk_size or not hasattr(binascii, "crc32"):
+        return []
+    bad = []
+    with open(part_path, "rb") as f:
+        for index, expected in enumerate(crcs):
+            data = f.read(chunk_size)
+            if binascii.crc32(data) & 0xFFFFFFFF != expected:
+                bad.append(index)
+            gc.collect()
+    return bad
+
+
+def _refetch_chunk(url, state, part_path, index):
+    """Re-download one pixel chunk with a Range request and patch it in place."""
+    chunk_size = state["meta"]["chunk"]
+    start = index * chunk_size
+    end = min(start + chunk_size, state["pixel_len"]) - 1
+    headers = _headers()
+    headers["Range"] = f"bytes={state['pixel_start'] + start}-{state['pixel_start'] + end}"
+    headers["If-Range"] = state["etag"]
+
+    print(f"[SP] Refetching chunk {index} ({end - start + 1}B)")
+    response = urequests.get(url, headers=headers)
+    try:
+        if response.status_code != 206:
+            print(f"[SP] Chunk refetch got {response.status_code}")
+            return False
+        data = _read_exact(response.raw, end - start + 1)
+    finally:
+        response.raw.close()
+
+    if len(data) != end - start + 1:
+        return False
+    with open(part_path, "r+b") as f:
+        f.seek(start)
+        f.write(data)
+    return True
+
+
 def download_streaming(message_id, pixel_out_path):
     """
     Download a Space Pack, streaming pixel data directly to pixel_out_path.
 
     Avoids the large RAM allocation that download() requires — safe for files
-    that exceed free heap (anything over ~150 KB on the Pico).
+    that exceed free heap (anything over ~150 KB on the Pico). An interrupted
+    download is resumed from where it stopped on the next call.
 
     Returns a metadata dict (without pixel_data) on success, or None on failure.
-    The caller is responsible for cleaning up pixel_out_path on failure.
     """
     url = f"{config.API_URL}/app/space-pack/{message_id}"
-    headers = {
-        "X-Board-Id": config.BOARD_ID,
-        "X-Board-Secret": config.BOARD_SECRET_KEY,
-    }
+    part_path, state_path = _part_paths(message_id)
+    state = _load_state(state_path)
+    have = _file_size(part_path) if state else 0
 
-    _CHUNK = 4096
+    headers = _headers()
+    if state and have and state.get("etag"):
+        headers["Range"] = f"bytes={state['pixel_start'] + have}-"
+        headers["If-Range"] = state["etag"]
 
-    print(f"[HTTP] GET {url}")
+    print(f"[HTTP] GET {url}" + (f" (resume at {have}B)" if "Range" in headers else ""))
     try:
         response = urequests.get(url, headers=headers)
+    except Exception as e:
+        print(f"[HTTP] GET {url} EXCEPTION: {e}")
+        return None
 
-        if response.status_code != 200:
+    remaining = -1
+    try:
+        if response.status_code == 206 and state:
+            with open(part_path, "ab") as f:
+                remaining = _copy_to(response.raw, f, state["pixel_len"] - have)
+        elif response.status_code == 200:
+            # Fresh download (or the pack changed and If-Range did not match)
+            parsed = _read_header(response.raw)
+            if parsed is None:
+                discard_partial(message_id)
+                return None
+            msg_id, meta, meta_len, pixel_len = parsed
+            state = {
+                "etag": _header_value(response, "ETag"),
+                "msg_id": msg_id,
+                "meta": meta,
+                "pixel_start": 24 + meta_len,
+                "pixel_len": pixel_len,
+            }
+            with open(state_path, "w") as f:
+                json.dump(state, f)
+            with open(part_path, "wb") as f:
+                remaining = _copy_to(response.raw, f, pixel_len)
+        else:
             print(f"[HTTP] {response.status_code}")
-            response.raw.close()
-            return None
-
-        # Parse the fixed 24-byte header inline (magic + uuid + meta_len + pixel_len)
-        header = response.raw.read(24)
-        if len(header) < 24:
-            print(f"[SP] Short header ({len(header)} bytes)")
-            response.raw.close()
-            return None
-
-        if header[:2] != b"SP":
-            print(f"[SP] Invalid magic: {header[:2]}")
-            response.raw.close()
+            if response.status_code == 401:
+                board_auth.invalidate()
+            elif response.status_code == 416:
+                discard_partial(message_id)
             return None
+    except Exception as e:
+        print(f"[SP] Pixel stream error: {e}")
+        return None
+    finally:
+        response.raw.close()
 
-        raw_uuid = header[2:18]
-        uid_hex = "".join("{:02x}".format(b) for b in raw_uuid)
-        msg_id = f"{uid_hex[:8]}-{uid_hex[8:12]}-{uid_hex[12:16]}-{uid_hex[16:20]}-{uid_hex[20:]}"
+    if remaining != 0:
+        print(f"[SP] Interrupted; {_file_size(part_path)}B kept for resume")
+        return None
 
-        meta_len = struct.unpack(">H", header[18:20])[0]
-        pixel_len = struct.unpack(">I", header[20:24])[0]
+    try:
+        bad = _bad_chunks(part_path, state["meta"])
+        if bad and state.get("etag"):
+            for index in bad:
+                _refetch_chunk(url, state, part_path, index)
+            bad = _bad_chunks(part_path, state["meta"])
+    except Exception as e:
+        print(f"[SP] Chunk verify error: {e}")
+        bad = [-1]
+    if bad:
+        print(f"[SP] {len(bad)} corrupt chunk(s); discarding download")
+        discard_partial(message_id)
+        return None
 
-        # Read metadata JSON (always small — a few hundred bytes at most)
-        meta_bytes = response.raw.read(meta_len)
-        if len(meta_bytes) < meta_len:
-            print(f"[SP] Short metadata ({len(meta_bytes)}/{meta_len})")
-            response.raw.close()
-            return None
+    _remove(pixel_out_path)
+    os.rename(part_path, pixel_out_path)
+    _remove(state_path)
+    print(f"[SP] Streamed OK: id={state['msg_id'][:12]}... {state['pixel_len']}B pixels")
+    gc.collect()
+    return _result(state["msg_id"], state["meta"])
 
-        try:
-            meta = json.loads(meta_bytes)
-        except Exception as e:
-            print(f"[SP] Metadata parse error: {e}")
-            response.raw.close()
-            return None
 
-        gc.collect()
+# Batch stream framing (POST /app/space-packs), one record per requested ID:
+# 0: "B" (1 byte) | 1: status (1 byte) | 2: pack length (4 bytes, uint32)
+# then pack length bytes of Space Pack (status OK only). A record with status
+# BATCH_END closes the stream.
+BATCH_OK = 0
+BATCH_NOT_FOUND = 1
+BATCH_FAILED = 2
+BATCH_END = 0xFF
 
-        # Stream pixel data directly to flash — never held in RAM beyond one chunk
-        remaining = pixel_len
-        try:
-            with open(pixel_out_path, "wb") as f:
-                while remaining > 0:
-                    chunk = response.raw.read(min(_CHUNK, remaining))
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    remaining -= len(chunk)
-                    gc.collect()
-        except Exception as e:
-            print(f"[SP] Pixel stream error: {e}")
-            response.raw.close()
-            try:
-                os.remove(pixel_out_path)
-            except OSError:
-                pass
-            return None
 
-        response.raw.close()
+def download_batch(message_ids, pixel_out_path, on_pack):
+    """
+    Download several Space Packs over one connection.
 
-        if remaining > 0:
-            print(f"[SP] Incomplete pixel data ({remaining} bytes missing)")
-            try:
-                os.remove(pixel_out_path)
-            except OSError:
-                pass
-            return None
+    Each pack's pixel data is streamed to pixel_out_path, then on_pack(sp) is
+    called with its metadata dict; on_pack must move the file away (e.g. via
+    storage.save_message_from_file) before the next pack overwrites it.
 
-        print(
-            f"[SP] Streamed OK: id={msg_id[:12]}... sender={meta.get('sender', '?')} {pixel_len}B pixels"
-        )
-        gc.collect()
-        return {
-            "message_id": msg_id,
-            "sender": meta.get("sender", "Unknown"),
-            "fps": meta.get("fps", config.DEFAULT_FPS),
-            "is_anim": meta.get("is_anim", False),
-        }
+    Returns the set of message IDs that were delivered. IDs not in the set
+    (not found, server-side failure, or a dropped connection) can be retried.
+    """
+    url = f"{config.API_URL}/app/space-packs"
+    headers = _headers()
+    headers["Content-Type"] = "application/json"
+    payload = json.dumps({"ids": message_ids})
 
+    delivered = set()
+    print(f"[HTTP] POST {url} ({len(message_ids)} packs)")
+    try:
+        response = urequests.post(url, headers=headers, data=payload)
+        if response.status_code != 200:
+            print(f"[HTTP] {response.status_code}")
+            if response.status_code == 401:
+                board_auth.invalidate()
+            response.raw.close()
+            return delivered
+
+        raw = response.raw
+        while True:
+            record = _read_exact(raw, 6)
+            if len(record) < 6 or record[0:1] != b"B":
+                print("[SP] Batch stream ended unexpectedly")
+                break
+            status = record[1]
+            pack_len = struct.unpack(">I", record[2:6])[0]
+            if status == BATCH_END:
+                break
+            if status != BATCH_OK:
+                print(f"[SP] Batch item skipped (status {status})")
+                continue
+
+            sp = _read_pack(raw, pixel_out_path)
+            if sp is None:
+                # Framing is lost once a pack is short; stop and retry later
+                break
+            on_pack(sp)
+            discard_partial(sp["message_id"])
+            delivered.add(sp["message_id"])
+
+        raw.close()
     except Exception as e:
-        print(f"[HTTP] GET {url} EXCEPTION: {e}")
-        try:
-            os.remove(pixel_out_path)
-        except OSError:
-            pass
-        return None
+        print(f"[HTTP] POST {url} EXCEPTION: {e}")
+        _remove(pixel_out_path)
+
+    return delivered